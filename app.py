@@ -26,11 +26,23 @@ from src.instagram.describe_video_tool import VideoDescriber  # Importar a class
 from src.instagram.describe_carousel_tool import CarouselDescriber  # Importar a classe CarouselDescriber
 from src.instagram.crew_post_instagram import InstagramPostCrew  # Importar a classe InstagramPostCrew
 from src.instagram.image_validator import InstagramImageValidator  # Add this import
+from src.instagram.http_pool import http_pool
+from src.instagram.container_poller import container_poller
+from src.instagram.service_registry import service_registry, token_cache
+from src.instagram.request_pacer import request_pacer
+from src.instagram.pending_publisher import pending_publisher
+from src.instagram.accounts import accounts
+from src.instagram.media_host import media_host
 from src.services.post_notification import PostCompletionNotifier
 from src.services.post_queue import post_queue
+from src.services.job_dedup import job_dedup
+from src.services.admission import admission_controller, AdmissionRejected
 
 app = Flask(__name__)
 
+# O controle de admissão acompanha a profundidade da fila e o término dos trabalhos
+admission_controller.start(post_queue)
+
 # Initialize required directories
 os.makedirs(os.path.join(Paths.ROOT_DIR, "temp_videos"), exist_ok=True)
 os.makedirs(os.path.join(Paths.ROOT_DIR, "temp"), exist_ok=True)
@@ -50,11 +62,41 @@ if not os.path.exists(border_image_path):
 # Variáveis de estado para o modo carrossel
 is_carousel_mode = False
 carousel_images = []
+carousel_hashes = set()  # Hashes das imagens do carrossel atual, para ignorar reenvios
+carousel_tickets = []  # Reservas de admissão das imagens do carrossel atual
 carousel_start_time = 0
 carousel_caption = ""
 CAROUSEL_TIMEOUT = 300  # 5 minutos em segundos
 MAX_CAROUSEL_IMAGES = 10
 
+def find_duplicate_job(dedup_keys):
+    """
+    Retorna o trabalho já criado para a mesma mídia ou mensagem dentro da
+    janela de deduplicação (retentativas do webhook ou reenvio da mesma foto)
+    """
+    job_id = job_dedup.lookup(dedup_keys)
+    if not job_id:
+        return None
+    status = InstagramSend.check_post_status(job_id).get("status")
+    if status in (None, "failed", "rate_limited", "policy_violation"):
+        # O trabalho anterior falhou: permitir um novo envio
+        job_dedup.forget(dedup_keys)
+        return None
+    return job_id
+
+def reject_admission(msg, error):
+    """Resposta do webhook para mensagens recusadas pelo controle de admissão"""
+    sender.send_text(number=msg.remote_jid, 
+                    msg=f"⏳ {error}. Tente novamente em {error.retry_after} segundos.")
+    response = jsonify({"error": str(error), "reason": error.reason, "retry_after": error.retry_after})
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response, error.status_code
+
+def release_carousel_tickets():
+    """Libera as reservas de admissão das imagens de um carrossel descartado"""
+    admission_controller.release(*carousel_tickets)
+    carousel_tickets.clear()
+
 @app.route("/messages-upsert", methods=['POST'])
 def webhook():
     global is_carousel_mode, carousel_images, carousel_start_time, carousel_caption
@@ -66,9 +108,12 @@ def webhook():
         texto = msg.get_text()
         
         #Verificar se o número é de um grupo valido.
+        account = None  # Conta padrão
         if msg.scope == Message.SCOPE_GROUP:
             print(f"Grupo: {msg.group_id}")
-            if str(msg.group_id) != "120363383673368986":  #Use != para a comparação, e a string correta.
+            # Grupos configurados em INSTAGRAM_<CONTA>_GROUP postam na conta correspondente
+            account = accounts.for_group(msg.group_id)
+            if str(msg.group_id) != "120363383673368986" and account is None:  #Use != para a comparação, e a string correta.
                 return jsonify({"status": "processed, but ignored"}), 200 #Retorna 200 para o webhook não reenviar.
         
         # Lógica do Modo Carrossel
@@ -77,6 +122,8 @@ def webhook():
         if carousel_command:
             is_carousel_mode = True
             carousel_images = []
+            carousel_hashes.clear()
+            release_carousel_tickets()
             carousel_caption = carousel_command.group(1).strip() if carousel_command.group(1) else ""
             carousel_start_time = time.time()
             
@@ -105,8 +152,22 @@ def webhook():
                                     msg=f"⚠️ Limite máximo de {MAX_CAROUSEL_IMAGES} imagens atingido! Envie \"postar\" para publicar.")
                     return jsonify({"status": "max images reached"}), 200
                     
-                image_path = ImageDecodeSaver.process(msg.image_base64)
+                try:
+                    ticket = admission_controller.admit(msg.remote_jid, 
+                                                        admission_controller.estimate_size(msg.image_base64), job=False)
+                except AdmissionRejected as e:
+                    return reject_admission(msg, e)
+                
+                image_data = ImageDecodeSaver.decode(msg.image_base64)
+                image_hash = job_dedup.keys_for(image_data)[0]
+                if image_hash in carousel_hashes:
+                    admission_controller.release(ticket)
+                    return jsonify({"status": "duplicate image ignored"}), 200
+                
+                image_path = ImageDecodeSaver.save(image_data)
                 carousel_images.append(image_path)
+                carousel_hashes.add(image_hash)
+                carousel_tickets.append(ticket)
                 
                 # Verificar se já temos pelo menos 2 imagens para habilitar o comando "postar"
                 if len(carousel_images) >= 2:
@@ -138,6 +199,12 @@ def webhook():
                                         f"Você tem apenas {len(carousel_images)} imagem.")
                     return jsonify({"status": "not enough images"}), 200
                 
+                # As imagens continuam no carrossel se a fila estiver cheia
+                try:
+                    job_ticket = admission_controller.admit(msg.remote_jid)
+                except AdmissionRejected as e:
+                    return reject_admission(msg, e)
+                
                 try:
                     # Validar as imagens segundo os requisitos do Instagram
                     is_valid, validation_msg = InstagramImageValidator.validate_for_carousel(carousel_images)
@@ -192,8 +259,11 @@ def webhook():
                             bordered_images.append(image_path)  # Usar a imagem original em caso de erro
                     
                     # Enfileirar o carrossel para publicação
-                    job_inputs = {'remote_jid': msg.remote_jid}
+                    job_inputs = {'remote_jid': msg.remote_jid, 'account': account}
                     job_id = InstagramSend.queue_carousel(bordered_images, caption_to_use, job_inputs)
+                    admission_controller.bind(job_id, job_ticket, *carousel_tickets)
+                    carousel_tickets.clear()
+                    job_ticket = None
                     
                     sender.send_text(number=msg.remote_jid, 
                                     msg=f"✅ Carrossel enfileirado com sucesso!\n"
@@ -223,8 +293,12 @@ def webhook():
                                     msg=f"❌ Erro ao enfileirar carrossel: {str(e)}")
                     return jsonify({"status": "error", "message": "Erro ao enfileirar carrossel"}), 500
                 finally:
+                    if job_ticket:
+                        admission_controller.release(job_ticket)
                     is_carousel_mode = False  # Resetar o modo carrossel
                     carousel_images = []
+                    carousel_hashes.clear()
+                    release_carousel_tickets()
                     carousel_caption = ""
                 return jsonify({"status": "Carrossel processado e enfileirado"}), 200
 
@@ -232,6 +306,8 @@ def webhook():
             elif texto and texto.lower() == "cancelar":
                 is_carousel_mode = False
                 carousel_images = []
+                carousel_hashes.clear()
+                release_carousel_tickets()
                 carousel_caption = ""
                 sender.send_text(number=msg.remote_jid, 
                                 msg="🚫 Modo carrossel cancelado. Todas as imagens foram descartadas.")
@@ -242,6 +318,8 @@ def webhook():
                 # Timeout, sair do modo carrossel
                 is_carousel_mode = False
                 carousel_images = []
+                carousel_hashes.clear()
+                release_carousel_tickets()
                 carousel_caption = ""
                 sender.send_text(number=msg.remote_jid, 
                                 msg="⏱️ Timeout do carrossel. Envie 'carrossel' novamente para iniciar.")
@@ -302,13 +380,32 @@ def webhook():
 
         # Processamento de Imagem Única
         if msg.message_type == msg.TYPE_IMAGE:
+            # Reservar espaço antes de decodificar e gravar a mídia
+            try:
+                ticket = admission_controller.admit(msg.remote_jid, admission_controller.estimate_size(msg.image_base64))
+            except AdmissionRejected as e:
+                return reject_admission(msg, e)
+            
             try:
-                image_path = ImageDecodeSaver.process(msg.image_base64)
+                image_data = ImageDecodeSaver.decode(msg.image_base64)
+                
+                # Reenvios da mesma imagem reutilizam o trabalho existente
+                dedup_keys = job_dedup.keys_for(image_data, msg.message_id)
+                duplicate_job = find_duplicate_job(dedup_keys)
+                if duplicate_job:
+                    sender.send_text(number=msg.remote_jid, 
+                                    msg=f"ℹ️ Esta imagem já foi recebida.\nID do trabalho: {duplicate_job}")
+                    return jsonify({"status": "duplicate", "job_id": duplicate_job}), 200
+                
+                image_path = ImageDecodeSaver.save(image_data)
                 caption = msg.image_caption if msg.image_caption else ""  # Usar a legenda da imagem, se houver
 
                 # Enfileirar a postagem da foto
-                job_inputs = {'remote_jid': msg.remote_jid}
+                job_inputs = {'remote_jid': msg.remote_jid, 'account': account}
                 job_id = InstagramSend.queue_post(image_path, caption, job_inputs)
+                admission_controller.bind(job_id, ticket)
+                ticket = None
+                job_dedup.remember(job_id, dedup_keys)
                 sender.send_text(number=msg.remote_jid, msg=f"✅ Postagem de imagem enfileirada com sucesso!\nID do trabalho: {job_id}")
                 
                 # Verificar o status do trabalho após enfileiramento
@@ -341,12 +438,32 @@ def webhook():
             except Exception as e:
                 sender.send_text(number=msg.remote_jid, msg=f"❌ Erro no processamento do post: {str(e)}")
                 return jsonify({"error": "Erro no processamento do post"}), 500
+            finally:
+                # Mídia duplicada ou falha ao enfileirar: liberar a reserva
+                if ticket:
+                    admission_controller.release(ticket)
 
         # Processamento de Vídeo (Reels)
         elif msg.message_type == msg.TYPE_VIDEO:
+            # Reservar espaço antes de decodificar e gravar a mídia
+            try:
+                ticket = admission_controller.admit(msg.remote_jid, admission_controller.estimate_size(msg.video_base64))
+            except AdmissionRejected as e:
+                return reject_admission(msg, e)
+            
             try:
                 # 1. Decodificar e salvar o vídeo
-                video_path = VideoDecodeSaver.process(msg.video_base64)
+                video_data = VideoDecodeSaver.decode(msg.video_base64)
+                
+                # Reenvios do mesmo vídeo reutilizam o trabalho existente
+                dedup_keys = job_dedup.keys_for(video_data, msg.message_id)
+                duplicate_job = find_duplicate_job(dedup_keys)
+                if duplicate_job:
+                    sender.send_text(number=msg.remote_jid, 
+                                    msg=f"ℹ️ Este vídeo já foi recebido.\nID do trabalho: {duplicate_job}")
+                    return jsonify({"status": "duplicate", "job_id": duplicate_job}), 200
+                
+                video_path = VideoDecodeSaver.save(video_data)
                 caption = msg.video_caption if msg.video_caption else ""
                 print(f"Caption received: {caption}")  # Debug statement
                 
@@ -373,8 +490,11 @@ def webhook():
                         caption = ""  # Usar uma legenda vazia em caso de erro
 
                 # 2. Enfileirar a postagem do Reels
-                job_inputs = {'remote_jid': msg.remote_jid}
+                job_inputs = {'remote_jid': msg.remote_jid, 'account': account}
                 job_id = InstagramSend.queue_reels(video_path, caption, job_inputs)
+                admission_controller.bind(job_id, ticket)
+                ticket = None
+                job_dedup.remember(job_id, dedup_keys)
                 sender.send_text(number=msg.remote_jid, msg=f"✅ Reels enfileirado com sucesso! ID do trabalho: {job_id}")
                 
                 # 3. Verificar o status do trabalho após enfileiramento
@@ -408,6 +528,9 @@ def webhook():
                 sender.send_text(number=msg.remote_jid, msg=f"❌ Erro ao enfileirar Reels: {str(e)}")
                 traceback.print_exc()
                 return jsonify({"error": "Erro ao enfileirar Reels"}), 500
+            finally:
+                if ticket:
+                    admission_controller.release(ticket)
             
     except Exception as e:
         print(f"Erro no processamento do webhook: {str(e)}")
@@ -428,6 +551,12 @@ def status():
         return jsonify({
             "status": "online",
             "queue": stats,
+            "http_pool": http_pool.get_stats(),
+            "container_poller": container_poller.get_stats(),
+            "request_pacer": request_pacer.get_stats(),
+            "pending_publisher": pending_publisher.get_stats(),
+            "accounts": accounts.names(),
+            "media_host": media_host.get_stats(),
             "recent_posts": InstagramSend.get_recent_posts(5)
         })
     except Exception as e:
@@ -515,6 +644,8 @@ def clear_carousel_cache():
         
         is_carousel_mode = False
         carousel_images = []
+        carousel_hashes.clear()
+        release_carousel_tickets()
         carousel_caption = ""
         carousel_start_time = 0
         
@@ -563,7 +694,7 @@ def check_instagram_token():
     try:
         from src.instagram.instagram_carousel_service import InstagramCarouselService
         
-        service = InstagramCarouselService()
+        service = service_registry.get(InstagramCarouselService)
         is_valid, missing_permissions = service.check_token_permissions()
         
         token = os.getenv('INSTAGRAM_API_KEY', '')
@@ -573,7 +704,8 @@ def check_instagram_token():
             "is_valid": is_valid,
             "missing_permissions": missing_permissions if not is_valid else [],
             "token": mask_token,
-            "account_id": os.getenv('INSTAGRAM_ACCOUNT_ID', 'Not set')
+            "account_id": os.getenv('INSTAGRAM_ACCOUNT_ID', 'Not set'),
+            "token_cache": token_cache.get_stats()
         }
         
         # Add extra details if the token is valid
@@ -605,7 +737,7 @@ def check_api_limits():
     try:
         from src.instagram.instagram_carousel_service import InstagramCarouselService
         
-        service = InstagramCarouselService()
+        service = service_registry.get(InstagramCarouselService)
         usage_info = service.get_app_usage_info()
         
         # Calculate time until reset if we have usage info
@@ -709,5 +841,11 @@ if __name__ == "__main__":
     # Setup notification system
     setup_notification_system()
 
+    # Publish containers left pending by rate limits in previous runs
+    pending_publisher.start()
+
+    # Serve the media of this process and of the queue workers (MEDIA_HOST=local)
+    media_host.start()
+
     # Start the main app
     app.run(host="0.0.0.0", port=5001, debug=True)
\ No newline at end of file
@@ -6,6 +6,9 @@ import psutil
 from datetime import datetime
 import logging
 import json
+from src.instagram.http_pool import http_pool
+from src.instagram.instrumentation import instrumentation
+from src.instagram.state_store import state_store
 
 # Configuração básica de logging
 logger = logging.getLogger(__name__)
@@ -53,15 +56,8 @@ def get_system_stats():
         minutes, seconds = divmod(remainder, 60)
         uptime_str = f"{int(days)}d {int(hours)}h {int(minutes)}m {int(seconds)}s"
 
-        # Load Instagram API stats
-        api_stats = {'successful_posts': 0, 'failed_posts': 0, 'rate_limited_posts': 0}
-        if os.path.exists('api_state.json'):
-            try:
-                with open('api_state.json', 'r') as f:
-                    state = json.load(f)
-                    api_stats = state.get('stats', api_stats)
-            except Exception as e:
-                logger.error(f"Error loading API stats: {e}")
+        # Estatísticas da API Instagram, lidas da memória (sem acessar api_state.json)
+        api_stats = state_store.get_stats()
 
         return {
             "cpu_percent": psutil.cpu_percent(interval=1),
@@ -102,9 +98,15 @@ def health_check():
     return jsonify({
         "status": "ok",
         "uptime": uptime_seconds,
-        "stats": stats
+        "stats": stats,
+        "http_pool": http_pool.get_stats()
     })
 
+@app.route("/api/metrics")
+def metrics():
+    """Métricas por requisição da Graph API: latência por endpoint, retries, bytes, rate limits e esperas"""
+    return jsonify(instrumentation.get_metrics())
+
 def start_monitoring_server():
     """Inicia o servidor de monitoramento em uma thread separada na porta 5501."""
     from werkzeug.serving import make_server
@@ -0,0 +1,111 @@
+import os
+import logging
+import threading
+
+logger = logging.getLogger('Accounts')
+
+class AccountDirectory:
+    """
+    Credentials of the Instagram accounts served by this process.
+
+    INSTAGRAM_ACCOUNTS lists account names ("marca_a,marca_b"); each name
+    reads INSTAGRAM_<NAME>_ACCOUNT_ID, INSTAGRAM_<NAME>_API_KEY and, optionally,
+    INSTAGRAM_<NAME>_GROUP (WhatsApp group whose messages post to it). The
+    account of INSTAGRAM_ACCOUNT_ID / INSTAGRAM_API_KEY is always included as
+    "default", so single-account deployments keep working unchanged.
+
+    Jobs refer to an account by name or IG user ID; everything downstream
+    (queue shards, rate governor, pacer, pending containers) is keyed by the
+    IG user ID. The environment is read on first use, after .env is loaded.
+    """
+
+    def __init__(self, environ=None):
+        self._environ = environ
+        self._lock = threading.Lock()
+        self._accounts = None  # ig_user_id -> {"name", "ig_user_id", "access_token", "group"}
+        self._names = {}       # name -> ig_user_id
+        self.default_id = None
+
+    def reload(self):
+        """Read the accounts from the environment again"""
+        environ = self._environ if self._environ is not None else os.environ
+        accounts, names, default_id = {}, {}, None
+
+        default_id = environ.get("INSTAGRAM_ACCOUNT_ID")
+        default_token = (environ.get("INSTAGRAM_API_KEY") or environ.get("INSTAGRAM_ACCESS_TOKEN")
+                         or environ.get("FACEBOOK_ACCESS_TOKEN"))
+        if default_id:
+            accounts[default_id] = {"name": "default", "ig_user_id": default_id,
+                                    "access_token": default_token, "group": None}
+            names["default"] = default_id
+
+        for name in (environ.get("INSTAGRAM_ACCOUNTS") or "").split(","):
+            name = name.strip()
+            if not name:
+                continue
+            prefix = f"INSTAGRAM_{name.upper()}_"
+            ig_user_id = environ.get(f"{prefix}ACCOUNT_ID")
+            access_token = environ.get(f"{prefix}API_KEY")
+            if not ig_user_id or not access_token:
+                logger.error(f"Account '{name}' ignored: set {prefix}ACCOUNT_ID and {prefix}API_KEY")
+                continue
+            accounts[ig_user_id] = {"name": name, "ig_user_id": ig_user_id,
+                                    "access_token": access_token, "group": environ.get(f"{prefix}GROUP")}
+            names[name] = ig_user_id
+            default_id = default_id or ig_user_id
+
+        with self._lock:
+            self._accounts, self._names, self.default_id = accounts, names, default_id
+        if len(accounts) > 1:
+            logger.info(f"Serving {len(accounts)} Instagram accounts: {', '.join(names)}")
+
+    def _loaded(self):
+        if self._accounts is None:
+            self.reload()
+        return self._accounts
+
+    def resolve(self, account=None):
+        """
+        Credentials of an account
+
+        Args:
+            account (str): Account name or IG user ID (default: the default account)
+
+        Returns:
+            dict: {"name", "ig_user_id", "access_token", "group"}, or None when no
+                account is configured (services then read the environment themselves)
+
+        Raises:
+            ValueError: If the account is not configured
+        """
+        accounts = self._loaded()
+        with self._lock:
+            if account is None:
+                return dict(accounts[self.default_id]) if self.default_id else None
+            ig_user_id = self._names.get(str(account), str(account))
+            if ig_user_id not in accounts:
+                raise ValueError(f"Conta do Instagram não configurada: {account}")
+            return dict(accounts[ig_user_id])
+
+    def account_id(self, account=None):
+        """IG user ID of an account name or ID (None if no account is configured)"""
+        resolved = self.resolve(account)
+        return resolved["ig_user_id"] if resolved else None
+
+    def for_group(self, group_id):
+        """Name of the account a WhatsApp group posts to (None for the default account)"""
+        accounts = self._loaded()
+        with self._lock:
+            for entry in accounts.values():
+                if entry["group"] and entry["group"] == str(group_id):
+                    return entry["name"]
+        return None
+
+    def names(self):
+        """Configured account names, for status endpoints (credentials are never exposed)"""
+        accounts = self._loaded()
+        with self._lock:
+            return {entry["name"]: ig_user_id for ig_user_id, entry in accounts.items()}
+
+# Global instance shared by the queue and the Instagram services
+accounts = AccountDirectory()
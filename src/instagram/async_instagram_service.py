@@ -0,0 +1,266 @@
+"""
+asyncio client for the Instagram Graph API.
+
+Mirrors the blocking services (BaseInstagramService and the post, reels and
+carousel services) for the container lifecycle: create, poll, publish. A
+single event loop can keep hundreds of containers in flight, since waiting
+on the API never holds a thread. Errors map to the same exceptions as the
+blocking client (see graph_api_error).
+
+Requires the optional dependency aiohttp (`pip install aiohttp`).
+"""
+import os
+import json
+import asyncio
+import logging
+import time
+import random
+from dotenv import load_dotenv
+from src.instagram.rate_governor import rate_governor
+from src.instagram.request_pacer import request_pacer
+from src.instagram.instrumentation import instrumentation
+from src.instagram.base_instagram_service import (
+    BaseInstagramService, RateLimitError, InstagramAPIError, graph_api_error
+)
+
+try:
+    import aiohttp
+except ImportError:  # Optional dependency, only needed by this client
+    aiohttp = None
+
+logger = logging.getLogger('AsyncInstagramService')
+
+class AsyncInstagramService:
+    """asyncio variant of BaseInstagramService for posts, carousels and reels"""
+
+    base_url = BaseInstagramService.base_url
+    host = BaseInstagramService.host
+    # Requests in flight at once for this client
+    MAX_CONCURRENCY = int(os.getenv("INSTAGRAM_ASYNC_CONCURRENCY", 20))
+
+    def __init__(self, access_token=None, ig_user_id=None, max_concurrency=None, session=None):
+        """
+        Args:
+            access_token (str): Graph API token (default: INSTAGRAM_API_KEY)
+            ig_user_id (str): Instagram account ID (default: INSTAGRAM_ACCOUNT_ID)
+            max_concurrency (int): Requests in flight at once (default: INSTAGRAM_ASYNC_CONCURRENCY or 20)
+            session (aiohttp.ClientSession): Session to reuse (default: one owned by this client)
+        """
+        if aiohttp is None:
+            raise ImportError("AsyncInstagramService requires aiohttp: pip install aiohttp")
+
+        load_dotenv()
+        self.access_token = access_token or os.getenv('INSTAGRAM_API_KEY')
+        self.ig_user_id = ig_user_id or os.getenv("INSTAGRAM_ACCOUNT_ID")
+        if not self.access_token or not self.ig_user_id:
+            raise ValueError(
+                "Credenciais incompletas. Defina INSTAGRAM_API_KEY e "
+                "INSTAGRAM_ACCOUNT_ID nas variáveis de ambiente ou forneça-os diretamente."
+            )
+        self.max_concurrency = max_concurrency or self.MAX_CONCURRENCY
+        self._session = session
+        self._owns_session = session is None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """Close the HTTP session if it is owned by this client"""
+        if self._session is not None and self._owns_session:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        # Created lazily so the session and the semaphore belong to the running loop
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60))
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def _make_request(self, method, endpoint, params=None, data=None):
+        """Make an API request, raising the same exceptions as BaseInstagramService._make_request"""
+        # Don't send requests the API is already known to reject
+        blocked_for = rate_governor.blocked_time(self.ig_user_id)
+        if blocked_for > 0:
+            raise RateLimitError(f"Rate limit active, retry in {blocked_for:.0f} seconds", blocked_for)
+
+        # Same pacing schedule as the blocking services for this account
+        wait = request_pacer.reserve(self.host, self.ig_user_id)
+        if wait > 0:
+            instrumentation.record_sleep('pacing', wait, self.ig_user_id)
+            await asyncio.sleep(wait)
+
+        params = dict(params or {})
+        params['access_token'] = self.access_token
+        session = self._get_session()
+
+        body = None
+        status = None
+        error = None
+        duration = None
+        started = time.time()
+        try:
+            async with self._semaphore:
+                logger.info(f"Making async {method} request to {endpoint}")
+                started = time.time()
+                async with session.request(method, f"{self.base_url}/{endpoint}", params=params, data=data) as response:
+                    if 'x-business-use-case-usage' in response.headers or 'x-app-usage' in response.headers:
+                        rate_governor.record_headers(response.headers, self.ig_user_id)
+                    body = await response.text()
+                    status = response.status
+            duration = time.time() - started
+
+            try:
+                result = json.loads(body) if body else None
+            except ValueError:
+                raise InstagramAPIError(f"Failed to parse response (HTTP {status})")
+
+            if isinstance(result, dict) and 'error' in result:
+                raise graph_api_error(result['error'], status, self.ig_user_id)
+            if status >= 400:
+                raise InstagramAPIError(f"Request failed with HTTP {status}")
+            return result
+        except aiohttp.ClientError as e:
+            logger.error(f"Request failed: {str(e)}")
+            error = InstagramAPIError(f"Request failed: {str(e)}")
+            raise error
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            instrumentation.record_request(
+                method, endpoint, duration if duration is not None else time.time() - started,
+                status=status, bytes_in=len(body or ''), error=error,
+                params=data or params, account_id=self.ig_user_id
+            )
+
+    async def _create_container(self, params):
+        result = await self._make_request('POST', f"{self.ig_user_id}/media", data=params)
+        if result and 'id' in result:
+            logger.info(f"Media container created with ID: {result['id']}")
+            return result['id']
+        logger.error(f"Failed to create media container. Response: {result}")
+        return None
+
+    async def create_media_container(self, image_url, caption):
+        """Create an image container"""
+        return await self._create_container({'image_url': image_url, 'caption': caption, 'media_type': 'IMAGE'})
+
+    async def create_reels_container(self, video_url, caption, share_to_feed=True,
+                                     audio_name=None, thumbnail_url=None, user_tags=None):
+        """Create a Reels container"""
+        params = {
+            'media_type': 'REELS',
+            'video_url': video_url,
+            'caption': caption,
+            'share_to_feed': 'true' if share_to_feed else 'false'
+        }
+        if audio_name:
+            params['audio_name'] = audio_name
+        if thumbnail_url:
+            params['thumbnail_url'] = thumbnail_url
+        if user_tags:
+            params['user_tags'] = json.dumps(user_tags)
+        return await self._create_container(params)
+
+    async def create_carousel_container(self, media_urls, caption):
+        """Create the children containers concurrently, then the carousel container"""
+        children = await asyncio.gather(*[
+            self._create_container({'image_url': url, 'media_type': 'IMAGE', 'is_carousel_item': 'true'})
+            for url in media_urls
+        ])
+        children = [child for child in children if child]
+        if len(children) < 2:
+            logger.error(f"Not enough child containers created. Found: {len(children)}, required: at least 2")
+            return None
+        return await self._create_container({
+            'media_type': 'CAROUSEL',
+            'caption': caption[:2200],  # Instagram caption limit
+            'children': ','.join(children)
+        })
+
+    async def check_container_status(self, container_id):
+        """Return the container status_code (FINISHED, IN_PROGRESS, ERROR, EXPIRED...)"""
+        result = await self._make_request('GET', container_id, params={'fields': 'status_code,status'})
+        if not result:
+            return None
+        status = result.get('status_code')
+        if status == 'ERROR' and 'status' in result:
+            logger.error(f"Container {container_id} error details: {result['status']}")
+        return status
+
+    async def wait_for_container_status(self, container_id, max_attempts=30, delay=5, max_delay=45):
+        """
+        Poll the container until it is ready, without blocking the event loop.
+        RateLimitError is raised to the caller, like in the blocking services.
+        """
+        for attempt in range(max_attempts):
+            try:
+                status = await self.check_container_status(container_id)
+            except InstagramAPIError as e:
+                logger.error(f"Error checking container status: {e}")
+                status = None
+            if status == 'FINISHED':
+                return status
+            if status in ('ERROR', 'EXPIRED'):
+                logger.error(f"Container {container_id} failed with status: {status}")
+                return status
+            await asyncio.sleep(min(delay * (1.5 ** attempt), max_delay) + random.uniform(0, 1))
+
+        logger.error(f"Container status check timed out after {max_attempts} attempts.")
+        return 'TIMEOUT'
+
+    async def publish_media(self, container_id):
+        """Publish a FINISHED container; returns the post ID"""
+        result = await self._make_request('POST', f"{self.ig_user_id}/media_publish", data={'creation_id': container_id})
+        if result and 'id' in result:
+            logger.info(f"Container {container_id} published with ID: {result['id']}")
+            return result['id']
+        logger.error(f"Could not publish container {container_id}")
+        return None
+
+    async def get_post_permalink(self, post_id):
+        """Return the permalink of a post, or None"""
+        try:
+            result = await self._make_request('GET', post_id, params={'fields': 'permalink'})
+            return result.get('permalink') if result else None
+        except Exception as e:
+            logger.error(f"Erro ao obter permalink: {e}")
+            return None
+
+    async def _finish(self, container_id, media_type):
+        status = await self.wait_for_container_status(container_id)
+        if status != 'FINISHED':
+            logger.error(f"Container {container_id} not ready. Final status: {status}")
+            return None
+        post_id = await self.publish_media(container_id)
+        if not post_id:
+            return None
+        return {
+            'id': post_id,
+            'container_id': container_id,
+            'permalink': await self.get_post_permalink(post_id),
+            'media_type': media_type
+        }
+
+    async def post_image(self, image_url, caption):
+        """Create, wait for and publish an image post"""
+        container_id = await self.create_media_container(image_url, caption)
+        return await self._finish(container_id, 'IMAGE') if container_id else None
+
+    async def post_reels(self, video_url, caption, share_to_feed=True, audio_name=None, thumbnail_url=None):
+        """Create, wait for and publish a Reels post"""
+        container_id = await self.create_reels_container(video_url, caption, share_to_feed, audio_name, thumbnail_url)
+        return await self._finish(container_id, 'REELS') if container_id else None
+
+    async def post_carousel(self, media_urls, caption):
+        """Create, wait for and publish a carousel post"""
+        if len(media_urls) < 2 or len(media_urls) > 10:
+            raise ValueError(f"Invalid number of media URLs. Found: {len(media_urls)}, required: 2-10")
+        container_id = await self.create_carousel_container(media_urls, caption)
+        return await self._finish(container_id, 'CAROUSEL_ALBUM') if container_id else None
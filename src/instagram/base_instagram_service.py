@@ -5,10 +5,14 @@ import logging
 import requests
 from datetime import datetime
 from dotenv import load_dotenv
-from urllib3.util.retry import Retry
-from requests.adapters import HTTPAdapter
 import random
 import math
+from urllib.parse import urlencode, urlparse
+from src.instagram.rate_governor import rate_governor
+from src.instagram.http_pool import http_pool
+from src.instagram.service_registry import token_cache, service_registry
+from src.instagram.request_pacer import request_pacer
+from src.instagram.instrumentation import instrumentation, redact
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -32,6 +36,8 @@ class PermissionError(Exception):
 
 class RateLimitError(Exception):
     """Raised when rate limits are hit"""
+    retriable = True  # The caller should retry after retry_seconds instead of failing
+
     def __init__(self, message, retry_seconds=300, error_code=None, error_subcode=None, fbtrace_id=None):
         self.retry_seconds = retry_seconds
         self.error_code = error_code
@@ -49,6 +55,8 @@ class MediaError(Exception):
 
 class TemporaryServerError(Exception):
     """Raised for temporary server issues"""
+    retriable = True
+
     def __init__(self, message, error_code=None, error_subcode=None, fbtrace_id=None):
         self.error_code = error_code
         self.error_subcode = error_subcode
@@ -96,30 +104,106 @@ class RateLimitHandler:
         jitter = random.uniform(0.75, 1.25)
         return delay * jitter
 
+def get_retry_after(error):
+    """Extract retry after time from a Graph API error payload"""
+    # Default retry time increased to 5 minutes for application request limit
+    retry_seconds = 300
+    
+    # Check for specific error subcodes
+    if error.get('error_subcode') == 2207051:  # Application request limit
+        retry_seconds = 900  # 15 minutes
+    
+    # Try to extract time from error message
+    message = error.get('message', '').lower()
+    if 'minutes' in message:
+        try:
+            import re
+            time_match = re.search(r'(\d+)\s*minutes?', message)
+            if time_match:
+                retry_seconds = int(time_match.group(1)) * 60
+        except:
+            pass
+    
+    return retry_seconds
+
+def register_rate_limit(retry_seconds, account_id, error_code, retry_attempt=0):
+    """
+    Record a rate limit in the governor and return the backoff for the caller.
+
+    The request is not retried here: sleeping for minutes would hold the
+    caller's thread (a queue worker), so RateLimitError is raised and the
+    queue parks the job until the returned time has passed.
+    """
+    rate_governor.record_rate_limit(retry_seconds, account_id, error_code)
+    return max(
+        RateLimitHandler.calculate_backoff_time(retry_attempt, retry_seconds),
+        rate_governor.blocked_time(account_id)
+    )
+
+def graph_api_error(error, status_code=None, account_id=None, retry_attempt=0):
+    """
+    Map a Graph API error payload to the exception taxonomy of this module.
+    Shared by the blocking and the asyncio clients; rate limits are recorded
+    in the governor.
+
+    Args:
+        error (dict): The "error" object of the response
+        status_code (int): HTTP status of the response
+        account_id (str): Instagram account the request was made for
+        retry_attempt (int): Attempt number, used for the backoff
+
+    Returns:
+        Exception: The exception to raise
+    """
+    error_code = error.get('code')
+    error_subcode = error.get('error_subcode')
+    error_message = error.get('message', '')
+    fb_trace_id = error.get('fbtrace_id')
+    
+    # Only rate limit codes make a 403 retriable; permission and OAuth 403s fail fast below
+    if status_code == 403 and (error_code in RateLimitHandler.RATE_LIMIT_CODES
+                               or error_subcode in RateLimitHandler.RATE_LIMIT_SUBCODES):
+        logger.error(f"{error_code} {error_message} (Subcode: {error_subcode})")
+        
+        # Start with 5 minutes
+        retry_seconds = register_rate_limit(300, account_id, error_code, retry_attempt)
+        if error_subcode == 2207051:
+            logger.warning(f"Application request limit reached. Retry in {retry_seconds:.0f} seconds")
+        return RateLimitError(error_message, retry_seconds, error_code, error_subcode, fb_trace_id)
+    
+    if error_code in [190, 104]:  # Token errors
+        return AuthenticationError(error_message, error_code, error_subcode, fb_trace_id)
+    elif error_code in [200, 10, 803]:  # Permission errors
+        return PermissionError(error_message, error_code, error_subcode, fb_trace_id)
+    elif RateLimitHandler.is_rate_limit_error(error_code, error_subcode):
+        retry_seconds = register_rate_limit(get_retry_after(error), account_id, error_code, retry_attempt)
+        logger.warning(f"Rate limit hit. Retry in {retry_seconds:.0f} seconds")
+        return RateLimitError(error_message, retry_seconds, error_code, error_subcode, fb_trace_id)
+    elif error_code in [1, 2]:  # Temporary server errors
+        return TemporaryServerError(error_message, error_code, error_subcode, fb_trace_id)
+    return InstagramAPIError(error_message, error_code, error_subcode, fb_trace_id)
+
 class BaseInstagramService:
     """Base class for Instagram API services with common functionality"""
     
     API_VERSION = "v22.0"  # Latest stable version
-    base_url = f"https://graph.facebook.com/{API_VERSION}"
-    min_request_interval = 1  # Minimum seconds between requests
+    # INSTAGRAM_GRAPH_BASE_URL points the services elsewhere, e.g. at src/instagram/graph_simulator.py
+    base_url = os.getenv("INSTAGRAM_GRAPH_BASE_URL", f"https://graph.facebook.com/{API_VERSION}").rstrip("/")
+    BATCH_LIMIT = 50  # Maximum calls in one Graph API batch request
     
     def __init__(self, access_token, ig_user_id):
         """Initialize with access token and Instagram user ID"""
         self.access_token = access_token
         self.ig_user_id = ig_user_id
-        self.last_request_time = 0
         self.rate_limit_window = {}
         
-        # Configure session with retries
-        self.session = requests.Session()
-        retry_strategy = Retry(
-            total=3,  # Number of retries for failed requests
-            backoff_factor=0.5,  # Factor to apply between attempts
-            status_forcelist=[500, 502, 503, 504]  # HTTP status codes to retry on
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        self.session.mount("https://", adapter)
-        self.session.mount("http://", adapter)
+        # Process-wide pooled session (keep-alive and retries), see http_pool
+        self.session = http_pool.session
+    
+    @property
+    def host(self):
+        """Host of base_url: requests are paced per host and account, see request_pacer"""
+        return urlparse(self.base_url).netloc
     
     def _make_request(self, method, endpoint, params=None, data=None, headers=None, retry_attempt=0):
         """Make an API request with enhanced rate limiting and error handling"""
@@ -130,88 +214,136 @@ class BaseInstagramService:
             params = {}
         params['access_token'] = self.access_token
         
-        # Respect rate limits with minimum interval between requests
-        current_time = time.time()
-        elapsed = current_time - self.last_request_time
-        if elapsed < self.min_request_interval:
-            time.sleep(self.min_request_interval - elapsed)
+        # Don't send requests the API is already known to reject
+        blocked_for = rate_governor.blocked_time(self.ig_user_id)
+        if blocked_for > 0 and retry_attempt == 0:
+            raise RateLimitError(f"Rate limit active, retry in {blocked_for:.0f} seconds", blocked_for)
+        
+        # Pace requests across every thread and service instance using this account
+        waited = request_pacer.acquire(self.host, self.ig_user_id)
+        instrumentation.record_sleep('pacing', waited, self.ig_user_id)
         
+        response = None
+        error = None
+        duration = None
+        started = time.time()
         try:
             logger.info(f"Making {method} request to {endpoint}")
             if data:
-                logger.info(f"With data: {data}")
+                logger.info(f"With data: {redact(data)}")
             
             response = self.session.request(method, url, params=params, data=data, headers=headers)
-            self.last_request_time = time.time()
+            duration = time.time() - started
             
             # Process rate limit headers if present
-            if 'x-business-use-case-usage' in response.headers:
+            if 'x-business-use-case-usage' in response.headers or 'x-app-usage' in response.headers:
                 self._process_rate_limit_headers(response.headers)
             
             # Log response status
             logger.info(f"Response status: {response.status_code}")
             
-            if response.status_code == 403:
+            if response.status_code >= 400:
+                # Graph API errors (including rate limits) come with a JSON error body
                 try:
                     error_json = response.json()
-                    if 'error' in error_json:
-                        error = error_json['error']
-                        error_code = error.get('code')
-                        error_subcode = error.get('error_subcode')
-                        error_message = error.get('message', '')
-                        fb_trace_id = error.get('fbtrace_id')
-                        
-                        logger.error(f"{error_code} {error_message} (Subcode: {error_subcode})")
-                        
-                        # Handle application request limit specifically
-                        if error_subcode == 2207051:
-                            retry_seconds = 300  # Start with 5 minutes
-                            if retry_attempt < RateLimitHandler.MAX_ATTEMPTS:
-                                backoff_time = RateLimitHandler.calculate_backoff_time(retry_attempt, retry_seconds)
-                                logger.warning(f"Application request limit reached. Backing off for {backoff_time:.2f} seconds. Attempt {retry_attempt+1}/{RateLimitHandler.MAX_ATTEMPTS}")
-                                time.sleep(backoff_time)
-                                return self._make_request(method, endpoint, params, data, headers, retry_attempt + 1)
-                            
-                        raise RateLimitError(error_message, retry_seconds, error_code, error_subcode, fb_trace_id)
-                        
                 except ValueError:
+                    error_json = None
+                if isinstance(error_json, dict) and 'error' in error_json:
+                    raise graph_api_error(error_json['error'], response.status_code, self.ig_user_id, retry_attempt)
+                if response.status_code == 403:
                     raise InstagramAPIError("Failed to parse error response")
             
             response.raise_for_status()
             result = response.json() if response.content else None
             
-            if result and 'error' in result:
-                error = result['error']
-                error_code = error.get('code')
-                error_message = error.get('message', '')
-                error_subcode = error.get('error_subcode')
-                fb_trace_id = error.get('fbtrace_id')
-                
-                if error_code in [190, 104]:  # Token errors
-                    raise AuthenticationError(error_message, error_code, error_subcode, fb_trace_id)
-                elif error_code in [200, 10, 803]:  # Permission errors
-                    raise PermissionError(error_message, error_code, error_subcode, fb_trace_id)
-                elif RateLimitHandler.is_rate_limit_error(error_code, error_subcode):
-                    retry_seconds = self._get_retry_after(error)
-                    if retry_attempt < RateLimitHandler.MAX_ATTEMPTS:
-                        backoff_time = RateLimitHandler.calculate_backoff_time(retry_attempt, retry_seconds)
-                        logger.warning(f"Rate limit hit. Backing off for {backoff_time:.2f} seconds. Attempt {retry_attempt+1}/{RateLimitHandler.MAX_ATTEMPTS}")
-                        time.sleep(backoff_time)
-                        return self._make_request(method, endpoint, params, data, headers, retry_attempt + 1)
-                    raise RateLimitError(error_message, retry_seconds, error_code, error_subcode, fb_trace_id)
-                elif error_code in [1, 2]:  # Temporary server errors
-                    raise TemporaryServerError(error_message, error_code, error_subcode, fb_trace_id)
-                else:
-                    raise InstagramAPIError(error_message, error_code, error_subcode, fb_trace_id)
+            if isinstance(result, dict) and 'error' in result:
+                raise graph_api_error(result['error'], response.status_code, self.ig_user_id, retry_attempt)
             
             return result
             
         except requests.exceptions.RequestException as e:
             logger.error(f"Request failed: {str(e)}")
-            raise InstagramAPIError(f"Request failed: {str(e)}")
+            error = InstagramAPIError(f"Request failed: {str(e)}")
+            raise error
+        except AuthenticationError as e:
+            # Revoked or rotated token: stop handing out its cached introspection and services
+            error = e
+            token_cache.invalidate(self.access_token)
+            service_registry.invalidate(access_token=self.access_token)
+            raise
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            retries = getattr(getattr(response, 'raw', None), 'retries', None)
+            instrumentation.record_request(
+                method, endpoint,
+                duration if duration is not None else time.time() - started,
+                status=response.status_code if response is not None else None,
+                retries=len(retries.history) if retries is not None else 0,
+                bytes_out=len(response.request.body or b'') if response is not None else 0,
+                bytes_in=len(response.content) if response is not None else 0,
+                error=error,
+                params=data or params,
+                account_id=self.ig_user_id
+            )
+
+    def _sleep(self, seconds, reason):
+        """Sleep for a backoff, reporting the time to instrumentation"""
+        instrumentation.record_sleep(reason, seconds, self.ig_user_id)
+        time.sleep(seconds)
+
+    def _make_batch_request(self, calls):
+        """
+        Send several API calls as Graph API batch requests (one round-trip per
+        BATCH_LIMIT calls). A failing call does not fail the others: its
+        error is mapped to the same exceptions as _make_request and returned
+        in its position.
+
+        Args:
+            calls (list): Dicts with 'method', 'relative_url' and optional 'params'
+
+        Returns:
+            list: For each call, in order, the parsed response or the exception for that call
+        """
+        results = []
+        for start in range(0, len(calls), self.BATCH_LIMIT):
+            chunk = calls[start:start + self.BATCH_LIMIT]
+            batch = []
+            for call in chunk:
+                item = {'method': call['method'], 'relative_url': call['relative_url']}
+                if call.get('params'):
+                    if call['method'] == 'GET':
+                        item['relative_url'] += '?' + urlencode(call['params'])
+                    else:
+                        item['body'] = urlencode(call['params'])
+                batch.append(item)
+
+            responses = self._make_request('POST', '', data={'batch': json.dumps(batch), 'include_headers': 'false'})
+            if not isinstance(responses, list) or len(responses) != len(chunk):
+                raise InstagramAPIError(f"Unexpected batch response: {responses}")
+
+            for response in responses:
+                # Calls the API could not complete in time come back as null
+                if response is None:
+                    results.append(TemporaryServerError("Batch call did not complete"))
+                    continue
+                try:
+                    body = json.loads(response.get('body') or 'null')
+                except ValueError:
+                    results.append(InstagramAPIError(f"Failed to parse batch response (HTTP {response.get('code')})"))
+                    continue
+                if isinstance(body, dict) and 'error' in body:
+                    results.append(graph_api_error(body['error'], response.get('code'), self.ig_user_id))
+                elif response.get('code', 200) >= 400:
+                    results.append(InstagramAPIError(f"Batch call failed with HTTP {response.get('code')}"))
+                else:
+                    results.append(body)
+        return results
     
     def _process_rate_limit_headers(self, headers):
         """Process rate limit information from response headers"""
+        rate_governor.record_headers(headers, self.ig_user_id)
         usage_header = headers.get('x-business-use-case-usage')
         if usage_header:
             try:
@@ -220,36 +352,19 @@ class BaseInstagramService:
                     if isinstance(metrics, list) and metrics:
                         rate_data = metrics[0]
                         if 'estimated_time_to_regain_access' in rate_data:
-                            self.rate_limit_window[app_id] = time.time() + rate_data['estimated_time_to_regain_access']
+                            # estimated_time_to_regain_access is reported in minutes
+                            self.rate_limit_window[app_id] = time.time() + rate_data['estimated_time_to_regain_access'] * 60
             except json.JSONDecodeError:
                 logger.warning("Failed to parse rate limit headers")
     
     def _get_retry_after(self, error):
         """Extract retry after time from error response"""
-        # Default retry time increased to 5 minutes for application request limit
-        retry_seconds = 300
-        
-        # Check for specific error subcodes
-        if error.get('error_subcode') == 2207051:  # Application request limit
-            retry_seconds = 900  # 15 minutes
-        
-        # Try to extract time from error message
-        message = error.get('message', '').lower()
-        if 'minutes' in message:
-            try:
-                import re
-                time_match = re.search(r'(\d+)\s*minutes?', message)
-                if time_match:
-                    retry_seconds = int(time_match.group(1)) * 60
-            except:
-                pass
-        
-        return retry_seconds
+        return get_retry_after(error)
 
     def check_token_permissions(self):
         """Check if the access token has the necessary permissions"""
         try:
-            response = self._make_request('GET', 'debug_token', params={'input_token': self.access_token})
+            response = token_cache.introspect(self)
             if not response or 'data' not in response:
                 return False, ["Unable to verify token"]
             
@@ -270,7 +385,7 @@ class BaseInstagramService:
     def get_app_usage_info(self):
         """Get current app usage and rate limit information"""
         try:
-            result = requests.get(
+            result = self.session.get(
                 f"{self.base_url}/me",
                 params={
                     'access_token': self.access_token,
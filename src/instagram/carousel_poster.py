@@ -7,7 +7,8 @@ import mimetypes
 from typing import List, Tuple, Callable, Dict, Optional
 from dotenv import load_dotenv
 from src.instagram.instagram_carousel_service import InstagramCarouselService, RateLimitError
-from src.instagram.image_uploader import ImageUploader  # Para upload das imagens
+from src.instagram.service_registry import service_registry
+from src.instagram.media_host import media_host  # Hospedagem das imagens (Imgur ou servidor local)
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -111,7 +112,7 @@ def validate_carousel_images(image_paths: List[str], validator_func: Callable[[s
     return valid_images, invalid_images
 
 def upload_carousel_images(image_paths: List[str], progress_callback: Callable[[int, int], None] = None) -> Tuple[bool, List[Dict[str, str]], List[str]]:
-    """Faz upload de uma lista de imagens para o Imgur (ou outro serviço).
+    """Publica uma lista de imagens no media host (Imgur ou servidor local).
 
     Args:
         image_paths: Uma lista de caminhos de arquivos de imagem.
@@ -126,7 +127,6 @@ def upload_carousel_images(image_paths: List[str], progress_callback: Callable[[
     """
     logger.info(f"Starting upload of {len(image_paths)} carousel images")
     
-    uploader = ImageUploader()  # Instancia o ImageUploader
     uploaded_images = []
     uploaded_urls = []
     success = True
@@ -140,7 +140,7 @@ def upload_carousel_images(image_paths: List[str], progress_callback: Callable[[
         try:
             # Log before upload attempt to track any issues
             logger.info(f"Attempting to upload image {index+1}/{total_images}: {image_path}")
-            result = uploader.upload_from_path(image_path)
+            result = media_host.publish(image_path)
             uploaded_images.append(result)
             uploaded_urls.append(result['url'])
             logger.info(f"Uploaded image {index+1}/{total_images}: {result['url']}")
@@ -156,15 +156,14 @@ def upload_carousel_images(image_paths: List[str], progress_callback: Callable[[
     return success, uploaded_images, uploaded_urls
 
 def cleanup_uploaded_images(uploaded_images: List[Dict[str, str]]):
-    """Exclui imagens que foram enviadas para o Imgur (ou outro serviço)."""
-    uploader = ImageUploader()
+    """Libera as imagens publicadas no media host (Imgur ou servidor local)."""
     success_count = 0
     fail_count = 0
     
     for image_info in uploaded_images:
         if 'deletehash' in image_info:
             try:
-                uploader.delete_image(image_info['deletehash'])
+                media_host.delete(image_info['deletehash'])
                 success_count += 1
             except Exception as e:
                 fail_count += 1
@@ -203,11 +202,11 @@ def post_carousel_to_instagram(image_paths: List[str], caption: str, image_urls:
     logger.info(f"Creating carousel with {len(image_urls)} images")
     logger.info(f"Image URLs: {image_urls}")
     
-    service = InstagramCarouselService()
+    service = service_registry.get(InstagramCarouselService)
     
-    # Explicitly check token
+    # Explicitly check token (answered from the token cache while it is fresh)
     try:
-        service._validate_token(force_check=True)
+        service._validate_token()
         logger.info("Instagram token validated successfully")
     except Exception as e:
         logger.error(f"Token validation failed: {str(e)}")
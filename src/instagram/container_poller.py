@@ -0,0 +1,302 @@
+import os
+import time
+import heapq
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from src.instagram.base_instagram_service import InstagramAPIError
+from src.instagram.processing_times import processing_times
+
+logger = logging.getLogger('ContainerPoller')
+
+class ContainerPoller:
+    """
+    Shared status poller for media containers.
+
+    Instead of every job polling its own container from a blocking loop, the
+    services register the containers they wait for and a single daemon
+    thread checks them. Containers of the same account that are due (or
+    nearly due) are queried together with the multi-ID form
+    `?ids=a,b,c&fields=status_code,status`, and the waiting jobs are woken
+    through futures when their container reaches a final status.
+
+    Checks are scheduled from the learned processing times of similar
+    containers (see processing_times), falling back to a capped backoff
+    while there is no data, and every container has a hard deadline.
+    """
+
+    # Final container statuses: the waiting job is woken with the container data
+    FINAL_STATUSES = ("FINISHED", "ERROR", "EXPIRED", "PUBLISHED")
+    # IDs per multi-ID request
+    MAX_IDS = 50
+    # Containers due within this many seconds join a request that is being made anyway
+    COALESCE_WINDOW = float(os.getenv("INSTAGRAM_POLL_COALESCE_WINDOW", 3))
+    # Growth of the interval between checks of one container, and its upper bound
+    # (used until processing times have been learned for the media)
+    BACKOFF_FACTOR = 1.5
+    MAX_INTERVAL = 45
+    # Wall-clock seconds a container may take before the wait ends with TIMEOUT
+    DEADLINES = {
+        "IMAGE": int(os.getenv("INSTAGRAM_POLL_DEADLINE_IMAGE", 600)),
+        "CAROUSEL": int(os.getenv("INSTAGRAM_POLL_DEADLINE_CAROUSEL", 900)),
+        "REELS": int(os.getenv("INSTAGRAM_POLL_DEADLINE_REELS", 1800))
+    }
+    DEFAULT_DEADLINE = 900
+    # Extra seconds wait() gives a check in progress at the deadline before returning TIMEOUT
+    RESULT_GRACE = 60
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._entries = {}  # container_id -> entry
+        self._heap = []     # (next_check, sequence, container_id)
+        self._sequence = 0
+        self._thread = None
+        self.stats = {
+            "requests": 0,
+            "containers_checked": 0,
+            "containers_resolved": 0,
+            "timeouts": 0
+        }
+
+    def watch(self, service, container_id, max_checks=30, delay=10,
+              media_type=None, media_size=None, deadline=None):
+        """
+        Start watching a container
+
+        Args:
+            service (BaseInstagramService): Service whose credentials are used for the checks
+            container_id (str): Container to watch
+            max_checks (int): Checks before giving up with TIMEOUT
+            delay (float): Seconds before the first check when nothing has been learned yet
+            media_type (str): IMAGE, CAROUSEL or REELS, for the learned schedule and the deadline
+            media_size (int): Size of the media in bytes, if known
+            deadline (float): Seconds before giving up with TIMEOUT (default: DEADLINES[media_type])
+
+        Returns:
+            Future: Resolves to the container data ({'status_code': ..., 'status': ...}),
+                {'status_code': 'TIMEOUT'} after max_checks or the deadline, or raises the
+                error of the status request (RateLimitError, TemporaryServerError, ...)
+        """
+        with self._cond:
+            entry = self._entries.get(container_id)
+            if entry is not None:
+                return entry["future"]
+
+            now = time.time()
+            first_check = processing_times.next_check_in(media_type, media_size, 0)
+            entry = {
+                "container_id": container_id,
+                "service": service,
+                "account": (service.ig_user_id, service.access_token),
+                "future": Future(),
+                "media_type": media_type,
+                "media_size": media_size,
+                "checks": 0,
+                "max_checks": max_checks,
+                "interval": delay,
+                "started_at": now,
+                "last_check": now,
+                "deadline": now + (deadline or self.DEADLINES.get(media_type, self.DEFAULT_DEADLINE))
+            }
+            entry["next_check"] = min(now + (first_check if first_check is not None else delay), entry["deadline"])
+            self._entries[container_id] = entry
+            self._push(entry)
+            self._ensure_thread()
+            self._cond.notify()
+            return entry["future"]
+
+    def wait(self, service, container_id, max_checks=30, delay=10, **kwargs):
+        """Block until the container reaches a final status or its deadline; see watch()"""
+        future = self.watch(service, container_id, max_checks, delay, **kwargs)
+        with self._cond:
+            entry = self._entries.get(container_id)
+            deadline = entry["deadline"] if entry is not None else time.time()
+        try:
+            return future.result(timeout=max(deadline - time.time(), 0) + self.RESULT_GRACE)
+        except FutureTimeout:
+            # The poller never answered: do not keep the caller (a queue worker) blocked
+            logger.error(f"No status for container {container_id} by its deadline")
+            if entry is not None:
+                self._timeout(entry)
+            return {'status_code': 'TIMEOUT'}
+
+    def get_stats(self):
+        """Counters and containers currently watched"""
+        with self._cond:
+            stats = dict(self.stats)
+            stats["watching"] = len(self._entries)
+        # Average containers per status request: the saving over polling one by one
+        stats["containers_per_request"] = round(stats["containers_checked"] / stats["requests"], 2) if stats["requests"] else 0
+        stats["processing_times"] = processing_times.get_stats()
+        return stats
+
+    def _push(self, entry):
+        self._sequence += 1
+        heapq.heappush(self._heap, (entry["next_check"], self._sequence, entry["container_id"]))
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="ContainerPoller", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                groups = self._next_groups()
+            except Exception as e:
+                logger.error(f"Container poller error: {e}")
+                time.sleep(1)
+                continue
+            for group in groups:
+                try:
+                    self._check_group(group)
+                except Exception as e:
+                    # Never leave a group reserved: its waiting jobs get the error
+                    logger.error(f"Container poller error: {e}")
+                    for entry in group:
+                        self._resolve(entry, exception=e)
+
+    def _next_groups(self):
+        """Wait for the next due container; return the due entries grouped by account"""
+        with self._cond:
+            while True:
+                self._expire_overdue(time.time())
+                # Drop heap items of entries that were resolved or rescheduled
+                while self._heap:
+                    next_check, _, container_id = self._heap[0]
+                    entry = self._entries.get(container_id)
+                    if entry is not None and entry["next_check"] == next_check:
+                        break
+                    heapq.heappop(self._heap)
+                if self._heap and self._heap[0][0] <= time.time():
+                    break
+                # Wake up for the next check, or for the deadline of an entry without one
+                wake_times = [entry["deadline"] for entry in self._entries.values()]
+                if self._heap:
+                    wake_times.append(self._heap[0][0])
+                if not wake_times:
+                    self._cond.wait()
+                    continue
+                self._cond.wait(max(min(wake_times) - time.time(), 0))
+
+            now = time.time()
+            due_accounts = set()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, container_id = heapq.heappop(self._heap)
+                entry = self._entries.get(container_id)
+                if entry is not None:
+                    due_accounts.add(entry["account"])
+
+            groups = {}
+            for entry in self._entries.values():
+                if entry["account"] in due_accounts and entry["next_check"] <= now + self.COALESCE_WINDOW:
+                    groups.setdefault(entry["account"], []).append(entry)
+                    # Reserved for this round; rescheduled after the check
+                    entry["next_check"] = float("inf")
+
+        batches = []
+        for entries in groups.values():
+            for start in range(0, len(entries), self.MAX_IDS):
+                batches.append(entries[start:start + self.MAX_IDS])
+        return batches
+
+    def _check_group(self, entries):
+        service = entries[0]["service"]
+        ids = [entry["container_id"] for entry in entries]
+        try:
+            if len(ids) == 1:
+                results = {ids[0]: service._make_request('GET', ids[0], params={'fields': 'status_code,status'})}
+            else:
+                results = service._make_request('GET', '', params={'ids': ','.join(ids), 'fields': 'status_code,status'}) or {}
+            self._count(len(ids))
+        except InstagramAPIError as e:
+            if len(ids) == 1:
+                logger.error(f"Error checking container {ids[0]} status: {e}")
+                self._reschedule(entries[0])
+                return
+            # One bad ID fails the whole multi-ID request: check them one by one
+            logger.warning(f"Multi-ID status check failed ({e}), checking {len(ids)} containers individually")
+            for entry in entries:
+                self._check_group([entry])
+            return
+        except Exception as e:
+            # RateLimitError, TemporaryServerError, AuthenticationError...: the waiting
+            # jobs re-raise it and the queue retries the retriable ones later
+            for entry in entries:
+                self._resolve(entry, exception=e)
+            return
+
+        now = time.time()
+        for entry in entries:
+            data = results.get(entry["container_id"]) if isinstance(results, dict) else None
+            status = data.get('status_code') if data else None
+            logger.info(f"Container {entry['container_id']} status: {status}")
+            if status == 'FINISHED':
+                # It finished somewhere between the previous check and this one
+                finished_after = (entry["last_check"] + now) / 2 - entry["started_at"]
+                processing_times.record(entry["media_type"], entry["media_size"], finished_after)
+            entry["last_check"] = now
+            if status in self.FINAL_STATUSES:
+                if status == 'ERROR' and 'status' in data:
+                    logger.error(f"Container {entry['container_id']} error details: {data['status']}")
+                self._resolve(entry, result=data)
+            else:
+                self._reschedule(entry)
+
+    def _count(self, containers):
+        with self._cond:
+            self.stats["requests"] += 1
+            self.stats["containers_checked"] += containers
+
+    def _reschedule(self, entry):
+        with self._cond:
+            entry["checks"] += 1
+            now = time.time()
+            if entry["checks"] >= entry["max_checks"] or now >= entry["deadline"]:
+                self._timeout_locked(entry, now)
+                return
+
+            wait_time = processing_times.next_check_in(entry["media_type"], entry["media_size"], now - entry["started_at"])
+            if wait_time is None:
+                entry["interval"] = min(entry["interval"] * self.BACKOFF_FACTOR, self.MAX_INTERVAL)
+                wait_time = entry["interval"]
+            # The last check happens right at the deadline
+            entry["next_check"] = min(now + wait_time, entry["deadline"])
+            self._push(entry)
+
+    def _expire_overdue(self, now):
+        """Time out entries past their deadline that have no check left scheduled"""
+        for entry in list(self._entries.values()):
+            # A check scheduled at the deadline still runs; later (or none) means it never will
+            if now >= entry["deadline"] and entry["next_check"] > entry["deadline"]:
+                self._timeout_locked(entry, now)
+
+    def _timeout(self, entry):
+        with self._cond:
+            self._timeout_locked(entry, time.time())
+
+    def _timeout_locked(self, entry, now):
+        if entry["future"].done():
+            return
+        self.stats["timeouts"] += 1
+        logger.error(f"Container {entry['container_id']} status check timed out after "
+                     f"{entry['checks']} checks ({now - entry['started_at']:.0f}s)")
+        self._resolve_locked(entry, result={'status_code': 'TIMEOUT'})
+
+    def _resolve(self, entry, result=None, exception=None):
+        with self._cond:
+            self._resolve_locked(entry, result, exception)
+
+    def _resolve_locked(self, entry, result=None, exception=None):
+        if entry["future"].done():
+            return
+        if self._entries.get(entry["container_id"]) is entry:
+            self._entries.pop(entry["container_id"])
+        self.stats["containers_resolved"] += 1
+        if exception is not None:
+            entry["future"].set_exception(exception)
+        else:
+            entry["future"].set_result(result)
+
+# Global instance shared by every Instagram service in the process
+container_poller = ContainerPoller()
@@ -1,17 +1,55 @@
 import os
 import google.generativeai as genai
 from dotenv import load_dotenv
-import requests  # Added for fetching image data
+from src.instagram.http_pool import http_pool
 import base64    # Added for base64 encoding
+import mimetypes
 
 class ImageDescriber:
     @staticmethod
-    def describe(image_url: str) -> str:
+    def _read_image(image):
+        """
+        Lê o conteúdo da imagem e identifica seu tipo MIME.
+
+        Args:
+            image: URL, caminho local, bytes ou objeto com read() (arquivo, BytesIO).
+
+        Returns:
+            tuple: (bytes da imagem, tipo MIME)
+        """
+        if isinstance(image, str) and image.startswith(('http://', 'https://')):
+            headers = {'User-Agent': 'Mozilla/5.0'}
+            image_response = http_pool.session.get(image, headers=headers, timeout=30)
+            image_response.raise_for_status()
+            content_type = image_response.headers.get('Content-Type', '').split(';')[0]
+            return image_response.content, content_type if content_type.startswith('image/') else None
+        if isinstance(image, (str, os.PathLike)):
+            # Arquivo local: lido diretamente, sem upload temporário
+            with open(image, 'rb') as image_file:
+                return image_file.read(), mimetypes.guess_type(str(image))[0]
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return bytes(image), None
+        if hasattr(image, 'read'):
+            return image.read(), None
+        raise TypeError(f"Tipo de imagem não suportado: {type(image).__name__}")
+
+    @staticmethod
+    def _sniff_mime_type(image_bytes):
+        """Identifica o tipo MIME pela assinatura do arquivo (padrão: JPEG)"""
+        if image_bytes.startswith(b'\x89PNG'):
+            return 'image/png'
+        if image_bytes[:4] == b'RIFF' and image_bytes[8:12] == b'WEBP':
+            return 'image/webp'
+        return 'image/jpeg'
+
+    @staticmethod
+    def describe(image) -> str:
         """
         Gera uma descrição detalhada para a imagem fornecida.
 
         Args:
-            image_url (str): URL da imagem a ser analisada.
+            image: Imagem a ser analisada: caminho local, bytes, objeto com read()
+                (arquivo aberto, BytesIO) ou URL.
 
         Returns:
             str: Descrição gerada para a imagem.
@@ -24,11 +62,9 @@ class ImageDescriber:
 
         # Fazer a solicitação à API do Gemini
         try:
-            # Fetch and encode the image from the URL with custom headers
-            headers = {'User-Agent': 'Mozilla/5.0'}
-            image_response = requests.get(image_url, headers=headers)
-            image_response.raise_for_status()
-            encoded_image = base64.b64encode(image_response.content).decode('utf-8')
+            image_bytes, mime_type = ImageDescriber._read_image(image)
+            mime_type = mime_type or ImageDescriber._sniff_mime_type(image_bytes)
+            encoded_image = base64.b64encode(image_bytes).decode('utf-8')
         except Exception as e:
             return f"Erro ao obter a imagem: {e}"
 
@@ -49,7 +85,7 @@ class ImageDescriber:
                     },
                     {
                         "inline_data": {
-                            "mime_type": "image/jpeg",
+                            "mime_type": mime_type,
                             "data": encoded_image  # Updated to use base64 encoded image content
                         }
                     }
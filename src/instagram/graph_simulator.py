@@ -0,0 +1,344 @@
+"""
+Local stand-in for the Instagram Graph API, for offline end-to-end benchmarks.
+
+Implements the endpoints the services use: `{ig_user_id}/media`,
+`{ig_user_id}/media_publish`, container status (single and `?ids=`),
+`permalink`, `debug_token`, `me` and batch requests. Containers take a
+configurable, seeded-random time to process; responses carry
+`x-app-usage` / `x-business-use-case-usage` headers computed from a per-account
+call budget, and rate-limit errors (codes 4, 17 and subcode 2207051) are
+returned when the budget runs out or at a configurable random rate.
+
+Usage:
+    python -m src.instagram.graph_simulator --port 8765 --seed 42
+    INSTAGRAM_GRAPH_BASE_URL=http://127.0.0.1:8765/v22.0 python app.py
+"""
+import re
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger('GraphSimulator')
+
+class SimulatorError(Exception):
+    """Graph API error returned by the simulator"""
+    def __init__(self, status, code, message, subcode=None, error_type="OAuthException"):
+        self.status = status
+        self.code = code
+        self.subcode = subcode
+        self.error_type = error_type
+        super().__init__(message)
+
+    def payload(self):
+        error = {"message": str(self), "type": self.error_type, "code": self.code, "fbtrace_id": "simulator"}
+        if self.subcode:
+            error["error_subcode"] = self.subcode
+        return {"error": error}
+
+class GraphSimulator:
+    """Simulated Graph API state and behavior; serve() exposes it over HTTP"""
+
+    # Rate-limit errors the simulator can return: (HTTP status, code, subcode, message)
+    RATE_LIMIT_ERRORS = {
+        4: (400, 4, None, "Application request limit reached"),
+        17: (400, 17, None, "User request limit reached"),
+        2207051: (403, 4, 2207051, "Application request limit reached")
+    }
+
+    def __init__(self, seed=0, image_delay=(1.0, 3.0), carousel_delay=(2.0, 6.0), video_delay=(5.0, 20.0),
+                 calls_per_window=200, window=3600, rate_limit_probability=0.0, rate_limit_codes=(4, 17, 2207051),
+                 expire_after=86400):
+        """
+        Args:
+            seed (int): Seed of the random generator (processing times, injected errors, IDs)
+            image_delay, carousel_delay, video_delay (tuple): Min/max seconds a container takes to process
+            calls_per_window (int): Calls per account and window before rate limiting
+            window (float): Length of the usage window in seconds
+            rate_limit_probability (float): Chance of a random rate-limit error on any call
+            rate_limit_codes (tuple): Errors to pick from (4, 17 and/or 2207051)
+            expire_after (float): Seconds after which an unpublished container is EXPIRED
+        """
+        self.rng = random.Random(seed)
+        self.delays = {"IMAGE": image_delay, "CAROUSEL": carousel_delay, "REELS": video_delay, "VIDEO": video_delay}
+        self.calls_per_window = calls_per_window
+        self.window = window
+        self.rate_limit_probability = rate_limit_probability
+        self.rate_limit_codes = tuple(rate_limit_codes)
+        self.expire_after = expire_after
+        self._lock = threading.Lock()
+        self._next_id = 17841400000000000
+        self.containers = {}  # container_id -> {"account", "media_type", "ready_at", "created_at", "status"}
+        self.posts = {}       # post_id -> {"account", "container_id"}
+        self._usage = {}      # account -> [window start, calls]
+        self.stats = {"requests": 0, "by_endpoint": {}, "rate_limited": 0, "containers": 0, "published": 0}
+
+    # ---- helpers ------------------------------------------------------------
+
+    def _new_id(self):
+        self._next_id += self.rng.randint(1, 999)
+        return str(self._next_id)
+
+    def _count_call(self, account):
+        """Count a call against the account's window; returns its usage in percent"""
+        now = time.time()
+        usage = self._usage.setdefault(account, [now, 0])
+        if now - usage[0] >= self.window:
+            usage[0], usage[1] = now, 0
+        usage[1] += 1
+        return usage[1] * 100 / self.calls_per_window
+
+    def usage_headers(self, account):
+        """x-app-usage and x-business-use-case-usage for an account's current window"""
+        with self._lock:
+            start, calls = self._usage.get(account, [time.time(), 0])
+        percent = min(100, int(calls * 100 / self.calls_per_window))
+        regain = 0
+        if calls >= self.calls_per_window:
+            # Reported in minutes, like the real API
+            regain = max(1, int((start + self.window - time.time()) // 60) + 1)
+        metrics = {"call_count": percent, "total_cputime": percent // 2, "total_time": percent // 2}
+        return {
+            "x-app-usage": json.dumps(metrics),
+            "x-business-use-case-usage": json.dumps({
+                account: [dict(metrics, type="instagram", estimated_time_to_regain_access=regain)]
+            })
+        }
+
+    def _owner(self, node_id):
+        """Account a container or post belongs to ("default" for other nodes)"""
+        with self._lock:
+            node = self.containers.get(node_id) or self.posts.get(node_id)
+        return node["account"] if node else "default"
+
+    def _container_status(self, container):
+        if container["status"] == "PUBLISHED":
+            return "PUBLISHED"
+        now = time.time()
+        if now - container["created_at"] > self.expire_after:
+            return "EXPIRED"
+        return "FINISHED" if now >= container["ready_at"] else "IN_PROGRESS"
+
+    # ---- request handling ---------------------------------------------------
+
+    def handle(self, method, path, params):
+        """
+        Handle one API call
+
+        Args:
+            method (str): GET or POST
+            path (str): Path without the version prefix (e.g. "123/media")
+            params (dict): Query and form parameters (single values)
+
+        Returns:
+            tuple: (HTTP status, body dict, account) — account is used for the usage headers
+        """
+        parts = [part for part in path.strip("/").split("/") if part]
+        endpoint = "/".join(parts[1:]) if len(parts) > 1 else ("root" if not parts else "node")
+        account = parts[0] if len(parts) > 1 else self._owner(parts[0] if parts else params.get("ids", "").split(",")[0])
+
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["by_endpoint"][endpoint] = self.stats["by_endpoint"].get(endpoint, 0) + 1
+
+        try:
+            if method == "POST" and not parts and "batch" in params:
+                return 200, self._batch(params), account
+
+            with self._lock:
+                usage = self._count_call(account)
+                injected = self.rate_limit_codes and self.rng.random() < self.rate_limit_probability
+                code = self.rng.choice(self.rate_limit_codes) if injected else None
+            if usage > 100:
+                code = 17 if 17 in self.rate_limit_codes or not self.rate_limit_codes else self.rate_limit_codes[0]
+            if code:
+                status, error_code, subcode, message = self.RATE_LIMIT_ERRORS[code]
+                with self._lock:
+                    self.stats["rate_limited"] += 1
+                raise SimulatorError(status, error_code, message, subcode)
+
+            return 200, self._route(method, parts, params), account
+        except SimulatorError as e:
+            return e.status, e.payload(), account
+
+    def _route(self, method, parts, params):
+        if not parts:
+            if "ids" in params:
+                return {node_id: self._node(node_id, params) for node_id in params["ids"].split(",")}
+            raise SimulatorError(400, 100, "Unsupported request", error_type="GraphMethodException")
+        if parts == ["debug_token"]:
+            return {"data": {
+                "app_id": "simulator", "type": "USER", "is_valid": True,
+                "expires_at": int(time.time()) + 60 * 86400,
+                "scopes": ["instagram_basic", "instagram_content_publish", "pages_show_list"]
+            }}
+        if parts == ["me"]:
+            body = {"id": "simulator-user", "name": "Graph Simulator"}
+            if params.get("debug") == "all":
+                body["__debug"] = {"app_usage": {}, "page_usage": {}}
+            return body
+        if len(parts) == 2 and parts[1] == "media" and method == "POST":
+            return self._create_container(parts[0], params)
+        if len(parts) == 2 and parts[1] == "media_publish" and method == "POST":
+            return self._publish(parts[0], params)
+        if len(parts) == 1 and method == "GET":
+            return self._node(parts[0], params)
+        raise SimulatorError(400, 100, f"Unsupported request: {method} /{'/'.join(parts)}", error_type="GraphMethodException")
+
+    def _create_container(self, account, params):
+        if params.get("media_type") == "CAROUSEL":
+            media_type = "CAROUSEL"
+            children = [child for child in params.get("children", "").split(",") if child]
+            if len(children) < 2 or any(child not in self.containers for child in children):
+                raise SimulatorError(400, 100, "Invalid carousel children", 2207004)
+        elif params.get("media_type") in ("REELS", "VIDEO"):
+            media_type = "REELS"
+        else:
+            media_type = "IMAGE"
+            if not params.get("image_url"):
+                raise SimulatorError(400, 100, "Missing image_url", 2207052)
+
+        with self._lock:
+            low, high = self.delays[media_type]
+            container_id = self._new_id()
+            now = time.time()
+            self.containers[container_id] = {
+                "account": account, "media_type": media_type, "created_at": now,
+                "ready_at": now + self.rng.uniform(low, high), "status": "IN_PROGRESS"
+            }
+            self.stats["containers"] += 1
+        return {"id": container_id}
+
+    def _publish(self, account, params):
+        container_id = params.get("creation_id")
+        with self._lock:
+            container = self.containers.get(container_id)
+            if container is None:
+                raise SimulatorError(400, 100, "Invalid creation_id", 2207026)
+            status = self._container_status(container)
+            if status != "FINISHED":
+                raise SimulatorError(400, 9007, "Media ID is not available", 2207027)
+            container["status"] = "PUBLISHED"
+            post_id = self._new_id()
+            self.posts[post_id] = {"account": account, "container_id": container_id}
+            self.stats["published"] += 1
+        return {"id": post_id}
+
+    def _node(self, node_id, params):
+        fields = params.get("fields", "id").split(",")
+        with self._lock:
+            if node_id in self.posts:
+                node = {"id": node_id, "permalink": f"https://www.instagram.com/p/sim{node_id[-8:]}/"}
+            elif node_id in self.containers:
+                status = self._container_status(self.containers[node_id])
+                node = {"id": node_id, "status_code": status, "status": status.title().replace("_", " ")}
+            else:
+                raise SimulatorError(400, 100, f"Object with ID '{node_id}' does not exist", 33, "GraphMethodException")
+        return dict({field: node[field] for field in fields if field in node}, id=node_id)
+
+    def _batch(self, params):
+        results = []
+        for call in json.loads(params["batch"]):
+            url = urlparse(call["relative_url"])
+            call_params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            if call.get("body"):
+                call_params.update({key: values[0] for key, values in parse_qs(call["body"]).items()})
+            path = re.sub(r"^/?v\d+\.\d+", "", url.path)
+            status, body, _ = self.handle(call.get("method", "GET").upper(), path, call_params)
+            results.append({"code": status, "headers": [], "body": json.dumps(body)})
+        return results
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, by_endpoint=dict(self.stats["by_endpoint"]))
+
+    # ---- HTTP server ----------------------------------------------------------
+
+    def serve(self, host="127.0.0.1", port=0):
+        """
+        Start the HTTP server in a background thread
+
+        Returns:
+            ThreadingHTTPServer: The server; base URL is http://host:server.server_port/v22.0
+        """
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self, method):
+                url = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if method == "POST":
+                    length = int(self.headers.get("Content-Length") or 0)
+                    form = self.rfile.read(length).decode() if length else ""
+                    params.update({key: values[0] for key, values in parse_qs(form).items()})
+                if url.path == "/__simulator/stats":
+                    status, body, account = 200, simulator.get_stats(), None
+                else:
+                    status, body, account = simulator.handle(method, re.sub(r"^/v\d+\.\d+", "", url.path), params)
+
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                if account:
+                    for name, value in simulator.usage_headers(account).items():
+                        self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self._respond("GET")
+
+            def do_POST(self):
+                self._respond("POST")
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="GraphSimulator", daemon=True).start()
+        logger.info(f"Graph API simulator listening on http://{host}:{server.server_port}")
+        return server
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulador local da Graph API do Instagram")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--image-delay', type=float, nargs=2, default=(1.0, 3.0), metavar=('MIN', 'MAX'))
+    parser.add_argument('--carousel-delay', type=float, nargs=2, default=(2.0, 6.0), metavar=('MIN', 'MAX'))
+    parser.add_argument('--video-delay', type=float, nargs=2, default=(5.0, 20.0), metavar=('MIN', 'MAX'))
+    parser.add_argument('--calls-per-window', type=int, default=200)
+    parser.add_argument('--window', type=float, default=3600)
+    parser.add_argument('--rate-limit-probability', type=float, default=0.0)
+    parser.add_argument('--rate-limit-codes', default='4,17,2207051', help='Códigos de erro simulados, separados por vírgula')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+    simulator = GraphSimulator(
+        seed=args.seed,
+        image_delay=tuple(args.image_delay),
+        carousel_delay=tuple(args.carousel_delay),
+        video_delay=tuple(args.video_delay),
+        calls_per_window=args.calls_per_window,
+        window=args.window,
+        rate_limit_probability=args.rate_limit_probability,
+        rate_limit_codes=[int(code) for code in args.rate_limit_codes.split(',') if code]
+    )
+    server = simulator.serve(args.host, args.port)
+    print(f"INSTAGRAM_GRAPH_BASE_URL=http://{args.host}:{server.server_port}/v22.0")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import os
+import logging
+import threading
+import requests
+from urllib3.util.retry import Retry
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('HttpPool')
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter that reports in-flight requests to its HttpPool"""
+
+    def __init__(self, http_pool, **kwargs):
+        self.http_pool = http_pool
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        self.http_pool._begin()
+        failed = True
+        try:
+            response = super().send(request, **kwargs)
+            failed = False
+            return response
+        finally:
+            self.http_pool._end(failed)
+
+class HttpPool:
+    """
+    Process-wide HTTP connection pool shared by every Instagram service.
+
+    A single requests.Session with keep-alive is reused by all services, so
+    a new service instance per job no longer pays a fresh TLS handshake to
+    graph.facebook.com. Sending requests through a shared Session is
+    thread-safe as long as its state (headers, cookies) is not mutated
+    per request; services pass the token in the params of each call.
+    """
+
+    # Number of hosts with their own connection pool (graph API, image hosts...)
+    POOL_CONNECTIONS = int(os.getenv("INSTAGRAM_HTTP_POOL_CONNECTIONS", 10))
+    # Connections kept alive per host; should cover every worker and pipeline thread
+    POOL_MAXSIZE = int(os.getenv("INSTAGRAM_HTTP_POOL_MAXSIZE", 20))
+    # Wait for a free connection instead of opening a throwaway one when the pool is exhausted
+    POOL_BLOCK = os.getenv("INSTAGRAM_HTTP_POOL_BLOCK", "false").lower() == "true"
+
+    def __init__(self, pool_connections=None, pool_maxsize=None, pool_block=None):
+        self.pool_connections = pool_connections or self.POOL_CONNECTIONS
+        self.pool_maxsize = pool_maxsize or self.POOL_MAXSIZE
+        self.pool_block = self.POOL_BLOCK if pool_block is None else pool_block
+        self._lock = threading.Lock()
+        self._session = None
+        self._adapter = None
+        self._stats = {
+            "requests": 0,
+            "failed_requests": 0,
+            "in_flight": 0,
+            "peak_in_flight": 0
+        }
+
+    @property
+    def session(self):
+        """The shared session, created on first use"""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._create_session()
+        return self._session
+
+    def _create_session(self):
+        session = requests.Session()
+        retry_strategy = Retry(
+            total=3,  # Number of retries for failed requests
+            backoff_factor=0.5,  # Factor to apply between attempts
+            status_forcelist=[500, 502, 503, 504]  # HTTP status codes to retry on
+        )
+        self._adapter = PooledAdapter(
+            self,
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block,
+            max_retries=retry_strategy
+        )
+        session.mount("https://", self._adapter)
+        session.mount("http://", self._adapter)
+        logger.info(f"Shared HTTP pool created ({self.pool_connections} hosts, {self.pool_maxsize} connections per host)")
+        return session
+
+    def _begin(self):
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["in_flight"] += 1
+            self._stats["peak_in_flight"] = max(self._stats["peak_in_flight"], self._stats["in_flight"])
+
+    def _end(self, failed):
+        with self._lock:
+            self._stats["in_flight"] -= 1
+            if failed:
+                self._stats["failed_requests"] += 1
+
+    def get_stats(self):
+        """Request counters and per-host pool utilization, for status endpoints"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            "pool_connections": self.pool_connections,
+            "pool_maxsize": self.pool_maxsize,
+            "utilization": round(stats["in_flight"] / self.pool_maxsize, 2),
+            "hosts": {}
+        })
+        if self._adapter is None:
+            return stats
+
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            idle = pool.pool.qsize() if pool.pool is not None else 0
+            stats["hosts"][f"{key.key_scheme}://{key.key_host}:{key.key_port}"] = {
+                "connections_created": pool.num_connections,
+                "requests": pool.num_requests,
+                "idle_connections": idle,
+                # Requests per connection: above 1 means connections are being reused
+                "reuse_ratio": round(pool.num_requests / pool.num_connections, 2) if pool.num_connections else 0
+            }
+        return stats
+
+# Global instance shared by every Instagram service in the process
+http_pool = HttpPool()
@@ -3,6 +3,7 @@ import time
 import json
 import logging
 import random
+import requests
 from typing import Dict, Any, Optional, List
 from datetime import datetime
 from dotenv import load_dotenv
@@ -10,6 +11,9 @@ from src.instagram.base_instagram_service import (
     BaseInstagramService, AuthenticationError, PermissionError,
     RateLimitError, MediaError, TemporaryServerError, InstagramAPIError
 )
+from src.instagram.container_poller import container_poller
+from src.instagram.service_registry import token_cache
+from src.instagram.instrumentation import redact
 
 logger = logging.getLogger('InstagramCarouselService')
 
@@ -84,11 +88,8 @@ class InstagramCarouselService(BaseInstagramService):
             logger.info(f"Validating Instagram token (force_check={force_check})")
             logger.info(f"Using Instagram Account ID: {self.ig_user_id}")
             
-            response = self._make_request(
-                "GET",
-                "debug_token",
-                params={"input_token": self.access_token}
-            )
+            # Cached per token: one debug_token call per TTL instead of one per service
+            response = token_cache.introspect(self, force=force_check)
             
             if response and 'data' in response and response['data'].get('is_valid'):
                 logger.info("Token de acesso validado com sucesso.")
@@ -148,6 +149,7 @@ class InstagramCarouselService(BaseInstagramService):
             )
             
             if response and 'access_token' in response:
+                token_cache.invalidate(self.access_token)
                 self.access_token = response['access_token']
                 self.token_expires_at = time.time() + response.get('expires_in', 5184000)  # Default 60 days
                 logger.info(f"Token refreshed. New expiration: {datetime.fromtimestamp(self.token_expires_at)}")
@@ -167,17 +169,13 @@ class InstagramCarouselService(BaseInstagramService):
             try:
                 logger.info(f"Validating media URL (attempt {attempt+1}/{max_retries}): {media_url}")
                 
-                # Create a new session for each attempt to avoid connection pooling issues
-                import requests
-                session = requests.Session()
-                
                 # Add user agent to mimic browser request
                 headers = {
                     'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
                     'Accept': 'image/jpeg, image/png, */*'
                 }
                 
-                response = session.head(media_url, timeout=20, headers=headers)  # Increased timeout
+                response = self.session.head(media_url, timeout=20, headers=headers)  # Increased timeout
                 
                 if response.status_code != 200:
                     logger.error(f"Media URL not accessible: {media_url}, status code: {response.status_code}")
@@ -189,12 +187,12 @@ class InstagramCarouselService(BaseInstagramService):
                         # Ensure we wait at least 10 seconds for rate limits
                         retry_after = max(retry_after, 10 + random.randint(1, 10))
                         logger.warning(f"Rate limit hit from image host. Waiting {retry_after}s before retry...")
-                        time.sleep(retry_after)
+                        self._sleep(retry_after, 'media_validation_backoff')
                     elif attempt < max_retries - 1:
                         # Exponential backoff with jitter for other errors
                         delay = base_delay * (2 ** attempt) + random.uniform(0, 3)
                         logger.warning(f"Will retry after {delay:.2f}s...")
-                        time.sleep(delay)
+                        self._sleep(delay, 'media_validation_backoff')
                     continue
 
                 content_type = response.headers.get('content-type', '').lower()
@@ -217,18 +215,18 @@ class InstagramCarouselService(BaseInstagramService):
                     # This is likely a rate limit issue
                     delay = base_delay * (3 ** attempt) + random.uniform(5, 15)  # More aggressive backoff
                     logger.warning(f"Rate limit hit from image host. Waiting {delay:.2f}s before retry...")
-                    time.sleep(delay)
+                    self._sleep(delay, 'media_validation_backoff')
                 elif attempt < max_retries - 1:
                     # General network error, retry with exponential backoff
                     delay = base_delay * (2 ** attempt) + random.uniform(0, 5)
                     logger.warning(f"Network error, will retry after {delay:.2f}s...")
-                    time.sleep(delay)
+                    self._sleep(delay, 'media_validation_backoff')
             except Exception as e:
                 logger.error(f"Unexpected error validating media: {str(e)}")
                 if attempt < max_retries - 1:
                     delay = base_delay * (2 ** attempt) + random.uniform(0, 5)
                     logger.warning(f"Will retry after {delay:.2f}s...")
-                    time.sleep(delay)
+                    self._sleep(delay, 'media_validation_backoff')
         
         logger.error(f"Failed to validate media after {max_retries} attempts: {media_url}")
         return False
@@ -242,14 +240,11 @@ class InstagramCarouselService(BaseInstagramService):
             logger.error(f"Media validation failed for: {media_url}")
             return None
 
-        # Ensure the media_url is properly encoded
         try:
-            from urllib.parse import quote
-            encoded_url = quote(media_url, safe=':/')  # Allow : and / in URL
-            
-            # Build parameters correctly
+            # The form encoding of data= escapes the URL; quoting it here as well would
+            # turn the query string of signed URLs (?expires=...&signature=...) into path
             params = {
-                'image_url': encoded_url,
+                'image_url': media_url,
                 'media_type': 'IMAGE',
                 'is_carousel_item': 'true',  # Changed to string 'true'
                 'access_token': self.access_token
@@ -288,6 +283,43 @@ class InstagramCarouselService(BaseInstagramService):
             logger.error(f"Unexpected error creating child container: {str(e)}")
             return None
 
+    def _create_child_containers(self, media_urls: List[str]) -> List[Dict[str, Any]]:
+        """
+        Creates the child containers of a carousel in a single Graph API batch request.
+
+        Returns:
+            List with, for each media URL in order, a dict with 'media_url',
+            'container_id' (None on failure) and 'error' (the exception, or None)
+        """
+        if self.token_expires_at and time.time() > self.token_expires_at - 60:
+            self._refresh_token()
+
+        # image_url goes as is: the batch form encoding escapes it once
+        calls = [{
+            'method': 'POST',
+            'relative_url': f"{self.ig_user_id}/media",
+            'params': {
+                'image_url': media_url,
+                'media_type': 'IMAGE',
+                'is_carousel_item': 'true'
+            }
+        } for media_url in media_urls]
+
+        logger.info(f"Creating {len(calls)} child containers in a batch request")
+        results = []
+        for media_url, response in zip(media_urls, self._make_batch_request(calls)):
+            if isinstance(response, Exception):
+                logger.error(f"Failed to create child container for {media_url}: {response}")
+                results.append({'media_url': media_url, 'container_id': None, 'error': response})
+            elif response and 'id' in response:
+                logger.info(f"Child container created successfully for {media_url}: {response['id']}")
+                results.append({'media_url': media_url, 'container_id': response['id'], 'error': None})
+            else:
+                logger.error(f"Invalid response from Instagram API for {media_url}: {response}")
+                results.append({'media_url': media_url, 'container_id': None,
+                                'error': InstagramAPIError(f"Invalid response: {response}")})
+        return results
+
     def create_carousel_container(self, media_urls: List[str], caption: str) -> Optional[str]:
         """Creates a container for a carousel post using v22 API."""
         if self.token_expires_at and time.time() > self.token_expires_at - 60:
@@ -309,15 +341,14 @@ class InstagramCarouselService(BaseInstagramService):
         
         logger.info(f"Proceeding with {len(valid_media_urls)} valid media URLs")
 
-        # Create children containers
-        children = []
-        for media_url in valid_media_urls:
-            child_id = self._create_child_container(media_url)
-            if not child_id:
-                logger.error(f"Failed to create child container for {media_url}")
-                continue
-            children.append(child_id)
-            time.sleep(2)  # Respect rate limits between child creation
+        # Create children containers (one batch request instead of one call per image)
+        child_results = self._create_child_containers(valid_media_urls)
+        children = [result['container_id'] for result in child_results if result['container_id']]
+
+        # A rate limit or temporary failure on any child is retried later as a whole
+        for result in child_results:
+            if isinstance(result['error'], (RateLimitError, TemporaryServerError)):
+                raise result['error']
 
         if len(children) < 2:
             logger.error(f"Not enough child containers created. Found: {len(children)}, required: at least 2")
@@ -333,7 +364,7 @@ class InstagramCarouselService(BaseInstagramService):
 
         try:
             endpoint = f"{self.ig_user_id}/media"
-            logger.info(f"Creating carousel container with params: {params}")
+            logger.info(f"Creating carousel container with params: {redact(params)}")
             result = self._make_request('POST', endpoint, data=params)
             if result and 'id' in result:
                 container_id = result['id']
@@ -345,90 +376,44 @@ class InstagramCarouselService(BaseInstagramService):
             logger.error(f"Failed to create carousel container: {e}")
             raise
 
-    def wait_for_container_status(self, container_id: str, max_attempts: int = 30, delay: int = 5) -> str:
-        """Verifica o status do container até estar pronto ou falhar."""
+    def wait_for_container_status(self, container_id: str, max_attempts: int = 30, delay: int = 5,
+                                  media_size: Optional[int] = None) -> str:
+        """Verifica o status do container até estar pronto ou falhar (verificações feitas pelo container_poller)."""
         if self.token_expires_at and time.time() > self.token_expires_at - 60:
             self._refresh_token()
 
-        for attempt in range(max_attempts):
+        # Media processing errors get one more round of checks
+        processing_retries = 1
+        while True:
             try:
-                params = {
-                    'fields': 'status_code,status',  # Removed 'publishing_to_ig'
-                    'access_token': self.access_token  # Ensure access token is included
-                }
-                
-                data = self._make_request('GET', f"{container_id}", params=params)
-                if not data:
-                    logger.warning(f"Failed to get container status (attempt {attempt + 1}/{max_attempts})")
-                    time.sleep(delay)
-                    continue
+                data = container_poller.wait(
+                    self, container_id, max_checks=max_attempts, delay=delay,
+                    media_type='CAROUSEL', media_size=media_size
+                )
+            except RateLimitError as e:
+                # Do not sleep here: the queue reschedules the job after retry_seconds
+                logger.warning(f"Rate limit hit while checking status. Retry in {e.retry_seconds}s")
+                raise
 
-                status_code = data.get('status_code', '')
-                status_details = data.get('status', {})
-                
-                # Log detailed status information
-                logger.info(f"Container status check (attempt {attempt + 1}/{max_attempts}):")
-                logger.info(f"  - Status code: {status_code}")
-                logger.info(f"  - Status details: {status_details}")
+            status_code = data.get('status_code', '')
+            status_details = data.get('status', {})
+            logger.info(f"Container {container_id} final status: {status_code} ({status_details})")
 
-                if status_code == 'FINISHED':
-                    return status_code
-                
-                elif status_code == 'IN_PROGRESS':
-                    # Container still processing, continue waiting
-                    time.sleep(delay)
-                    continue
-                
-                elif status_code == 'ERROR':
-                    # Extract detailed error information
-                    error_code = status_details.get('error_code')
-                    error_type = status_details.get('error_type')
-                    error_message = status_details.get('error_message')
-                    
-                    logger.error(f"Container failed with error:")
-                    logger.error(f"  - Error code: {error_code}")
-                    logger.error(f"  - Error type: {error_type}")
-                    logger.error(f"  - Message: {error_message}")
-                    
-                    # Check for specific error types that might be recoverable
-                    if error_code in [2207024, 2207026]:  # Media processing errors
-                        if attempt < max_attempts - 1:
-                            logger.info("Media processing error, will retry...")
-                            time.sleep(delay * 2)  # Double delay for processing errors
-                            continue
-                    
-                    return 'ERROR'
-                
-                elif status_code == 'EXPIRED':
-                    logger.error("Container expired before publishing")
-                    return 'EXPIRED'
-                    
-                else:
-                    # Unknown status code
-                    logger.warning(f"Unknown status code: {status_code}")
-                    if attempt < max_attempts - 1:
-                        time.sleep(delay)
-                        continue
-                    return 'UNKNOWN'
-
-            except RateLimitError as e:
-                if e.retry_seconds:
-                    logger.warning(f"Rate limit hit while checking status. Waiting {e.retry_seconds}s...")
-                    time.sleep(e.retry_seconds)
-                else:
-                    time.sleep(delay)
-            except InstagramAPIError as e:
-                if e.response.status_code == 400:
-                    logger.error(f"Bad Request: {e.response.text}")
-                    return 'BAD_REQUEST'
-                logger.error(f"Instagram API error while checking status: {e}")
-                time.sleep(delay)
-            except Exception as e:
-                logger.error(f"Error checking container status: {str(e)}")
-                time.sleep(delay)
+            if status_code == 'ERROR':
+                # Extract detailed error information
+                error_code = status_details.get('error_code') if isinstance(status_details, dict) else None
+                logger.error(f"Container failed with error: {status_details}")
 
-        logger.error(f"Container status check timed out after {max_attempts} attempts.")
-        return 'TIMEOUT'
+                # Check for specific error types that might be recoverable
+                if error_code in [2207024, 2207026] and processing_retries > 0:  # Media processing errors
+                    processing_retries -= 1
+                    logger.info("Media processing error, will retry...")
+                    continue
+            elif status_code == 'EXPIRED':
+                logger.error("Container expired before publishing")
+            elif status_code == 'TIMEOUT':
+                logger.error(f"Container status check timed out after {max_attempts} attempts.")
+            return status_code
 
     def publish_carousel(self, container_id: str) -> Optional[str]:
         """Publishes the carousel post using v22 API."""
@@ -440,10 +425,7 @@ class InstagramCarouselService(BaseInstagramService):
             'access_token': self.access_token
         }
 
-        if self._rate_limit_state.should_backoff():
-            wait_time = self._rate_limit_state.get_backoff_time()
-            logger.warning(f"Still in backoff period. Waiting {wait_time:.1f} seconds...")
-            time.sleep(wait_time)
+        self._check_backoff()
             
         try:
             # Add detailed logging to help diagnose issues
@@ -451,7 +433,7 @@ class InstagramCarouselService(BaseInstagramService):
             
             # Print detailed info about the request
             logger.info(f"Publishing to endpoint: {self.ig_user_id}/media_publish")
-            logger.info(f"Publishing with params: {params}")
+            logger.info(f"Publishing with params: {redact(params)}")
             
             endpoint = f"{self.ig_user_id}/media_publish"  # Removed API_VERSION prefix
             result = self._make_request('POST', endpoint, data=params)
@@ -488,15 +470,32 @@ class InstagramCarouselService(BaseInstagramService):
                 
             raise
 
+    def stage_carousel(self, media_urls: List[str], caption: str, media_size: Optional[int] = None) -> Optional[str]:
+        """
+        Creates the carousel container and waits until it is FINISHED, without publishing.
+        media_size (total bytes of the images, if known) tunes the status check schedule.
+        """
+        if len(media_urls) < 2 or len(media_urls) > 10:
+            raise ValueError(f"Invalid number of media URLs. Found: {len(media_urls)}, required: 2-10")
+
+        container_id = self.create_carousel_container(media_urls, caption)
+        if not container_id:
+            logger.error("Failed to create carousel container")
+            return None
+
+        status = self.wait_for_container_status(container_id, media_size=media_size)
+        if status != 'FINISHED':
+            logger.error(f"Container not ready. Final status: {status}")
+            return None
+
+        return container_id
+
     def post_carousel(self, media_urls: List[str], caption: str) -> Optional[str]:
         """Handles the full flow of creating and publishing a carousel post."""
         if len(media_urls) < 2 or len(media_urls) > 10:
             raise ValueError(f"Invalid number of media URLs. Found: {len(media_urls)}, required: 2-10")
 
-        if self._rate_limit_state.should_backoff():
-            wait_time = self._rate_limit_state.get_backoff_time()
-            logger.warning(f"Still in backoff period. Waiting {wait_time:.1f} seconds...")
-            time.sleep(wait_time)
+        self._check_backoff()
             
         max_attempts = 3
         base_delay = 30  # Increased from 15 to 30 seconds
@@ -517,7 +516,7 @@ class InstagramCarouselService(BaseInstagramService):
                 
                 # Add longer delay before publishing
                 logger.info("Adding extra delay before publishing...")
-                time.sleep(20)  # Increased from 10 to 20 seconds
+                self._sleep(20, 'publish_delay')  # Increased from 10 to 20 seconds
                 
                 # Publish carousel
                 post_id = self.publish_carousel(container_id)
@@ -536,7 +535,9 @@ class InstagramCarouselService(BaseInstagramService):
             except PermissionError as e:
                 if "request limit reached" in str(e).lower():
                     self._handle_rate_limit()
-                    continue
+                raise
+                
+            except (RateLimitError, TemporaryServerError):
                 raise
                 
             except Exception as e:
@@ -544,7 +545,7 @@ class InstagramCarouselService(BaseInstagramService):
                 if attempt < max_attempts - 1:
                     delay = base_delay * (2 ** attempt)
                     logger.info(f"Retrying in {delay} seconds...")
-                    time.sleep(delay)
+                    self._sleep(delay, 'retry_backoff')
                 else:
                     raise
                     
@@ -556,11 +557,7 @@ class InstagramCarouselService(BaseInstagramService):
         Returns a tuple (is_valid, missing_permissions)
         """
         try:
-            response = self._make_request(
-                "GET",
-                "debug_token",
-                params={"input_token": self.access_token}
-            )
+            response = token_cache.introspect(self)
             
             if not response or 'data' not in response:
                 return False, ["Unable to verify token"]
@@ -585,16 +582,20 @@ class InstagramCarouselService(BaseInstagramService):
         """Handle rate limiting with exponential backoff"""
         delay = self._rate_limit_state.record_error()
         logger.warning(f"Rate limit hit. Backing off for {delay:.1f} seconds...")
-        time.sleep(delay)
+        raise RateLimitError(f"Request limit reached, retry in {delay:.0f} seconds", delay)
+
+    def _check_backoff(self):
+        """Raise RateLimitError while still in the backoff period, instead of sleeping through it"""
+        if self._rate_limit_state.should_backoff():
+            elapsed = time.time() - self._rate_limit_state.last_error_time
+            wait_time = self._rate_limit_state.get_backoff_time() - elapsed
+            logger.warning(f"Still in backoff period. Retry in {wait_time:.1f} seconds")
+            raise RateLimitError(f"Still in backoff period, retry in {wait_time:.0f} seconds", wait_time)
 
     def debug_token(self):
         """Get detailed token information for debugging"""
         try:
-            return self._make_request(
-                "GET",
-                "debug_token",
-                params={"input_token": self.access_token}
-            )
+            return token_cache.introspect(self)
         except Exception as e:
             logger.error(f"Error getting token debug info: {e}")
             return None
@@ -10,6 +10,9 @@ from src.instagram.base_instagram_service import (
     BaseInstagramService, AuthenticationError, PermissionError,
     RateLimitError, MediaError, TemporaryServerError, InstagramAPIError
 )
+from src.instagram.container_poller import container_poller
+from src.instagram.state_store import state_store
+from src.instagram.pending_publisher import pending_publisher
 
 logger = logging.getLogger('InstagramPostService')
 
@@ -32,137 +35,32 @@ class InstagramPostService(BaseInstagramService):
             )
 
         super().__init__(access_token, ig_user_id)
-        self.state_file = 'api_state.json'
-        self.pending_containers = {}
-        self.stats = {
-            'successful_posts': 0,
-            'failed_posts': 0,
-            'rate_limited_posts': 0
+        # Stats and pending containers live in the shared state store (api_state.json)
+        self.state = state_store
+        # Pending containers (including those of previous runs) are published in the background
+        pending_publisher.register(self)
+
+    @property
+    def pending_containers(self):
+        """This account's containers waiting to be published after a rate limit (copy, by container ID)"""
+        return {
+            container_id: data for container_id, data in self.state.get_pending().items()
+            if data.get('ig_user_id', self.ig_user_id) == self.ig_user_id
         }
-        self._load_state()
-        
-        # Attempt to process any pending containers from previous runs
-        self._process_pending_containers()
 
-    def _load_state(self):
-        """Load persisted state from file"""
-        try:
-            if os.path.exists(self.state_file):
-                with open(self.state_file, 'r') as f:
-                    state = json.load(f)
-                    self.pending_containers = state.get('pending_containers', {})
-                    self.stats = state.get('stats', {
-                        'successful_posts': 0,
-                        'failed_posts': 0,
-                        'rate_limited_posts': 0
-                    })
-                    logger.info(f"Loaded {len(self.pending_containers)} pending containers from state file")
-        except Exception as e:
-            logger.error(f"Error loading state: {e}")
-            self.pending_containers = {}
-            self.stats = {
-                'successful_posts': 0,
-                'failed_posts': 0,
-                'rate_limited_posts': 0
-            }
-
-    def _save_state(self):
-        """Save current state to file"""
-        try:
-            state = {
-                'pending_containers': self.pending_containers,
-                'stats': self.stats,
-                'last_updated': datetime.now().isoformat()
-            }
-            with open(self.state_file, 'w') as f:
-                json.dump(state, f, indent=2)
-            logger.info(f"Saved state with {len(self.pending_containers)} pending containers")
-        except Exception as e:
-            logger.error(f"Error saving state: {e}")
+    @property
+    def stats(self):
+        """Posting statistics"""
+        return self.state.get_stats()
 
     def _update_stats(self, success=False, rate_limited=False):
         """Update posting statistics"""
         if success:
-            self.stats['successful_posts'] += 1
+            self.state.increment('successful_posts')
         elif rate_limited:
-            self.stats['rate_limited_posts'] += 1
+            self.state.increment('rate_limited_posts')
         else:
-            self.stats['failed_posts'] += 1
-        self._save_state()
-
-    def _process_pending_containers(self):
-        """Process any pending containers from previous runs"""
-        if not self.pending_containers:
-            return
-            
-        logger.info(f"Found {len(self.pending_containers)} pending containers to process")
-        processed_containers = []
-        
-        for container_id, container_data in list(self.pending_containers.items()):
-            try:
-                # Check if we're still within the backoff period
-                if container_data.get('next_attempt_time'):
-                    next_attempt_time = float(container_data['next_attempt_time'])
-                    if time.time() < next_attempt_time:
-                        wait_time = next_attempt_time - time.time()
-                        logger.info(f"Container {container_id} still in backoff period. Next attempt in {wait_time:.1f}s")
-                        continue
-                
-                # Check container status first
-                status = self.check_container_status(container_id)
-                if status != 'FINISHED':
-                    logger.warning(f"Container {container_id} not ready for publishing, status: {status}")
-                    if status in ['ERROR', 'EXPIRED', 'TIMEOUT']:
-                        processed_containers.append(container_id)
-                    continue
-                
-                # Attempt to publish
-                logger.info(f"Attempting to publish pending container: {container_id}")
-                post_id = self.publish_media(container_id)
-                
-                if post_id:
-                    logger.info(f"Successfully published pending container! ID: {post_id}")
-                    processed_containers.append(container_id)
-                    
-                    # Get permalink
-                    permalink = self.get_post_permalink(post_id)
-                    
-                    # If we have a callback URL in the container data, notify it
-                    if container_data.get('callback_url'):
-                        try:
-                            # Simplified callback, implement as needed
-                            pass
-                        except Exception as callback_err:
-                            logger.error(f"Error calling callback: {callback_err}")
-                
-            except RateLimitError as e:
-                # Update next attempt time and retry count
-                retry_count = container_data.get('retry_count', 0) + 1
-                next_attempt_time = time.time() + e.retry_seconds
-                
-                self.pending_containers[container_id].update({
-                    'retry_count': retry_count,
-                    'next_attempt_time': next_attempt_time,
-                    'last_error': str(e),
-                    'last_attempt': datetime.now().isoformat()
-                })
-                logger.warning(f"Rate limit hit for container {container_id}. Will retry after {e.retry_seconds}s (attempt {retry_count})")
-                
-                # If we've retried too many times, give up
-                if retry_count >= 5:
-                    logger.error(f"Too many retry attempts for container {container_id}, giving up")
-                    processed_containers.append(container_id)
-                    
-            except Exception as e:
-                logger.error(f"Error processing pending container {container_id}: {e}")
-                processed_containers.append(container_id)
-        
-        # Remove processed containers from pending list
-        for container_id in processed_containers:
-            self.pending_containers.pop(container_id, None)
-            
-        # Save updated state
-        self._save_state()
+            self.state.increment('failed_posts')
 
     def create_media_container(self, image_url, caption):
         """Creates a media container for the post."""
@@ -203,38 +101,32 @@ class InstagramPostService(BaseInstagramService):
             logger.error(f"Failed to check container status: {e}")
             raise
 
-    def wait_for_container_status(self, container_id, max_attempts=30, delay=10):
-        """Aguarda o container estar pronto, com backoff exponencial."""
-        for attempt in range(max_attempts):
-            try:
-                status = self.check_container_status(container_id)
-                if status == 'FINISHED':
-                    logger.info(f"Container pronto para publicação após {attempt+1} verificações")
-                    return status
-                elif status in ['ERROR', 'EXPIRED']:
-                    logger.error(f"Container falhou com status: {status}")
-                    return status
-                
-                # Usar backoff exponencial como no ReelsPublisher
-                backoff_time = delay * (1.5 ** attempt) + random.uniform(0, 3)
-                max_backoff = 45  # Limitar o tempo máximo de espera
-                backoff_time = min(backoff_time, max_backoff)
-                
-                logger.info(f"Tentativa {attempt + 1}/{max_attempts}. Aguardando {backoff_time:.1f}s...")
-                time.sleep(backoff_time)
-                
-            except RateLimitError as e:
-                logger.warning(f"Rate limit hit while checking status. Waiting {e.retry_seconds}s...")
-                time.sleep(e.retry_seconds)
-            except Exception as e:
-                logger.error(f"Error checking container status: {str(e)}")
-                time.sleep(delay)
-        
-        logger.error(f"Container status check timed out after {max_attempts} attempts.")
-        return 'TIMEOUT'
+    def wait_for_container_status(self, container_id, max_attempts=30, delay=10, media_size=None):
+        """Aguarda o container estar pronto; as verificações são feitas pelo container_poller."""
+        try:
+            status = container_poller.wait(
+                self, container_id, max_checks=max_attempts, delay=delay,
+                media_type='IMAGE', media_size=media_size
+            ).get('status_code')
+        except RateLimitError as e:
+            # Não dormir aqui: a fila reagenda o trabalho após retry_seconds
+            logger.warning(f"Rate limit hit while checking status. Retry in {e.retry_seconds}s")
+            raise
+
+        if status == 'FINISHED':
+            logger.info(f"Container {container_id} pronto para publicação")
+        elif status in ['ERROR', 'EXPIRED']:
+            logger.error(f"Container falhou com status: {status}")
+        return status
 
-    def publish_media(self, media_container_id):
-        """Publishes the media container to Instagram."""
+    def publish_media(self, media_container_id, save_pending=True):
+        """
+        Publishes the media container to Instagram.
+
+        On a rate limit the container is saved as pending and published later by
+        the pending_publisher, unless save_pending is False (the caller retries it,
+        e.g. the post queue), so the same container is never published twice.
+        """
         params = {
             'creation_id': media_container_id,
         }
@@ -247,9 +139,7 @@ class InstagramPostService(BaseInstagramService):
                 logger.info(f"Publication initiated with ID: {post_id}")
                 
                 # If this was a pending container, remove it from the list
-                if media_container_id in self.pending_containers:
-                    self.pending_containers.pop(media_container_id)
-                    self._save_state()
+                self.state.remove_pending(media_container_id)
                 
                 self._update_stats(success=True)
                 return post_id
@@ -259,17 +149,22 @@ class InstagramPostService(BaseInstagramService):
             return None
             
         except RateLimitError as e:
+            self._update_stats(rate_limited=True)
+            if not save_pending:
+                raise
+
             # Save container to pending list with retry information
-            self.pending_containers[media_container_id] = {
+            next_attempt_time = time.time() + e.retry_seconds
+            self.state.put_pending(media_container_id, {
                 'container_id': media_container_id,
+                'ig_user_id': self.ig_user_id,
                 'retry_count': 1,
-                'next_attempt_time': time.time() + e.retry_seconds,
+                'next_attempt_time': next_attempt_time,
                 'last_error': str(e),
                 'created_at': datetime.now().isoformat(),
                 'last_attempt': datetime.now().isoformat()
-            }
-            self._save_state()
-            self._update_stats(rate_limited=True)
+            })
+            pending_publisher.schedule(self, media_container_id, next_attempt_time)
             
             logger.warning(f"Rate limit reached. Container {media_container_id} saved for later publishing. Will retry after {e.retry_seconds} seconds.")
             # Re-raise to allow caller to handle
@@ -14,12 +14,13 @@ import logging
 import random
 from datetime import datetime
 from dotenv import load_dotenv
-from imgurpython import ImgurClient
 from moviepy.editor import VideoFileClip
 from src.instagram.base_instagram_service import (
     BaseInstagramService, AuthenticationError, PermissionError, 
     RateLimitError, MediaError, TemporaryServerError, InstagramAPIError
 )
+from src.instagram.container_poller import container_poller
+from src.instagram.media_host import media_host
 
 logger = logging.getLogger('ReelsPublisher')
 
@@ -133,35 +134,31 @@ class ReelsPublisher(BaseInstagramService):
             logger.error(f"Error publishing reels: {e}")
             raise
 
-    def wait_for_container_status(self, container_id, max_attempts=30, delay=10):
-        """Aguarda o container estar pronto."""
-        for attempt in range(max_attempts):
-            try:
-                status = self.check_container_status(container_id)
-                if status == 'FINISHED':
-                    return status
-                elif status in ['ERROR', 'EXPIRED']:
-                    logger.error(f"Container failed with status: {status}")
-                    return status
-                
-                backoff_time = delay * (2 ** attempt) + random.uniform(0, 5)
-                logger.info(f"Tentativa {attempt + 1}/{max_attempts}. Aguardando {backoff_time:.1f}s...")
-                time.sleep(backoff_time)
-                
-            except RateLimitError as e:
-                logger.warning(f"Rate limit hit while checking status. Waiting {e.retry_seconds}s...")
-                time.sleep(e.retry_seconds)
-            except Exception as e:
-                logger.error(f"Error checking container status: {str(e)}")
-                time.sleep(delay)
-        
-        logger.error(f"Container status check timed out after {max_attempts} attempts.")
-        return 'TIMEOUT'
+    def wait_for_container_status(self, container_id, max_attempts=30, delay=10, media_size=None):
+        """Aguarda o container estar pronto; as verificações são feitas pelo container_poller."""
+        try:
+            status = container_poller.wait(
+                self, container_id, max_checks=max_attempts, delay=delay,
+                media_type='REELS', media_size=media_size
+            ).get('status_code')
+        except RateLimitError as e:
+            # Não dormir aqui: a fila reagenda o trabalho após retry_seconds
+            logger.warning(f"Rate limit hit while checking status. Retry in {e.retry_seconds}s")
+            raise
 
-    def post_reels(self, video_url, caption, share_to_feed=True,
-                  audio_name=None, thumbnail_url=None, user_tags=None,
-                  max_retries=30, retry_interval=10):
-        """Fluxo completo para postar um Reels."""
+        if status in ['ERROR', 'EXPIRED']:
+            logger.error(f"Container failed with status: {status}")
+        return status
+
+    def stage_reels(self, video_url, caption, share_to_feed=True,
+                    audio_name=None, thumbnail_url=None, user_tags=None,
+                    max_retries=30, retry_interval=10, media_size=None):
+        """
+        Cria o container do Reels e aguarda o processamento, sem publicar.
+        media_size (bytes do vídeo, se conhecido) ajusta o agendamento das verificações.
+        Returns:
+            str: ID do container pronto (FINISHED) ou None
+        """
         container_id = self.create_reels_container(
             video_url, caption, share_to_feed, audio_name, thumbnail_url, user_tags
         )
@@ -170,12 +167,28 @@ class ReelsPublisher(BaseInstagramService):
             return None
 
         logger.info(f"Aguardando processamento do Reels... (máx. {max_retries} tentativas)")
-        status = self.wait_for_container_status(container_id, max_attempts=max_retries, delay=retry_interval)
+        status = self.wait_for_container_status(
+            container_id, max_attempts=max_retries, delay=retry_interval, media_size=media_size
+        )
         
         if status != 'FINISHED':
             logger.error(f"Processamento do vídeo falhou com status: {status}")
             return None
 
+        return container_id
+
+    def post_reels(self, video_url, caption, share_to_feed=True,
+                  audio_name=None, thumbnail_url=None, user_tags=None,
+                  max_retries=30, retry_interval=10):
+        """Fluxo completo para postar um Reels."""
+        container_id = self.stage_reels(
+            video_url, caption, share_to_feed, audio_name, thumbnail_url, user_tags,
+            max_retries=max_retries, retry_interval=retry_interval
+        )
+        
+        if not container_id:
+            return None
+
         post_id = self.publish_reels(container_id)
         if not post_id:
             return None
@@ -205,31 +218,11 @@ class ReelsPublisher(BaseInstagramService):
             return None
 
         final_caption = self._format_caption_with_hashtags(caption, hashtags)
-        thumbnail_url = None
         
         try:
-            # Upload video to Imgur
-            imgur_client = ImgurClient(
-                os.getenv('IMGUR_CLIENT_ID'),
-                os.getenv('IMGUR_CLIENT_SECRET')
-            )
-            
-            # Upload thumbnail if provided
-            if thumbnail_path and os.path.exists(thumbnail_path):
-                logger.info(f"Enviando thumbnail personalizada: {thumbnail_path}")
-                thumb_result = imgur_client.upload_from_path(thumbnail_path)
-                if thumb_result and 'link' in thumb_result:
-                    thumbnail_url = thumb_result['link']
-                    logger.info(f"Thumbnail enviada: {thumbnail_url}")
-
-            logger.info(f"Enviando vídeo para Imgur...")
-            video_result = imgur_client.upload_from_path(video_path)
-            if not video_result or 'link' not in video_result:
-                logger.error("Falha no upload do vídeo para Imgur")
+            video_url, thumbnail_url = self._upload_video(video_path, thumbnail_path)
+            if not video_url:
                 return None
-                
-            video_url = video_result['link']
-            logger.info(f"Vídeo disponível em: {video_url}")
 
             result = self.post_reels(
                 video_url=video_url,
@@ -241,10 +234,72 @@ class ReelsPublisher(BaseInstagramService):
             
             return result
             
+        except (RateLimitError, TemporaryServerError):
+            # Falhas temporárias: a fila tenta novamente mais tarde
+            raise
         except Exception as e:
             logger.exception(f"Erro na publicação do Reels: {e}")
             return None
 
+    def stage_local_video_to_reels(self, video_path, caption, hashtags=None,
+                                   thumbnail_path=None, share_to_feed=True, audio_name=None):
+        """
+        Envia um vídeo local e prepara o container do Reels sem publicá-lo.
+        Returns:
+            str: ID do container pronto (FINISHED) ou None
+        """
+        if not os.path.exists(video_path):
+            logger.error(f"Arquivo de vídeo não encontrado: {video_path}")
+            return None
+
+        final_caption = self._format_caption_with_hashtags(caption, hashtags)
+        
+        try:
+            video_url, thumbnail_url = self._upload_video(video_path, thumbnail_path)
+            if not video_url:
+                return None
+
+            return self.stage_reels(
+                video_url=video_url,
+                caption=final_caption,
+                share_to_feed=share_to_feed,
+                audio_name=audio_name,
+                thumbnail_url=thumbnail_url,
+                media_size=os.path.getsize(video_path)
+            )
+            
+        except (RateLimitError, TemporaryServerError):
+            raise
+        except Exception as e:
+            logger.exception(f"Erro na preparação do Reels: {e}")
+            return None
+
+    def _upload_video(self, video_path, thumbnail_path=None):
+        """
+        Publica o vídeo (e a thumbnail, se houver) no media host (Imgur ou servidor local).
+        Returns:
+            tuple: (video_url, thumbnail_url) - video_url é None em caso de falha
+        """
+        thumbnail_url = None
+        
+        # Upload thumbnail if provided
+        if thumbnail_path and os.path.exists(thumbnail_path):
+            logger.info(f"Enviando thumbnail personalizada: {thumbnail_path}")
+            thumb_result = media_host.publish(thumbnail_path)
+            if thumb_result and thumb_result.get('url'):
+                thumbnail_url = thumb_result['url']
+                logger.info(f"Thumbnail enviada: {thumbnail_url}")
+
+        logger.info(f"Enviando vídeo para o media host...")
+        video_result = media_host.publish(video_path)
+        if not video_result or not video_result.get('url'):
+            logger.error("Falha no upload do vídeo para o media host")
+            return None, thumbnail_url
+            
+        video_url = video_result['url']
+        logger.info(f"Vídeo disponível em: {video_url}")
+        return video_url, thumbnail_url
+
     def _format_caption_with_hashtags(self, caption, hashtags=None):
         """Formata a legenda com hashtags."""
         if not hashtags:
@@ -2,8 +2,8 @@ import os
 import logging
 from typing import Optional, Tuple
 import moviepy.editor as mp
-from imgurpython import ImgurClient
 from dotenv import load_dotenv
+from src.instagram.media_host import media_host
 
 logger = logging.getLogger(__name__)
 
@@ -26,12 +26,9 @@ class VideoUploader:
     }
 
     def __init__(self):
-        """Initialize with Imgur client."""
+        """Initialize with the configured media host (Imgur or local server)."""
         load_dotenv()
-        self.imgur_client = ImgurClient(
-            os.getenv('IMGUR_CLIENT_ID'),
-            os.getenv('IMGUR_CLIENT_SECRET')
-        )
+        self.media_host = media_host
 
     def validate_video(self, video_path: str) -> Tuple[bool, str]:
         """
@@ -76,10 +73,10 @@ class VideoUploader:
 
     def upload_video(self, video_path: str) -> Optional[dict]:
         """
-        Uploads video to Imgur.
+        Publishes video on the media host.
         
         Returns:
-            Optional[dict]: Upload response with URL if successful
+            Optional[dict]: Upload response with URL ('url' and 'link') if successful
         """
         try:
             # First validate the video
@@ -88,15 +85,15 @@ class VideoUploader:
                 logger.error(f"Video validation failed: {message}")
                 return None
 
-            logger.info(f"Uploading video to Imgur: {video_path}")
-            response = self.imgur_client.upload_from_path(video_path)
+            logger.info(f"Publishing video on media host: {video_path}")
+            response = self.media_host.publish(video_path)
             
-            if not response or 'link' not in response:
-                logger.error("Failed to get upload URL from Imgur")
+            if not response or not response.get('url'):
+                logger.error("Failed to get upload URL from media host")
                 return None
 
-            logger.info(f"Video uploaded successfully. URL: {response['link']}")
-            return response
+            logger.info(f"Video uploaded successfully. URL: {response['url']}")
+            return dict(response, link=response['url'])
 
         except Exception as e:
             logger.error(f"Error uploading video: {str(e)}")
@@ -104,7 +101,7 @@ class VideoUploader:
 
     def delete_video(self, delete_hash: str) -> bool:
         """
-        Deletes a video from Imgur using its delete hash.
+        Releases a video from the media host using its delete hash.
         
         Returns:
             bool: True if deletion was successful
@@ -114,7 +111,7 @@ class VideoUploader:
                 return False
 
             logger.info(f"Deleting video with hash: {delete_hash}")
-            return bool(self.imgur_client.delete_image(delete_hash))
+            return bool(self.media_host.delete(delete_hash))
 
         except Exception as e:
             logger.error(f"Error deleting video: {str(e)}")
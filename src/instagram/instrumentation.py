@@ -0,0 +1,203 @@
+import re
+import time
+import logging
+import threading
+
+logger = logging.getLogger('Instrumentation')
+
+# Request fields never written to logs or passed to hooks in clear text
+REDACTED_FIELDS = ('access_token', 'input_token', 'client_secret', 'caption')
+
+def redact(params):
+    """Copy of request params/data safe for logs: secrets and captions are masked"""
+    if not isinstance(params, dict):
+        return params
+    safe = {}
+    for key, value in params.items():
+        if key in REDACTED_FIELDS and value:
+            safe[key] = f"<{len(str(value))} chars>" if key == 'caption' else '***'
+        else:
+            safe[key] = value
+    return safe
+
+def endpoint_name(endpoint):
+    """Endpoint with object IDs replaced, so metrics group by operation ("{id}/media")"""
+    name = re.sub(r'\d{5,}', '{id}', (endpoint or '').split('?')[0].strip('/'))
+    return name or 'root'
+
+class Histogram:
+    """Fixed-bucket latency histogram (seconds)"""
+
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.BUCKETS) and value > self.BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile"""
+        if not self.count:
+            return 0
+        target = self.count * p / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.BUCKETS[index] if index < len(self.BUCKETS) else self.max
+        return self.max
+
+    def snapshot(self):
+        buckets = {f"le_{bound}": count for bound, count in zip(self.BUCKETS, self.counts)}
+        buckets["le_inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 4) if self.count else 0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "max": round(self.max, 4),
+            "buckets": buckets
+        }
+
+class Instrumentation:
+    """
+    Per-request metrics for the Graph API clients.
+
+    _make_request reports every call here: latency per endpoint, transport
+    retries, bytes in and out, errors and rate-limit hits. Time spent
+    sleeping (pacing, backoff) is reported separately, so slow jobs can be
+    split into our own work, waiting and Graph API latency. Hooks receive
+    each event as a dict (with redacted params) and can be added by tests or
+    exporters.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hooks = []
+        self.reset()
+
+    def reset(self):
+        """Clear all metrics (hooks are kept)"""
+        with self._lock:
+            self._endpoints = {}  # "METHOD endpoint" -> {"latency": Histogram, "errors", ...}
+            self._totals = {
+                "requests": 0,
+                "errors": 0,
+                "retries": 0,
+                "rate_limit_hits": 0,
+                "bytes_out": 0,
+                "bytes_in": 0
+            }
+            self._errors = {}  # exception type -> count
+            self._sleeps = {}  # reason -> {"count", "seconds"}
+            self._started_at = time.time()
+
+    def add_hook(self, hook):
+        """Call hook(event) for every recorded request and sleep"""
+        with self._lock:
+            self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        with self._lock:
+            if hook in self._hooks:
+                self._hooks.remove(hook)
+
+    def record_request(self, method, endpoint, duration, status=None, retries=0,
+                       bytes_out=0, bytes_in=0, error=None, params=None, account_id=None):
+        """
+        Record one API call
+
+        Args:
+            method (str): HTTP method
+            endpoint (str): Endpoint as passed to _make_request
+            duration (float): Seconds spent in the HTTP call (pacing excluded)
+            status (int): HTTP status, if a response was received
+            retries (int): Transport-level retries made by the HTTP adapter
+            bytes_out, bytes_in (int): Request and response body sizes
+            error (Exception): Exception raised for the call, if any
+            params (dict): Request params/data (redacted before reaching hooks)
+            account_id (str): Instagram account of the call
+        """
+        name = f"{method} {endpoint_name(endpoint)}"
+        error_type = type(error).__name__ if error is not None else None
+        rate_limited = error_type == 'RateLimitError'
+        with self._lock:
+            metrics = self._endpoints.get(name)
+            if metrics is None:
+                metrics = self._endpoints[name] = {"latency": Histogram(), "errors": 0, "retries": 0, "rate_limit_hits": 0}
+            metrics["latency"].observe(duration)
+            metrics["retries"] += retries
+            self._totals["requests"] += 1
+            self._totals["retries"] += retries
+            self._totals["bytes_out"] += bytes_out
+            self._totals["bytes_in"] += bytes_in
+            if error_type:
+                metrics["errors"] += 1
+                self._totals["errors"] += 1
+                self._errors[error_type] = self._errors.get(error_type, 0) + 1
+            if rate_limited:
+                metrics["rate_limit_hits"] += 1
+                self._totals["rate_limit_hits"] += 1
+            hooks = list(self._hooks)
+
+        if hooks:
+            self._emit(hooks, {
+                "type": "request", "method": method, "endpoint": endpoint_name(endpoint),
+                "duration": duration, "status": status, "retries": retries,
+                "bytes_out": bytes_out, "bytes_in": bytes_in, "error": error_type,
+                "rate_limited": rate_limited, "params": redact(params), "account_id": account_id,
+                "timestamp": time.time()
+            })
+
+    def record_sleep(self, reason, seconds, account_id=None):
+        """Record time a request spent waiting before being sent (pacing, backoff)"""
+        if seconds <= 0:
+            return
+        with self._lock:
+            sleep = self._sleeps.setdefault(reason, {"count": 0, "seconds": 0.0})
+            sleep["count"] += 1
+            sleep["seconds"] += seconds
+            hooks = list(self._hooks)
+        if hooks:
+            self._emit(hooks, {"type": "sleep", "reason": reason, "seconds": seconds,
+                               "account_id": account_id, "timestamp": time.time()})
+
+    def get_metrics(self):
+        """Snapshot of every metric, for the monitoring server and tests"""
+        with self._lock:
+            return {
+                "since": self._started_at,
+                "totals": dict(self._totals),
+                "errors": dict(self._errors),
+                "sleeps": {reason: {"count": sleep["count"], "seconds": round(sleep["seconds"], 3)}
+                           for reason, sleep in self._sleeps.items()},
+                "endpoints": {
+                    name: {
+                        "latency": metrics["latency"].snapshot(),
+                        "errors": metrics["errors"],
+                        "retries": metrics["retries"],
+                        "rate_limit_hits": metrics["rate_limit_hits"]
+                    }
+                    for name, metrics in self._endpoints.items()
+                }
+            }
+
+    def _emit(self, hooks, event):
+        for hook in hooks:
+            try:
+                hook(event)
+            except Exception as e:
+                logger.warning(f"Instrumentation hook failed: {e}")
+
+# Global instance shared by every Instagram service in the process
+instrumentation = Instrumentation()
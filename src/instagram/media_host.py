@@ -0,0 +1,331 @@
+import os
+import re
+import abc
+import hmac
+import time
+import sqlite3
+import hashlib
+import logging
+import secrets
+import mimetypes
+import threading
+from urllib.parse import quote, urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.utils.paths import Paths
+
+logger = logging.getLogger('MediaHost')
+
+class MediaHost(abc.ABC):
+    """
+    Where processed media is put so Instagram can fetch it by URL.
+
+    publish(path) returns {"id", "url", "deletehash", "image_path"} (the
+    format ImageUploader always returned) and delete(deletehash) releases
+    the media once the container no longer needs it. MEDIA_HOST selects the
+    implementation: "imgur" (default) or "local".
+    """
+
+    @abc.abstractmethod
+    def publish(self, path):
+        """Make a file reachable by URL"""
+
+    @abc.abstractmethod
+    def delete(self, deletehash):
+        """Release a published file"""
+
+    def start(self):
+        """Start serving media, for hosts that serve it themselves"""
+
+    def get_stats(self):
+        return {}
+
+class ImgurMediaHost(MediaHost):
+    """Uploads every file to Imgur (anonymous uploads, deleted by deletehash)"""
+
+    def __init__(self):
+        self._uploader = None
+        self._lock = threading.Lock()
+        self.stats = {"published": 0, "deleted": 0}
+
+    @property
+    def uploader(self):
+        # Imgur client (and its credentials check) only when first needed
+        with self._lock:
+            if self._uploader is None:
+                from src.instagram.image_uploader import ImageUploader
+                self._uploader = ImageUploader()
+            return self._uploader
+
+    def publish(self, path):
+        result = self.uploader.upload_from_path(path)
+        with self._lock:
+            self.stats["published"] += 1
+        return result
+
+    def delete(self, deletehash):
+        deleted = self.uploader.delete_image(deletehash)
+        if deleted:
+            with self._lock:
+                self.stats["deleted"] += 1
+        return deleted
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, type="imgur")
+
+class LocalMediaHost(MediaHost):
+    """
+    Serves processed files from our own disk under short-lived signed URLs.
+
+    Publishing a file only registers it: the URL carries the media ID, an
+    expiry timestamp and an HMAC-SHA256 signature of both, so it cannot be
+    guessed or extended. The embedded server answers GET/HEAD with range
+    support and streams files with sendfile. Entries expire after TTL
+    seconds (or when deleted) and are purged automatically; the files
+    themselves belong to the pipeline, which removes its temporary files.
+
+    Published files are registered in the media_files table of the shared
+    queue database, so with worker processes (POST_QUEUE_MODE=external plus
+    src.worker) the server runs only in the webhook process and serves the
+    files every worker registers. Workers never bind MEDIA_HOST_PORT, and all
+    processes must share MEDIA_HOST_SECRET and the disk the media is on.
+
+    MEDIA_HOST_BASE_URL must be the public address Instagram reaches the
+    server at (usually an HTTPS reverse proxy in front of MEDIA_HOST_PORT).
+    """
+
+    # Seconds a published URL stays valid
+    TTL = int(os.getenv("MEDIA_HOST_URL_TTL", 3600))
+    PATH_PATTERN = re.compile(r'^/media/([A-Za-z0-9_-]+)/[^/]*$')
+    RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+    def __init__(self, base_url=None, bind=None, port=None, secret=None, ttl=None, db_path=None, serve=None):
+        """
+        Args:
+            db_path (str): Database the published files are registered in
+                (default: MEDIA_HOST_DB, or the queue database POST_QUEUE_DB)
+            serve (bool): Whether this process runs the HTTP server (default:
+                every process except queue workers)
+
+        Raises:
+            ValueError: If MEDIA_HOST_SECRET is missing with worker processes
+        """
+        mode = os.getenv("POST_QUEUE_MODE", "local")
+        self.bind = bind or os.getenv("MEDIA_HOST_BIND", "0.0.0.0")
+        self.port = int(port if port is not None else os.getenv("MEDIA_HOST_PORT", 6003))
+        self.base_url = (base_url or os.getenv("MEDIA_HOST_BASE_URL") or "").rstrip("/")
+        self.serve = serve if serve is not None else mode != "worker"
+        secret = secret or os.getenv("MEDIA_HOST_SECRET")
+        if not secret and mode in ("external", "worker"):
+            # URLs signed by a worker are checked by the webhook process
+            raise ValueError("MEDIA_HOST_SECRET é obrigatório com MEDIA_HOST=local e processos worker")
+        # Without a configured secret, URLs are only valid while this process runs
+        self.secret = secret.encode() if secret else secrets.token_bytes(32)
+        self.ttl = ttl or self.TTL
+        self.db_path = (db_path or os.getenv("MEDIA_HOST_DB") or os.getenv("POST_QUEUE_DB")
+                        or os.path.join(Paths.ROOT_DIR, "post_queue.db"))
+        self._lock = threading.Lock()
+        self._db = None
+        self._server = None
+        self.stats = {"published": 0, "deleted": 0, "expired": 0, "requests": 0,
+                      "range_requests": 0, "bytes_served": 0, "rejected": 0}
+
+    def _conn(self):
+        # Called with self._lock held: one connection per process, shared by the server threads
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS media_files (
+                    media_id TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+        return self._db
+
+    def start(self):
+        """Start the embedded HTTP server (once; queue workers leave it to the webhook process)"""
+        if not self.serve:
+            return
+        with self._lock:
+            if self._server is not None:
+                return
+            handler = type("MediaRequestHandler", (_MediaRequestHandler,), {"media_host": self})
+            self._server = ThreadingHTTPServer((self.bind, self.port), handler)
+            self._server.daemon_threads = True
+            self.port = self._server.server_address[1]
+            if not self.base_url:
+                host = "127.0.0.1" if self.bind in ("0.0.0.0", "") else self.bind
+                self.base_url = f"http://{host}:{self.port}"
+                logger.warning(f"MEDIA_HOST_BASE_URL not set, serving media at {self.base_url}")
+            threading.Thread(target=self._server.serve_forever, name="MediaHost", daemon=True).start()
+        logger.info(f"Local media host listening on {self.bind}:{self.port}")
+
+    def _public_url(self):
+        if not self.base_url and not self.serve:
+            self.base_url = f"http://127.0.0.1:{self.port}"
+            logger.warning(f"MEDIA_HOST_BASE_URL not set, assuming media is served at {self.base_url}")
+        return self.base_url
+
+    def stop(self):
+        with self._lock:
+            server, self._server = self._server, None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    def publish(self, path):
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"O arquivo especificado não foi encontrado: {path}")
+        self.start()
+        self._purge_expired()
+
+        media_id = secrets.token_urlsafe(16)
+        expires = int(time.time() + self.ttl)
+        with self._lock:
+            self._conn().execute("INSERT INTO media_files (media_id, path, expires_at) VALUES (?, ?, ?)",
+                                 (media_id, os.path.abspath(path), expires))
+            self.stats["published"] += 1
+        url = (f"{self._public_url()}/media/{media_id}/{quote(os.path.basename(path))}"
+               f"?expires={expires}&signature={self.sign(media_id, expires)}")
+        logger.info(f"Serving {path} at /media/{media_id} until {expires}")
+        return {"id": media_id, "url": url, "deletehash": media_id, "image_path": path}
+
+    def delete(self, deletehash):
+        with self._lock:
+            if self._conn().execute("DELETE FROM media_files WHERE media_id = ?", (deletehash,)).rowcount:
+                self.stats["deleted"] += 1
+        return True
+
+    def sign(self, media_id, expires):
+        return hmac.new(self.secret, f"{media_id}:{expires}".encode(), hashlib.sha256).hexdigest()
+
+    def lookup(self, media_id, expires, signature):
+        """
+        File behind a signed URL
+
+        Returns:
+            tuple: (path, None), or (None, HTTP status) when the URL is invalid,
+                expired or no longer published
+        """
+        try:
+            expires = int(expires)
+        except (TypeError, ValueError):
+            return None, 403
+        if not signature or not hmac.compare_digest(self.sign(media_id, expires), signature):
+            return None, 403
+        if time.time() > expires:
+            return None, 410
+        with self._lock:
+            row = self._conn().execute("SELECT path FROM media_files WHERE media_id = ?", (media_id,)).fetchone()
+        if row is None or not os.path.isfile(row[0]):
+            return None, 404
+        return row[0], None
+
+    def get_stats(self):
+        with self._lock:
+            serving = self._conn().execute("SELECT COUNT(*) FROM media_files").fetchone()[0]
+            return dict(self.stats, type="local", serving=serving, base_url=self.base_url)
+
+    def _purge_expired(self):
+        with self._lock:
+            self.stats["expired"] += self._conn().execute(
+                "DELETE FROM media_files WHERE expires_at < ?", (time.time(),)).rowcount
+
+    def _count(self, **amounts):
+        with self._lock:
+            for key, amount in amounts.items():
+                self.stats[key] += amount
+
+class _MediaRequestHandler(BaseHTTPRequestHandler):
+    """Serves the files of a LocalMediaHost (bound as the media_host class attribute)"""
+
+    media_host = None
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body):
+        host = self.media_host
+        url = urlparse(self.path)
+        match = host.PATH_PATTERN.match(url.path)
+        query = parse_qs(url.query)
+        if not match:
+            host._count(rejected=1)
+            return self._send_error(404)
+        path, status = host.lookup(match.group(1), query.get("expires", [None])[0], query.get("signature", [None])[0])
+        if path is None:
+            host._count(rejected=1)
+            return self._send_error(status)
+
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        range_header = self.headers.get("Range")
+        if range_header:
+            byte_range = self._parse_range(range_header, size)
+            if byte_range is None:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            start, end = byte_range
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        length = end - start + 1
+        self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Cache-Control", "private, no-store")
+        self.end_headers()
+        host._count(requests=1, range_requests=1 if range_header else 0)
+
+        if send_body and length > 0:
+            with open(path, "rb") as f:
+                # The headers are already flushed: the body goes from the file straight to the socket
+                sent = self.connection.sendfile(f, start, length)
+            host._count(bytes_served=sent)
+
+    @staticmethod
+    def _parse_range(header, size):
+        """(start, end) of a single "bytes=" range, or None if it cannot be satisfied"""
+        match = LocalMediaHost.RANGE_PATTERN.match(header.strip())
+        if not match or size == 0 or match.group(1) == match.group(2) == "":
+            return None
+        first, last = match.groups()
+        if first == "":
+            # Suffix range: the last N bytes
+            if int(last) == 0:
+                return None
+            return max(size - int(last), 0), size - 1
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if start > end:
+            return None
+        return start, end
+
+    def _send_error(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+def create_media_host(kind=None):
+    """Media host selected by MEDIA_HOST ("imgur" or "local")"""
+    kind = (kind or os.getenv("MEDIA_HOST", "imgur")).lower()
+    if kind == "local":
+        return LocalMediaHost()
+    if kind == "imgur":
+        return ImgurMediaHost()
+    raise ValueError(f"MEDIA_HOST inválido: {kind} (use imgur ou local)")
+
+# Global instance used by every publishing path
+media_host = create_media_host()
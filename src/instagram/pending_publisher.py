@@ -0,0 +1,287 @@
+import os
+import time
+import heapq
+import uuid
+import logging
+import threading
+from datetime import datetime
+from src.instagram.rate_governor import rate_governor
+from src.instagram.state_store import state_store
+
+logger = logging.getLogger('PendingPublisher')
+
+class PendingPublisher:
+    """
+    Background publisher for containers left pending by a rate limit.
+
+    When a publish call hits a rate limit outside the post queue, the
+    container is saved in the state store (api_state.json) with its
+    next_attempt_time. This daemon keeps those containers in a min-heap
+    ordered by next_attempt_time, publishes each one as soon as it is due and
+    the rate governor has publish quota for its account, and notifies
+    subscribers of the outcome. Containers from previous runs are loaded from
+    the state store when the daemon starts, so building a service never
+    walks the pending list or calls the API.
+
+    Every process (the webhook and each queue worker) shares the state store
+    and runs a publisher, so an attempt first claims the container in the
+    store: only the process holding the claim checks and publishes it, and
+    the others look again when the claim expires.
+    """
+
+    # Publish attempts before a pending container is given up
+    MAX_RETRIES = int(os.getenv("INSTAGRAM_PENDING_MAX_RETRIES", 5))
+    # Seconds before checking again a container that is still processing
+    NOT_READY_DELAY = 30
+    # Seconds a claim keeps other processes off a container (covers one full attempt)
+    CLAIM_TTL = 300
+
+    def __init__(self, store=None, owner=None):
+        self.store = store or state_store
+        self._owner = owner  # Name of this publisher in its claims (default: the process ID)
+        self._cond = threading.Condition()
+        self._heap = []       # (next_attempt_time, sequence, container_id)
+        self._scheduled = {}  # container_id -> next_attempt_time of its live heap item
+        self._sequence = 0
+        self._services = {}   # ig_user_id -> service used to publish its containers
+        self._subscribers = {}  # token -> callback
+        self._loaded = False
+        self._thread = None
+        self.stats = {
+            "published": 0,
+            "already_published": 0,
+            "failed": 0,
+            "gave_up": 0,
+            "rate_limited": 0,
+            "deferred": 0
+        }
+
+    def register(self, service):
+        """
+        Make a service available to publish its account's pending containers and
+        start the daemon (no API calls are made here)
+        """
+        with self._cond:
+            self._services[service.ig_user_id] = service
+        self.start()
+
+    def start(self):
+        """Load the pending containers from the state store (once) and start the daemon"""
+        with self._cond:
+            if not self._loaded:
+                self._loaded = True
+                pending = self.store.get_pending()
+                for container_id, data in pending.items():
+                    self._push(container_id, float(data.get('next_attempt_time') or 0))
+                if pending:
+                    logger.info(f"Loaded {len(pending)} pending containers to publish")
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="PendingPublisher", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def schedule(self, service, container_id, next_attempt_time):
+        """
+        Publish a container saved in the state store once next_attempt_time is reached
+
+        Args:
+            service (InstagramPostService): Service whose account owns the container
+            container_id (str): Pending container
+            next_attempt_time (float): Timestamp of the next publish attempt
+        """
+        with self._cond:
+            self._services[service.ig_user_id] = service
+            self._push(container_id, next_attempt_time)
+        self.start()
+
+    def subscribe(self, callback):
+        """
+        Register callback(container_id, event) for the outcome of each pending container
+
+        The event has 'status' ('published', 'failed' or 'gave_up'), 'ig_user_id',
+        and 'post_id'/'permalink' or 'error'.
+
+        Returns:
+            str: Token to cancel the subscription with unsubscribe
+        """
+        token = str(uuid.uuid4())
+        with self._cond:
+            self._subscribers[token] = callback
+        return token
+
+    def unsubscribe(self, token):
+        """Cancel a subscription made with subscribe"""
+        with self._cond:
+            return self._subscribers.pop(token, None) is not None
+
+    def get_stats(self):
+        """Counters and containers waiting to be published"""
+        with self._cond:
+            stats = dict(self.stats)
+            stats["pending"] = len(self._scheduled)
+            stats["next_attempt_in"] = round(max(min(self._scheduled.values()) - time.time(), 0), 1) if self._scheduled else None
+        return stats
+
+    def _push(self, container_id, next_attempt_time):
+        self._sequence += 1
+        self._scheduled[container_id] = next_attempt_time
+        heapq.heappush(self._heap, (next_attempt_time, self._sequence, container_id))
+        self._cond.notify()
+
+    def _run(self):
+        while True:
+            try:
+                container_id = self._next_due()
+                self._attempt(container_id)
+            except Exception as e:
+                logger.error(f"Pending publisher error: {e}")
+                time.sleep(1)
+
+    def _next_due(self):
+        """Wait for the earliest pending container to be due and take it off the heap"""
+        with self._cond:
+            while True:
+                # Drop heap items of containers that were rescheduled or finished
+                while self._heap and self._scheduled.get(self._heap[0][2]) != self._heap[0][0]:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                wait_time = self._heap[0][0] - time.time()
+                if wait_time > 0:
+                    self._cond.wait(wait_time)
+                    continue
+                _, _, container_id = heapq.heappop(self._heap)
+                del self._scheduled[container_id]
+                return container_id
+
+    def _attempt(self, container_id):
+        try:
+            data = self.store.claim_pending(container_id, self._owner or os.getpid(), self.CLAIM_TTL)
+        except Exception as e:
+            logger.error(f"Error claiming pending container {container_id}: {e}")
+            with self._cond:
+                self._push(container_id, time.time() + self.NOT_READY_DELAY)
+            return
+        if data is None:
+            claimed = self.store.get_pending().get(container_id)
+            if claimed is not None:
+                # Another process is publishing it: look again if its claim runs out
+                with self._cond:
+                    self._push(container_id, max(float(claimed.get('claim_expires') or 0), time.time()))
+            # Otherwise it was published or dropped by someone else in the meantime
+            return
+        ig_user_id = data.get('ig_user_id')
+
+        if self._defer(container_id, rate_governor.wait_time(ig_user_id)):
+            return
+
+        service = self._service_for(ig_user_id)
+        if service is None:
+            with self._cond:
+                self._push(container_id, time.time() + self.NOT_READY_DELAY)
+            return
+
+        try:
+            status = service.check_container_status(container_id)
+            if status == 'PUBLISHED':
+                # Published by another attempt (e.g. a queue retry) before the rate limit cleared
+                self.store.remove_pending(container_id)
+                with self._cond:
+                    self.stats["already_published"] += 1
+                logger.info(f"Pending container {container_id} was already published")
+                return
+            if status in ('ERROR', 'EXPIRED'):
+                self._finish(container_id, ig_user_id, 'failed', error=f"Container status {status}")
+                return
+            if status != 'FINISHED':
+                with self._cond:
+                    self._push(container_id, time.time() + self.NOT_READY_DELAY)
+                return
+
+            if self._defer(container_id, rate_governor.acquire(ig_user_id, publish=True)):
+                return
+            logger.info(f"Publishing pending container {container_id}")
+            try:
+                post_id = service.publish_media(container_id, save_pending=False)
+            except Exception:
+                rate_governor.release(ig_user_id)
+                raise
+            if not post_id:
+                rate_governor.release(ig_user_id)
+                self._finish(container_id, ig_user_id, 'failed', error="Publish returned no post ID")
+                return
+            permalink = service.get_post_permalink(post_id)
+            self._finish(container_id, ig_user_id, 'published', post_id=post_id, permalink=permalink)
+
+        except Exception as e:
+            if not getattr(e, "retriable", False):
+                logger.error(f"Error publishing pending container {container_id}: {e}")
+                self._finish(container_id, ig_user_id, 'failed', error=str(e))
+                return
+
+            # Rate limit or temporary server error: try again after retry_seconds
+            retry_count = data.get('retry_count', 0) + 1
+            if retry_count >= self.MAX_RETRIES:
+                logger.error(f"Too many retry attempts for container {container_id}, giving up")
+                self._finish(container_id, ig_user_id, 'gave_up', error=str(e))
+                return
+            retry_seconds = getattr(e, "retry_seconds", None) or self.NOT_READY_DELAY
+            next_attempt_time = time.time() + retry_seconds
+            self.store.update_pending(
+                container_id,
+                retry_count=retry_count,
+                next_attempt_time=next_attempt_time,
+                last_error=str(e),
+                last_attempt=datetime.now().isoformat(),
+                claimed_by=None,
+                claim_expires=None
+            )
+            with self._cond:
+                self.stats["rate_limited"] += 1
+                self._push(container_id, next_attempt_time)
+            logger.warning(f"Rate limit hit for container {container_id}. Will retry after {retry_seconds}s (attempt {retry_count})")
+
+    def _defer(self, container_id, wait):
+        """Put the container back on the heap if the governor asks to wait"""
+        if wait <= 0:
+            return False
+        with self._cond:
+            self.stats["deferred"] += 1
+            self._push(container_id, time.time() + wait)
+        logger.info(f"No publish quota for container {container_id}, next attempt in {wait:.0f}s")
+        return True
+
+    def _service_for(self, ig_user_id):
+        with self._cond:
+            service = self._services.get(ig_user_id)
+        if service is not None:
+            return service
+        # Containers restored from a previous run: use the credentials of their account
+        from src.instagram.instagram_post_service import InstagramPostService
+        from src.instagram.service_registry import service_registry
+        try:
+            return service_registry.for_account(InstagramPostService, ig_user_id)
+        except ValueError as e:
+            logger.warning(f"No credentials for account {ig_user_id}, pending containers wait: {e}")
+            return None
+
+    def _finish(self, container_id, ig_user_id, status, **details):
+        self.store.remove_pending(container_id)
+        with self._cond:
+            self.stats[status] += 1
+            subscribers = list(self._subscribers.values())
+        if status == 'published':
+            logger.info(f"Successfully published pending container! ID: {details.get('post_id')}")
+        else:
+            logger.error(f"Pending container {container_id} {status}: {details.get('error')}")
+
+        event = dict(details, status=status, ig_user_id=ig_user_id, container_id=container_id)
+        for callback in subscribers:
+            try:
+                callback(container_id, dict(event))
+            except Exception as e:
+                logger.error(f"Error notifying pending container {container_id}: {e}")
+
+# Global instance shared by every Instagram service in the process
+pending_publisher = PendingPublisher()
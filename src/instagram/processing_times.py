@@ -0,0 +1,125 @@
+import os
+import json
+import math
+import time
+import logging
+import threading
+from collections import deque
+from src.utils.paths import Paths
+
+logger = logging.getLogger('ProcessingTimes')
+
+class ProcessingTimeModel:
+    """
+    Learned container processing times.
+
+    Records how long containers took to reach FINISHED, per media type and
+    size class, and turns the observed percentiles into a polling schedule:
+    checks land around p50, p75, p90, p95 and p99 of similar containers
+    instead of on a fixed backoff. Samples are kept in a JSON file so the
+    schedule survives restarts.
+    """
+
+    # Percentiles the checks are scheduled at
+    PERCENTILES = (50, 75, 90, 95, 99)
+    # Samples kept per bucket, and needed before a bucket is trusted
+    MAX_SAMPLES = 200
+    MIN_SAMPLES = 5
+    # Bounds of the interval between two checks of one container
+    MIN_INTERVAL = 2
+    MAX_INTERVAL = 60
+    # Seconds between writes of the samples file
+    SAVE_INTERVAL = 60
+
+    def __init__(self, state_file=None):
+        self.state_file = (state_file or os.getenv("INSTAGRAM_PROCESSING_TIMES_FILE")
+                           or os.path.join(Paths.ROOT_DIR, "processing_times.json"))
+        self._lock = threading.Lock()
+        self._samples = {}  # "MEDIA_TYPE:size_class" -> deque of seconds
+        self._last_save = 0
+        self._load()
+
+    @staticmethod
+    def size_class(media_size):
+        """Size class of a media: 0 up to 1 MB, then one class per doubling ("*" if unknown)"""
+        if not media_size:
+            return "*"
+        return str(max(0, int(math.log2(max(media_size, 1) / (1024 * 1024))) + 1))
+
+    def record(self, media_type, media_size, seconds):
+        """Record the time a container took to reach FINISHED"""
+        if not media_type or seconds < 0:
+            return
+        # The size-agnostic bucket is the fallback for size classes without enough data
+        keys = {f"{media_type}:{self.size_class(media_size)}", f"{media_type}:*"}
+        with self._lock:
+            for key in keys:
+                self._samples.setdefault(key, deque(maxlen=self.MAX_SAMPLES)).append(round(seconds, 1))
+            save = time.time() - self._last_save >= self.SAVE_INTERVAL
+        if save:
+            self._save()
+
+    def percentiles(self, media_type, media_size=None):
+        """Learned percentiles for a media, falling back to all sizes of its type; None without enough data"""
+        with self._lock:
+            for key in (f"{media_type}:{self.size_class(media_size)}", f"{media_type}:*"):
+                samples = self._samples.get(key)
+                if samples and len(samples) >= self.MIN_SAMPLES:
+                    ordered = sorted(samples)
+                    return [ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in self.PERCENTILES]
+        return None
+
+    def next_check_in(self, media_type, media_size, elapsed):
+        """
+        Seconds until the next check of a container created `elapsed` seconds ago
+
+        Returns:
+            float: Wait time, or None when there is no learned data (use the default backoff)
+        """
+        learned = self.percentiles(media_type, media_size)
+        if not learned:
+            return None
+        for target in learned:
+            if target > elapsed:
+                return max(target - elapsed, self.MIN_INTERVAL)
+        # Slower than p99 of similar containers: check at a steady pace
+        return min(max((learned[-1] - learned[0]) / 2, self.MIN_INTERVAL), self.MAX_INTERVAL)
+
+    def get_stats(self):
+        """Sample count and p50/p90 per bucket"""
+        with self._lock:
+            buckets = {key: sorted(samples) for key, samples in self._samples.items()}
+        return {
+            key: {
+                "samples": len(ordered),
+                "p50": ordered[int(len(ordered) * 0.5)],
+                "p90": ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+            }
+            for key, ordered in buckets.items() if ordered
+        }
+
+    def _load(self):
+        if not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, 'r') as f:
+                data = json.load(f)
+            for key, samples in data.get('samples', {}).items():
+                self._samples[key] = deque(samples, maxlen=self.MAX_SAMPLES)
+        except Exception as e:
+            logger.warning(f"Could not load processing times from {self.state_file}: {e}")
+
+    def _save(self):
+        with self._lock:
+            data = {'samples': {key: list(samples) for key, samples in self._samples.items()}}
+            self._last_save = time.time()
+        try:
+            tmp_file = f"{self.state_file}.tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_file, self.state_file)
+        except Exception as e:
+            logger.warning(f"Could not save processing times to {self.state_file}: {e}")
+
+# Global instance shared by the container poller
+processing_times = ProcessingTimeModel()
@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger('RateGovernor')
+
+class RateGovernor:
+    """
+    Process-wide view of the Graph API quotas shared by every service instance.
+
+    Usage reported by the API headers (`x-app-usage` for the app and
+    `x-business-use-case-usage` per Instagram account) is tracked together with
+    explicit blocks from rate limit errors (codes 4, 17, 32, 613). The
+    content publishing limit is enforced locally with a token bucket per account,
+    so work is only dispatched when the API is expected to accept it. When
+    several processes publish for the same accounts (queue workers), the
+    buckets are kept in a shared store instead (see share_publish_budget), so
+    together they stay within one quota.
+    """
+
+    # Usage percentage (call_count/total_cputime/total_time) at which dispatch is deferred
+    USAGE_THRESHOLD = float(os.getenv("INSTAGRAM_USAGE_THRESHOLD", 90))
+    # Deferral when usage is above the threshold but the API gave no regain estimate
+    HIGH_USAGE_DELAY = 60
+    # Published posts allowed per account in a rolling 24h window
+    PUBLISH_QUOTA = int(os.getenv("INSTAGRAM_PUBLISH_QUOTA", 50))
+    PUBLISH_WINDOW = 24 * 60 * 60
+
+    def __init__(self, publish_quota=None):
+        self.publish_quota = publish_quota or self.PUBLISH_QUOTA
+        self._lock = threading.Lock()
+        self._usage = {}         # scope -> latest usage metrics
+        self._blocked_until = {} # scope -> timestamp
+        self._buckets = {}       # scope -> (tokens, last_refill)
+        self._shared_budget = None  # Store holding the buckets of every process, if shared
+
+    @staticmethod
+    def _account_scope(account_id):
+        account_id = account_id or os.getenv("INSTAGRAM_ACCOUNT_ID") or "default"
+        return f"account:{account_id}"
+
+    def share_publish_budget(self, store):
+        """
+        Keep the publish token buckets in a store shared by every process that
+        publishes for the same accounts, instead of in this process
+
+        Args:
+            store: Object with take_publish_token(scope, quota, window) -> wait
+                and return_publish_token(scope, quota, window) (the JobStore),
+                or None to go back to per-process buckets
+        """
+        with self._lock:
+            self._shared_budget = store
+
+    def record_headers(self, headers, account_id=None):
+        """
+        Update usage from a Graph API response's headers
+
+        Args:
+            headers: Response headers (dict-like)
+            account_id (str): Instagram account the request was made for
+        """
+        now = time.time()
+        updates = {}
+
+        app_usage = self._parse_header(headers.get('x-app-usage'))
+        if isinstance(app_usage, dict):
+            updates["app"] = app_usage
+
+        buc_usage = self._parse_header(headers.get('x-business-use-case-usage'))
+        if isinstance(buc_usage, dict):
+            for business_id, entries in buc_usage.items():
+                if not isinstance(entries, list):
+                    continue
+                for entry in entries:
+                    updates[self._account_scope(business_id)] = entry
+
+        if not updates:
+            return
+
+        with self._lock:
+            for scope, metrics in updates.items():
+                self._usage[scope] = {
+                    "call_count": metrics.get("call_count", 0),
+                    "total_cputime": metrics.get("total_cputime", 0),
+                    "total_time": metrics.get("total_time", 0),
+                    "estimated_time_to_regain_access": metrics.get("estimated_time_to_regain_access", 0),
+                    "updated_at": now
+                }
+                # estimated_time_to_regain_access is reported in minutes
+                regain_minutes = metrics.get("estimated_time_to_regain_access") or 0
+                if regain_minutes > 0:
+                    self._block(scope, now + regain_minutes * 60)
+
+    def record_rate_limit(self, retry_seconds, account_id=None, error_code=None):
+        """
+        Register a rate limit error so no further work is dispatched until it expires
+
+        Args:
+            retry_seconds (float): Seconds until the API is expected to accept requests again
+            account_id (str): Account the request was made for
+            error_code (int): Graph API error code (4 and 17 are app-wide, 32 and 613 per account)
+        """
+        scope = "app" if error_code in (4, 17) else self._account_scope(account_id)
+        with self._lock:
+            self._block(scope, time.time() + retry_seconds)
+        logger.warning(f"Rate limit registered for '{scope}', blocking for {retry_seconds:.0f}s")
+
+    def _block(self, scope, until):
+        if until > self._blocked_until.get(scope, 0):
+            self._blocked_until[scope] = until
+
+    def blocked_time(self, account_id=None):
+        """Seconds left on an explicit block (rate limit error or regain estimate) for the account"""
+        now = time.time()
+        scopes = ("app", self._account_scope(account_id))
+        with self._lock:
+            return max(max(self._blocked_until.get(scope, 0) - now for scope in scopes), 0)
+
+    def wait_time(self, account_id=None):
+        """Seconds until requests for the account are expected to be accepted (0 if now)"""
+        with self._lock:
+            return self._wait_time_locked(account_id, time.time())
+
+    def _wait_time_locked(self, account_id, now):
+        scopes = ("app", self._account_scope(account_id))
+        wait = max(self._blocked_until.get(scope, 0) - now for scope in scopes)
+
+        for scope in scopes:
+            usage = self._usage.get(scope)
+            if not usage:
+                continue
+            peak = max(usage["call_count"], usage["total_cputime"], usage["total_time"])
+            if peak >= self.USAGE_THRESHOLD:
+                # Usage is a rolling window: wait for it to decay before dispatching more work
+                wait = max(wait, usage["updated_at"] + self.HIGH_USAGE_DELAY - now)
+        return max(wait, 0)
+
+    def acquire(self, account_id=None, publish=False):
+        """
+        Try to dispatch work for an account
+
+        Args:
+            account_id (str): Instagram account
+            publish (bool): Whether the work publishes a post (takes a publish token;
+                give it back with release() if nothing gets published)
+
+        Returns:
+            float: 0 if the work can be dispatched now, otherwise the seconds to wait
+        """
+        now = time.time()
+        scope = self._account_scope(account_id)
+        with self._lock:
+            wait = self._wait_time_locked(account_id, now)
+            if wait > 0 or not publish:
+                return wait
+            shared = self._shared_budget
+            if shared is None:
+                tokens = self._refill_locked(scope, now)
+                if tokens < 1:
+                    self._buckets[scope] = (tokens, now)
+                    return (1 - tokens) * self.PUBLISH_WINDOW / self.publish_quota
+                self._buckets[scope] = (tokens - 1, now)
+                return 0.0
+        # The shared store serializes the processes itself
+        return shared.take_publish_token(scope, self.publish_quota, self.PUBLISH_WINDOW)
+
+    def release(self, account_id=None):
+        """
+        Give back the publish token taken by acquire(publish=True) for work that
+        published nothing (it failed, was parked or will be retried), so failures
+        do not drain the account's 24h publish quota
+        """
+        now = time.time()
+        scope = self._account_scope(account_id)
+        with self._lock:
+            shared = self._shared_budget
+            if shared is None:
+                self._buckets[scope] = (min(self.publish_quota, self._refill_locked(scope, now) + 1), now)
+                return
+        shared.return_publish_token(scope, self.publish_quota, self.PUBLISH_WINDOW)
+
+    def _refill_locked(self, scope, now):
+        """Tokens in the account's bucket after refilling it up to now"""
+        tokens, last_refill = self._buckets.get(scope, (self.publish_quota, now))
+        refill_rate = self.publish_quota / self.PUBLISH_WINDOW
+        return min(self.publish_quota, tokens + (now - last_refill) * refill_rate)
+
+    def snapshot(self):
+        """Current usage, blocks and publish tokens, for status endpoints"""
+        now = time.time()
+        with self._lock:
+            refill_rate = self.publish_quota / self.PUBLISH_WINDOW
+            return {
+                "usage": {scope: dict(usage) for scope, usage in self._usage.items()},
+                "blocked": {
+                    scope: round(until - now, 1)
+                    for scope, until in self._blocked_until.items() if until > now
+                },
+                "publish_tokens": {
+                    scope: round(min(self.publish_quota, tokens + (now - last) * refill_rate), 2)
+                    for scope, (tokens, last) in self._buckets.items()
+                },
+                "publish_quota": self.publish_quota,
+                "publish_budget": "local" if self._shared_budget is None else "shared"
+            }
+
+    @staticmethod
+    def _parse_header(value):
+        if not value:
+            return None
+        try:
+            return json.loads(value)
+        except (TypeError, ValueError):
+            logger.warning("Failed to parse rate limit headers")
+            return None
+
+# Global instance shared by every Instagram service in the process
+rate_governor = RateGovernor()
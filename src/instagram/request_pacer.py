@@ -0,0 +1,77 @@
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger('RequestPacer')
+
+class RequestPacer:
+    """
+    Request pacing shared by every thread and service instance in the process.
+
+    One GCRA (generic cell rate algorithm) schedule per Graph API host and
+    account: requests are spaced 1/rate seconds apart on average, and up to
+    `burst` requests may go out back to back when the account has been idle.
+
+    Callers reserve their slot under the lock and sleep outside it, so a
+    waiting request never blocks others from reserving. Slots are handed out
+    in arrival order, which keeps jobs fair: a job making many sequential
+    calls takes its turn with the others instead of starving them.
+    """
+
+    # Sustained requests per second for one account on one host
+    RATE = float(os.getenv("INSTAGRAM_PACER_RATE", 1))
+    # Requests that may be sent back to back after an idle period
+    BURST = int(os.getenv("INSTAGRAM_PACER_BURST", 5))
+
+    def __init__(self, rate=None, burst=None, clock=None):
+        self.rate = rate or self.RATE
+        self.burst = max(1, burst or self.BURST)
+        self.interval = 1.0 / self.rate
+        # How far ahead of its theoretical time a request may go out
+        self.tolerance = (self.burst - 1) * self.interval
+        self._clock = clock or time.monotonic
+        self._lock = threading.Lock()
+        self._tat = {}  # (host, account) -> theoretical arrival time of the next request
+        self.stats = {"requests": 0, "delayed": 0, "total_wait": 0.0, "max_wait": 0.0}
+
+    def reserve(self, host, account_id):
+        """
+        Reserve the next request slot for an account, without waiting
+
+        Returns:
+            float: Seconds the caller must wait before sending (0 if it can go now)
+        """
+        key = (host, account_id)
+        with self._lock:
+            now = self._clock()
+            tat = max(self._tat.get(key, now), now)
+            wait = max(0.0, tat - self.tolerance - now)
+            self._tat[key] = tat + self.interval
+
+            self.stats["requests"] += 1
+            if wait > 0:
+                self.stats["delayed"] += 1
+                self.stats["total_wait"] += wait
+                self.stats["max_wait"] = max(self.stats["max_wait"], wait)
+            return wait
+
+    def acquire(self, host, account_id):
+        """Reserve a slot and wait for it (the lock is not held while sleeping)"""
+        wait = self.reserve(host, account_id)
+        if wait > 0:
+            logger.debug(f"Pacing request for account {account_id} on {host}: waiting {wait:.2f}s")
+            time.sleep(wait)
+        return wait
+
+    def get_stats(self):
+        """Pacing configuration and how much waiting it caused"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["total_wait"] = round(stats["total_wait"], 2)
+            stats["max_wait"] = round(stats["max_wait"], 2)
+            stats.update({"rate": self.rate, "burst": self.burst, "accounts": len(self._tat)})
+        return stats
+
+# Global instance shared by every Instagram service in the process
+request_pacer = RequestPacer()
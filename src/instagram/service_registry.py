@@ -0,0 +1,190 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from src.instagram.accounts import accounts
+
+logger = logging.getLogger('ServiceRegistry')
+
+def token_hash(access_token):
+    """Short, non-reversible key for a token (tokens are never used as keys or logged)"""
+    return hashlib.sha256((access_token or "").encode()).hexdigest()[:16]
+
+class TokenCache:
+    """
+    Process-wide cache of debug_token responses, keyed by token hash.
+
+    An entry is reused until the TTL or the token's own expires_at, whichever
+    comes first. Past REFRESH_AHEAD of its TTL the cached answer is still
+    returned and a background thread refreshes it, so jobs don't wait on
+    the introspection call.
+    """
+
+    # Seconds a debug_token answer is trusted
+    TTL = int(os.getenv("INSTAGRAM_TOKEN_CACHE_TTL", 3600))
+    # Fraction of the TTL after which the entry is refreshed in the background
+    REFRESH_AHEAD = 0.8
+    # Entries stop being used this many seconds before the token expires
+    EXPIRY_MARGIN = 60
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl or self.TTL
+        self._lock = threading.Lock()
+        self._entries = {}  # token hash -> {"response", "checked_at", "valid_until", "refreshing"}
+        self._fetch_locks = {}
+        self.stats = {"hits": 0, "misses": 0, "background_refreshes": 0}
+
+    def introspect(self, service, force=False):
+        """
+        debug_token response for the service's token, from the cache when possible
+
+        Args:
+            service (BaseInstagramService): Service whose token is checked (its credentials make the call)
+            force (bool): Ignore the cached entry
+
+        Returns:
+            dict: The debug_token response ({'data': {...}})
+        """
+        key = token_hash(service.access_token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and not force and now < entry["valid_until"]:
+                self.stats["hits"] += 1
+                if now - entry["checked_at"] > self.ttl * self.REFRESH_AHEAD and not entry["refreshing"]:
+                    entry["refreshing"] = True
+                    threading.Thread(target=self._refresh, args=(service, key), daemon=True).start()
+                return entry["response"]
+            self.stats["misses"] += 1
+            fetch_lock = self._fetch_locks.setdefault(key, threading.Lock())
+
+        # One introspection call per token at a time; concurrent callers reuse its answer
+        with fetch_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and not force and entry["checked_at"] >= now:
+                    return entry["response"]
+            return self._fetch(service, key)
+
+    def invalidate(self, access_token=None):
+        """Drop the entry of a token (or every entry)"""
+        with self._lock:
+            if access_token is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(token_hash(access_token), None)
+
+    def get_stats(self):
+        """Hit/miss counters and cached tokens (by hash)"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["tokens"] = {
+                key: {
+                    "checked_at": entry["checked_at"],
+                    "valid_until": entry["valid_until"]
+                }
+                for key, entry in self._entries.items()
+            }
+        return stats
+
+    def _fetch(self, service, key):
+        response = service._make_request("GET", "debug_token", params={"input_token": service.access_token})
+        checked_at = time.time()
+        valid_until = checked_at + self.ttl
+        expires_at = (response or {}).get('data', {}).get('expires_at')
+        if expires_at:  # 0 means the token does not expire
+            valid_until = min(valid_until, expires_at - self.EXPIRY_MARGIN)
+        with self._lock:
+            self._entries[key] = {
+                "response": response,
+                "checked_at": checked_at,
+                "valid_until": valid_until,
+                "refreshing": False
+            }
+        return response
+
+    def _refresh(self, service, key):
+        try:
+            self._fetch(service, key)
+            with self._lock:
+                self.stats["background_refreshes"] += 1
+        except Exception as e:
+            logger.warning(f"Background token check failed: {e}")
+            with self._lock:
+                if key in self._entries:
+                    self._entries[key]["refreshing"] = False
+
+class ServiceRegistry:
+    """
+    Process-wide registry of Instagram service instances.
+
+    Services are built once per class, token and account and then shared,
+    so jobs don't repeat the constructor work (token validation, state
+    loading) for every post.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._services = {}
+
+    def get(self, service_class, access_token=None, ig_user_id=None):
+        """
+        Shared instance of a service class
+
+        Args:
+            service_class (type): InstagramPostService, InstagramCarouselService, ReelsPublisher...
+            access_token (str): Token (default: the one the service reads from the environment)
+            ig_user_id (str): Instagram account ID (default: from the environment)
+        """
+        key = (service_class, token_hash(access_token) if access_token else None, ig_user_id)
+        with self._lock:
+            service = self._services.get(key)
+        if service is not None:
+            return service
+
+        # Built outside the lock: constructors make API calls
+        service = service_class(access_token, ig_user_id)
+        with self._lock:
+            return self._services.setdefault(key, service)
+
+    def for_account(self, service_class, account=None):
+        """
+        Shared instance of a service class for one of the configured accounts
+
+        Args:
+            service_class (type): InstagramPostService, InstagramCarouselService, ReelsPublisher...
+            account (str): Account name or IG user ID (default: the default account)
+        """
+        resolved = accounts.resolve(account)
+        if resolved is None:
+            return self.get(service_class)
+        return self.get(service_class, resolved["access_token"], resolved["ig_user_id"])
+
+    def invalidate(self, service_class=None, access_token=None):
+        """
+        Drop the shared instances (of one class, or all), e.g. after a token change
+
+        Args:
+            service_class (type): Only instances of this class
+            access_token (str): Only instances using this token (e.g. one the API rejected)
+        """
+        with self._lock:
+            for key, service in list(self._services.items()):
+                if service_class is not None and key[0] is not service_class:
+                    continue
+                if access_token is not None and service.access_token != access_token:
+                    continue
+                del self._services[key]
+
+    def get_stats(self):
+        """Number of shared instances per service class"""
+        with self._lock:
+            stats = {}
+            for service_class, _, _ in self._services:
+                stats[service_class.__name__] = stats.get(service_class.__name__, 0) + 1
+            return stats
+
+# Global instances for use throughout the application
+token_cache = TokenCache()
+service_registry = ServiceRegistry()
@@ -0,0 +1,296 @@
+import os
+import json
+import copy
+import time
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from src.utils.paths import Paths
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger('StateStore')
+
+class StateStore:
+    """
+    Persistence for api_state.json (posting stats and pending containers).
+
+    The state lives in memory and is the read model: the monitor and the
+    services read it without touching disk. Each change is appended as one
+    JSON line to a journal, and a background thread flushes the appended
+    lines in batches every FLUSH_INTERVAL seconds instead of rewriting the
+    whole file per post. Every COMPACT_EVERY journal entries the state is
+    written to api_state.json as an atomic snapshot (temporary file +
+    rename) and the journal starts over. Loading reads the snapshot and
+    replays the journal.
+
+    Several processes (the webhook and the queue workers) may share the
+    files: appends and compactions happen under an exclusive lock on
+    api_state.json.lock, and before writing, and every FLUSH_INTERVAL
+    seconds, each process applies the journal lines the others appended (or
+    reloads the snapshot when another process compacted), so the stats read
+    by the monitor include the posts made by every process.
+    """
+
+    # Seconds between journal flushes
+    FLUSH_INTERVAL = float(os.getenv("INSTAGRAM_STATE_FLUSH_INTERVAL", 2))
+    # Journal entries before the state is compacted into a snapshot
+    COMPACT_EVERY = int(os.getenv("INSTAGRAM_STATE_COMPACT_EVERY", 500))
+
+    STAT_KEYS = ('successful_posts', 'failed_posts', 'rate_limited_posts')
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv("INSTAGRAM_STATE_FILE") or os.path.join(Paths.ROOT_DIR, "api_state.json")
+        self.journal_path = f"{self.path}.journal"
+        self.lock_path = f"{self.path}.lock"
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._buffer = []  # Journal lines not yet written
+        self._journal_entries = 0
+        self._offset = 0          # Journal bytes already applied to the state
+        self._snapshot_id = None  # Snapshot file the state was loaded from
+        self._wakeup = threading.Event()
+        with self._flush_lock, self._file_lock():
+            self._state = self._load()
+        self._thread = threading.Thread(target=self._run, name="StateStore", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _empty_state(self):
+        return {'pending_containers': {}, 'stats': {key: 0 for key in self.STAT_KEYS}, 'last_updated': None}
+
+    # ---- reads (memory only) --------------------------------------------------
+
+    def get_stats(self):
+        """Posting counters"""
+        with self._lock:
+            return dict(self._state['stats'])
+
+    def get_pending(self):
+        """Pending containers (copy), by container ID"""
+        with self._lock:
+            return copy.deepcopy(self._state['pending_containers'])
+
+    def snapshot(self):
+        """Copy of the whole state, in the api_state.json format"""
+        with self._lock:
+            return copy.deepcopy(self._state)
+
+    # ---- writes -------------------------------------------------------------
+
+    def increment(self, stat, amount=1):
+        """Add to a posting counter (successful_posts, failed_posts, rate_limited_posts)"""
+        self._apply({'op': 'increment', 'stat': stat, 'amount': amount})
+
+    def put_pending(self, container_id, data):
+        """Add or replace a pending container"""
+        self._apply({'op': 'put_pending', 'id': container_id, 'data': data})
+
+    def update_pending(self, container_id, **fields):
+        """Update fields of a pending container (ignored if it is no longer pending)"""
+        self._apply({'op': 'update_pending', 'id': container_id, 'data': fields})
+
+    def remove_pending(self, container_id):
+        """Remove a pending container (nothing is journaled if it is not pending)"""
+        with self._lock:
+            if container_id not in self._state['pending_containers']:
+                return
+        self._apply({'op': 'remove_pending', 'id': container_id})
+
+    def claim_pending(self, container_id, owner, ttl):
+        """
+        Claim a pending container for owner, atomically across processes
+
+        The claim is written to the journal before returning, so another process
+        trying to claim the same container sees it until claim_expires.
+
+        Returns:
+            dict: The container data, or None if it is no longer pending or another
+                owner holds an unexpired claim on it
+        """
+        with self._flush_lock, self._file_lock():
+            self._refresh()
+            now = time.time()
+            with self._lock:
+                data = self._state['pending_containers'].get(container_id)
+                if data is None:
+                    return None
+                if data.get('claimed_by') not in (None, owner) and (data.get('claim_expires') or 0) > now:
+                    return None
+            self._apply({'op': 'update_pending', 'id': container_id,
+                         'data': {'claimed_by': owner, 'claim_expires': now + ttl}})
+            self._write_buffer()
+            with self._lock:
+                return copy.deepcopy(self._state['pending_containers'].get(container_id))
+
+    def flush(self):
+        """Apply the changes of other processes, write the buffered journal entries and compact if due"""
+        with self._flush_lock:
+            try:
+                with self._file_lock():
+                    self._refresh()
+                    self._write_buffer()
+            except Exception as e:
+                logger.error(f"Error saving state: {e}")
+
+    # ---- internals ------------------------------------------------------------
+
+    def _apply(self, entry):
+        entry['at'] = datetime.now().isoformat()
+        with self._lock:
+            self._replay(self._state, entry)
+            self._buffer.append(json.dumps(entry) + '\n')
+        self._wakeup.set()
+
+    def _replay(self, state, entry):
+        op = entry.get('op')
+        pending = state['pending_containers']
+        if op == 'increment':
+            state['stats'][entry['stat']] = state['stats'].get(entry['stat'], 0) + entry.get('amount', 1)
+        elif op == 'put_pending':
+            pending[entry['id']] = dict(entry['data'])
+        elif op == 'update_pending':
+            if entry['id'] in pending:
+                pending[entry['id']].update(entry['data'])
+        elif op == 'remove_pending':
+            pending.pop(entry['id'], None)
+        state['last_updated'] = entry.get('at')
+
+    def _run(self):
+        while True:
+            if self._wakeup.wait(self.FLUSH_INTERVAL):
+                # Let more changes accumulate so they go out in one write
+                time.sleep(self.FLUSH_INTERVAL)
+                self._wakeup.clear()
+            # Without local changes this only picks up those of other processes
+            self.flush()
+
+    def _write_buffer(self):
+        """Write the buffered journal entries, compacting if due (called with both locks held)"""
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+            compact = self._journal_entries + len(lines) >= self.COMPACT_EVERY
+            state = copy.deepcopy(self._state) if compact and lines else None
+        if not lines:
+            return
+        try:
+            if compact:
+                self._write_snapshot(state)
+                self._journal_entries, self._offset = 0, 0
+                self._snapshot_id = self._file_id(self.path)
+            else:
+                with open(self.journal_path, 'ab') as f:
+                    f.write(''.join(lines).encode())
+                    self._offset = f.tell()
+                self._journal_entries += len(lines)
+        except Exception:
+            with self._lock:
+                self._buffer = lines + self._buffer
+            raise
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock shared by every process using this state file"""
+        with open(self.lock_path, 'a+') as f:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    @staticmethod
+    def _file_id(path):
+        """Identity of a file version (os.replace gives the snapshot a new one), or None"""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _refresh(self):
+        """Apply what other processes wrote since the last read (called with the file lock held)"""
+        journal_size = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+        if self._file_id(self.path) != self._snapshot_id or journal_size < self._offset:
+            # Another process compacted: reload, with our unwritten changes on top
+            state = self._load()
+            with self._lock:
+                for line in self._buffer:
+                    self._replay(state, json.loads(line))
+                self._state = state
+            return
+        if journal_size > self._offset:
+            entries = self._read_journal()
+            with self._lock:
+                for entry in entries:
+                    self._replay(self._state, entry)
+
+    def _write_snapshot(self, state):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        # The snapshot holds every journaled change
+        with open(self.journal_path, 'w'):
+            pass
+        logger.info(f"Saved state with {len(state['pending_containers'])} pending containers")
+
+    def _load(self):
+        """State on disk: the snapshot plus the journal (called with the file lock held)"""
+        state = self._empty_state()
+        self._snapshot_id = self._file_id(self.path)
+        self._journal_entries, self._offset = 0, 0
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    loaded = json.load(f)
+                state['pending_containers'] = loaded.get('pending_containers', {})
+                state['stats'].update(loaded.get('stats', {}))
+                state['last_updated'] = loaded.get('last_updated')
+        except Exception as e:
+            logger.error(f"Error loading state: {e}")
+
+        try:
+            for entry in self._read_journal():
+                self._replay(state, entry)
+        except Exception as e:
+            logger.error(f"Error replaying state journal: {e}")
+        logger.info(f"Loaded {len(state['pending_containers'])} pending containers from state file")
+        return state
+
+    def _read_journal(self):
+        """Journal entries after the last read; a line still being written is left for the next read"""
+        if not os.path.exists(self.journal_path):
+            return []
+        with open(self.journal_path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        complete = data.rfind(b'\n') + 1
+        entries = []
+        for line in data[:complete].splitlines():
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # A partially written line from a crash
+                continue
+        self._offset += complete
+        self._journal_entries += len(entries)
+        return entries
+
+# Global instance shared by the Instagram services and the monitor
+state_store = StateStore()
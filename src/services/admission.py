@@ -0,0 +1,170 @@
+import os
+import time
+import uuid
+import logging
+import threading
+
+logger = logging.getLogger('Admission')
+
+class AdmissionRejected(Exception):
+    """Exceção para mensagens recusadas pelo controle de admissão"""
+    def __init__(self, message, status_code=503, retry_after=60, reason=None):
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+        super().__init__(message)
+
+class AdmissionController:
+    """
+    Controle de admissão do webhook.
+
+    Antes de decodificar e gravar uma mídia em temp/ ou temp_videos/, o webhook
+    reserva espaço aqui. A reserva é recusada quando a fila está cheia, quando
+    o total de bytes aguardando publicação passaria do limite ou quando o
+    remetente já tem trabalhos demais em andamento. As reservas são liberadas
+    quando o trabalho associado termina.
+    """
+
+    FINISHED_STATUSES = ("completed", "failed", "rate_limited", "policy_violation")
+
+    def __init__(self, max_depth=None, max_bytes=None, max_per_sender=None, retry_after=None):
+        """
+        Args:
+            max_depth (int): Trabalhos pendentes, em processamento ou em espera (padrão: POST_QUEUE_MAX_DEPTH ou 100)
+            max_bytes (int): Bytes de mídia aguardando publicação (padrão: POST_QUEUE_MAX_PENDING_BYTES ou 2 GiB)
+            max_per_sender (int): Trabalhos em andamento por remetente (padrão: POST_QUEUE_MAX_PER_SENDER ou 5)
+            retry_after (int): Valor do cabeçalho Retry-After em segundos (padrão: POST_QUEUE_RETRY_AFTER ou 60)
+        """
+        self.max_depth = max_depth or int(os.getenv("POST_QUEUE_MAX_DEPTH", 100))
+        self.max_bytes = max_bytes or int(os.getenv("POST_QUEUE_MAX_PENDING_BYTES", 2 * 1024 ** 3))
+        self.max_per_sender = max_per_sender or int(os.getenv("POST_QUEUE_MAX_PER_SENDER", 5))
+        self.retry_after = retry_after or int(os.getenv("POST_QUEUE_RETRY_AFTER", 60))
+        self.post_queue = None
+        self.subscription = None
+        self._lock = threading.Lock()
+        self._tickets = {}     # ticket -> {"sender", "bytes", "job", "job_id"}
+        self._job_tickets = {} # job_id -> [tickets]
+        self._pending_bytes = 0
+        self._per_sender = {}  # remetente -> trabalhos em andamento
+        self.stats = {
+            "admitted": 0,
+            "rejected": 0,
+            "rejected_by_reason": {},
+            "last_rejection": None
+        }
+
+    def start(self, post_queue_instance):
+        """
+        Passa a acompanhar a fila: a profundidade vem da PostQueue e as reservas
+        são liberadas quando os trabalhos terminam
+
+        Args:
+            post_queue_instance: Instância da PostQueue
+        """
+        self.post_queue = post_queue_instance
+        self.subscription = self.post_queue.subscribe(self._on_job_finished, statuses=self.FINISHED_STATUSES)
+
+    def admit(self, sender, size=0, job=True):
+        """
+        Reserva espaço para uma mídia recebida
+
+        Args:
+            sender (str): Remetente da mensagem (remote_jid)
+            size (int): Tamanho estimado da mídia em bytes
+            job (bool): Se a reserva corresponde a um novo trabalho (False para
+                imagens de um carrossel ainda em montagem)
+
+        Returns:
+            str: Ticket da reserva, para bind ou release
+
+        Raises:
+            AdmissionRejected: Se algum limite seria excedido
+        """
+        depth = self.post_queue.queue_depth() if self.post_queue else 0
+        with self._lock:
+            rejection = None
+            if job and depth >= self.max_depth:
+                rejection = ("queue_depth", 503, f"Fila cheia ({depth} trabalhos aguardando)")
+            elif self._pending_bytes + size > self.max_bytes:
+                rejection = ("pending_bytes", 503, "Limite de mídia aguardando publicação atingido")
+            elif job and self._per_sender.get(sender, 0) >= self.max_per_sender:
+                rejection = ("sender_in_flight", 429, f"Limite de {self.max_per_sender} trabalhos em andamento por remetente atingido")
+
+            if rejection:
+                reason, status_code, message = rejection
+                self.stats["rejected"] += 1
+                self.stats["rejected_by_reason"][reason] = self.stats["rejected_by_reason"].get(reason, 0) + 1
+                self.stats["last_rejection"] = {"reason": reason, "sender": sender, "at": time.time()}
+                logger.warning(f"Mensagem de {sender} recusada: {message}")
+                raise AdmissionRejected(message, status_code, self.retry_after, reason)
+
+            ticket = str(uuid.uuid4())
+            self._tickets[ticket] = {"sender": sender, "bytes": size, "job": job, "job_id": None}
+            self._pending_bytes += size
+            if job:
+                self._per_sender[sender] = self._per_sender.get(sender, 0) + 1
+            self.stats["admitted"] += 1
+            return ticket
+
+    def bind(self, job_id, *tickets):
+        """Associa reservas ao trabalho criado; elas são liberadas quando ele terminar"""
+        with self._lock:
+            for ticket in tickets:
+                if ticket in self._tickets:
+                    self._tickets[ticket]["job_id"] = job_id
+                    self._job_tickets.setdefault(job_id, []).append(ticket)
+
+        # O trabalho pode ter terminado antes da associação
+        if self.post_queue and self.post_queue.get_job_status(job_id).get("status") in self.FINISHED_STATUSES:
+            self._on_job_finished(job_id, None)
+
+    def release(self, *tickets):
+        """Libera reservas (mídia descartada ou falha ao enfileirar)"""
+        with self._lock:
+            for ticket in tickets:
+                entry = self._tickets.pop(ticket, None)
+                if entry is None:
+                    continue
+                self._pending_bytes -= entry["bytes"]
+                if entry["job"]:
+                    remaining = self._per_sender.get(entry["sender"], 0) - 1
+                    if remaining > 0:
+                        self._per_sender[entry["sender"]] = remaining
+                    else:
+                        self._per_sender.pop(entry["sender"], None)
+                if entry["job_id"] in self._job_tickets:
+                    self._job_tickets[entry["job_id"]].remove(ticket)
+                    if not self._job_tickets[entry["job_id"]]:
+                        del self._job_tickets[entry["job_id"]]
+
+    def _on_job_finished(self, job_id, job_info):
+        """Chamado pela PostQueue quando um trabalho termina"""
+        with self._lock:
+            tickets = list(self._job_tickets.get(job_id, ()))
+        self.release(*tickets)
+
+    def get_stats(self):
+        """Limites, uso atual e decisões de admissão"""
+        with self._lock:
+            stats = dict(self.stats, rejected_by_reason=dict(self.stats["rejected_by_reason"]))
+            stats.update({
+                "max_depth": self.max_depth,
+                "max_pending_bytes": self.max_bytes,
+                "max_per_sender": self.max_per_sender,
+                "pending_bytes": self._pending_bytes,
+                "senders_in_flight": dict(self._per_sender)
+            })
+            return stats
+
+    @staticmethod
+    def estimate_size(base64_data):
+        """Tamanho decodificado de uma mídia em base64, sem decodificá-la"""
+        if not base64_data:
+            return 0
+        # Ignorar o cabeçalho data URI, se houver, sem copiar a string
+        header = base64_data.find("base64,", 0, 100)
+        start = header + len("base64,") if header >= 0 else 0
+        return (len(base64_data) - start) * 3 // 4
+
+# Instância global para uso em toda a aplicação
+admission_controller = AdmissionController()
@@ -0,0 +1,99 @@
+import time
+import threading
+from collections import OrderedDict, deque
+from queue import Empty
+
+class FairQueue:
+    """
+    Fila de trabalhos particionada por conta do Instagram (shards).
+
+    Cada conta tem sua própria fila FIFO e os workers atendem as contas em
+    rodízio, de forma que uma conta com muitos posts não atrase as demais.
+    Contas sem cota disponível (wait_time(conta) > 0) são puladas: seus
+    trabalhos continuam na fila, sem ocupar workers, até a cota voltar.
+
+    Mantém a interface usada pelos pools da PostQueue (put, get, task_done,
+    qsize, empty).
+    """
+
+    # Espera máxima entre reavaliações quando todas as contas com trabalhos estão bloqueadas
+    BLOCKED_RECHECK = 1.0
+
+    def __init__(self, wait_time=None):
+        """
+        Args:
+            wait_time: Função wait_time(conta) -> segundos até a conta poder ser atendida
+        """
+        self.wait_time = wait_time
+        self._cond = threading.Condition()
+        self._shards = OrderedDict()  # conta -> deque de job_ids, na ordem do rodízio
+        self._size = 0
+        self._unfinished = 0
+
+    def put(self, item, shard=None):
+        """Enfileira um item na partição da conta"""
+        with self._cond:
+            self._shards.setdefault(shard, deque()).append(item)
+            self._size += 1
+            self._unfinished += 1
+            self._cond.notify()
+
+    def get(self, block=True, timeout=None):
+        """
+        Retira o próximo item, alternando entre as contas
+
+        Raises:
+            Empty: Se nenhum item puder ser entregue dentro do timeout
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._cond:
+            while True:
+                item, wait = self._next_item()
+                if item is not None:
+                    return item
+                if not block:
+                    raise Empty
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise Empty
+                    wait = min(wait, remaining) if wait is not None else remaining
+                self._cond.wait(wait)
+
+    def _next_item(self):
+        """
+        Retorna (item, None) da primeira conta disponível no rodízio, ou
+        (None, espera) se não houver item entregável agora
+        """
+        blocked_wait = None
+        for shard in list(self._shards):
+            wait = self.wait_time(shard) if self.wait_time else 0
+            if wait > 0:
+                blocked_wait = min(blocked_wait or wait, wait)
+                continue
+            items = self._shards.pop(shard)
+            item = items.popleft()
+            self._size -= 1
+            if items:
+                # A conta volta ao fim do rodízio
+                self._shards[shard] = items
+            return item, None
+        if blocked_wait is not None:
+            return None, min(blocked_wait, self.BLOCKED_RECHECK)
+        return None, None
+
+    def task_done(self):
+        with self._cond:
+            self._unfinished = max(0, self._unfinished - 1)
+
+    def qsize(self):
+        with self._cond:
+            return self._size
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def shard_sizes(self):
+        """Itens aguardando por conta"""
+        with self._cond:
+            return {shard: len(items) for shard, items in self._shards.items()}
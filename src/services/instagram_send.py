@@ -15,10 +15,12 @@ warnings.filterwarnings("ignore", category=SyntaxWarning,
 from src.instagram.crew_post_instagram import InstagramPostCrew
 from src.instagram.describe_image_tool import ImageDescriber
 from src.instagram.instagram_post_service import InstagramPostService
+from src.instagram.service_registry import service_registry
+from src.instagram.base_instagram_service import RateLimitError, TemporaryServerError
 from src.instagram.border import ImageWithBorder
 from src.instagram.filter import FilterImage
 from src.utils.paths import Paths
-from src.instagram.image_uploader import ImageUploader
+from src.instagram.media_host import media_host
 from PIL import Image
 
 # Import new queue system
@@ -37,7 +39,7 @@ class InstagramSend:
     max_rate_limit_hits = 52  # Maximum number of rate limit hits before enforcing longer delays
     
     @staticmethod
-    def queue_post(image_path, caption, inputs=None) -> str:
+    def queue_post(image_path, caption, inputs=None, publish_at=None) -> str:
         """
         Queue an image to be posted to Instagram asynchronously
         
@@ -45,6 +47,7 @@ class InstagramSend:
             image_path (str): Path to the image file
             caption (str): Caption text
             inputs (dict): Optional configuration for post generation
+            publish_at (float or datetime): Optional scheduled publishing time
             
         Returns:
             str: Job ID for tracking the post status
@@ -59,11 +62,11 @@ class InstagramSend:
             raise FileNotFoundError(f"Arquivo de imagem não encontrado: {image_path}")
             
         # Add to queue and return job ID
-        job_id = post_queue.add_job(image_path, caption, inputs)
+        job_id = post_queue.add_job(image_path, caption, inputs, publish_at=publish_at)
         return job_id
     
     @staticmethod
-    def queue_reels(video_path, caption, inputs=None) -> str:
+    def queue_reels(video_path, caption, inputs=None, publish_at=None) -> str:
         """
         Queue a video to be posted to Instagram as a reel asynchronously
         
@@ -71,6 +74,7 @@ class InstagramSend:
             video_path (str): Path to the video file
             caption (str): Caption text
             inputs (dict): Optional configuration for post generation
+            publish_at (float or datetime): Optional scheduled publishing time
             
         Returns:
             str: Job ID for tracking the post status
@@ -94,12 +98,12 @@ class InstagramSend:
         print(f"Caption in queue_reels: {caption}")  # Debug statement
         # Add to queue and return job ID - using the same queue system for now
         # The worker will need to check the content_type to handle differently
-        job_id = post_queue.add_job(video_path, caption, inputs)
+        job_id = post_queue.add_job(video_path, caption, inputs, publish_at=publish_at)
         print(f"Reel queued with job ID: {job_id}")
         return job_id
     
     @staticmethod
-    def queue_carousel(image_paths, caption, inputs=None):
+    def queue_carousel(image_paths, caption, inputs=None, publish_at=None):
         """
         Enfileira um carrossel de imagens para o Instagram
         
@@ -107,6 +111,7 @@ class InstagramSend:
             image_paths (list): Lista de caminhos dos arquivos de mídia (imagens)
             caption (str): Legenda do post
             inputs (dict): Configurações adicionais
+            publish_at (float or datetime): Horário agendado para a publicação (opcional)
             
         Returns:
             str: ID do trabalho
@@ -118,7 +123,7 @@ class InstagramSend:
         # Add content_type explicitly to mark this as a carousel
         inputs["content_type"] = "carousel"
         
-        job_id = post_queue.add_job(image_paths, caption, inputs)
+        job_id = post_queue.add_job(image_paths, caption, inputs, publish_at=publish_at)
         return job_id
 
     @staticmethod
@@ -144,6 +149,25 @@ class InstagramSend:
         """
         return post_queue.get_queue_stats()
     
+    @staticmethod
+    def subscribe_job_events(callback, statuses=None):
+        """
+        Subscribe to job status transitions
+        
+        Args:
+            callback: Called as callback(job_id, job_info) on every transition
+            statuses (iterable): Statuses of interest (default: all)
+            
+        Returns:
+            str: Token to pass to unsubscribe_job_events
+        """
+        return post_queue.subscribe(callback, statuses)
+    
+    @staticmethod
+    def unsubscribe_job_events(token):
+        """Cancel a subscription made with subscribe_job_events"""
+        return post_queue.unsubscribe(token)
+    
     @staticmethod
     def get_recent_posts(limit=10):
         """
@@ -157,6 +181,11 @@ class InstagramSend:
         """
         return post_queue.get_job_history(limit)
     
+    @staticmethod
+    def _account(inputs):
+        """Account (IG user ID) a post goes to, set by the queue in inputs['account_id']"""
+        return (inputs or {}).get('account_id')
+
     @staticmethod
     def send_instagram(image_path, caption, inputs=None):
         """
@@ -167,195 +196,347 @@ class InstagramSend:
             caption (str): Caption text
             inputs (dict): Optional configuration for post generation
         """
-        result = None
-        original_image_path = image_path
-        uploaded_images = []
-        uploader = ImageUploader()  # Reuse the same uploader instance
-        
+        staged = InstagramSend.stage_instagram(image_path, caption, inputs)
+        if not staged:
+            return None
+        return InstagramSend.publish_staged(staged)
+
+    @staticmethod
+    def stage_instagram(image_path, caption, inputs=None):
+        """
+        Run every expensive step of an image post ahead of publishing: filter,
+        description, border, upload, caption generation and media container
+        creation, waiting until the container is FINISHED.
+
+        Args:
+            image_path (str): Path to the image file
+            caption (str): Caption text
+            inputs (dict): Optional configuration for post generation
+
+        Returns:
+            dict: Staged post, ready for publish_staged (or None on failure)
+        """
+        ctx = None
+        try:
+            ctx = InstagramSend.new_image_context(image_path, caption, inputs)
+            # Todas as etapas do pipeline, exceto a publicação
+            for name, step, _ in InstagramSend.image_pipeline_stages()[:-1]:
+                if step(ctx) is None:
+                    logger.error(f"Etapa '{name}' falhou para {image_path}")
+                    InstagramSend._cleanup_staged(ctx)
+                    return None
+            return ctx
+
+        except (RateLimitExceeded, RateLimitError, TemporaryServerError):
+            if ctx:
+                InstagramSend._cleanup_staged(ctx)
+            raise
+        except Exception as e:
+            print(f"Error publishing photo: {e}")
+            import traceback
+            print(traceback.format_exc())
+            if ctx:
+                InstagramSend._cleanup_staged(ctx)
+            return None
+
+    @staticmethod
+    def image_pipeline_stages():
+        """
+        Stages of the image publishing pipeline, in order, as (name, function,
+        default workers). Each function takes the context created by
+        new_image_context and returns it, or None when the post cannot continue.
+        """
+        return [
+            ("filter", InstagramSend._filter_image, 1),
+            ("describe", InstagramSend._describe_image, 2),
+            ("border", InstagramSend._apply_border, 1),
+            ("upload", InstagramSend._upload_final_image, 2),
+            ("caption", InstagramSend._generate_caption, 2),
+            ("container", InstagramSend._create_container, 2),
+            ("wait", InstagramSend._wait_container, 4),
+            ("publish", InstagramSend._publish_image, 1),
+        ]
+
+    @staticmethod
+    def new_image_context(image_path, caption, inputs=None):
+        """
+        Create the context passed between the image pipeline stages
+
+        Args:
+            image_path (str): Path to the image file
+            caption (str): Caption text
+            inputs (dict): Optional configuration for post generation
+        """
         # Validar caption antes do processamento
         if not caption or caption.lower() == "none":
             caption = "A AcessoIA está transformando processos com IA! 🚀"
             print(f"Caption vazia ou 'None'. Usando caption padrão: '{caption}'")
-        
+
+        if inputs is None:
+            inputs = {
+                "estilo": "Divertido, Alegre, Sarcástico e descontraído",
+                "pessoa": "Terceira pessoa do singular",
+                "sentimento": "Positivo",
+                "tamanho": "200 palavras",
+                "genero": "Neutro",
+                "emojs": "sim",
+                "girias": "sim"
+            }
+
+        # Verificar se o arquivo existe
+        if not os.path.exists(image_path):
+            raise FileNotFoundError(f"Arquivo de imagem não encontrado: {image_path}")
+
+        return {
+            'content_type': 'image',
+            'account_id': inputs.get('account_id'),
+            'original_image_path': image_path,
+            'image_path': image_path,
+            'caption': caption,
+            'inputs': inputs,
+            'describe': None,
+            'final_image': None,
+            'final_caption': None,
+            'container_id': None,
+            'uploaded_images': [],
+            'temp_paths': []
+        }
+
+    @staticmethod
+    def _filter_image(ctx):
+        """Pipeline stage: apply filters to the image (CPU)"""
+        print("Aplicando filtros à imagem...")
+        ctx['image_path'] = FilterImage.process(ctx['image_path'])
+        if ctx['image_path'] != ctx['original_image_path']:
+            ctx['temp_paths'].append(ctx['image_path'])
+        return ctx
+
+    @staticmethod
+    def _describe_image(ctx):
+        """Pipeline stage: describe the image from the local file (network)"""
+        print("Obtendo descrição da imagem...")
         try:
-            if inputs is None:
-                inputs = {
-                    "estilo": "Divertido, Alegre, Sarcástico e descontraído",
-                    "pessoa": "Terceira pessoa do singular",
-                    "sentimento": "Positivo",
-                    "tamanho": "200 palavras",
-                    "genero": "Neutro",
-                    "emojs": "sim",
-                    "girias": "sim"
-                }
-            
-            # Verificar se o arquivo existe
-            if not os.path.exists(image_path):
-                raise FileNotFoundError(f"Arquivo de imagem não encontrado: {image_path}")
-                
-            border_image = os.path.join(Paths.SRC_DIR, "instagram", "moldura.png")
-            
-            # Process image with filter
-            print("Aplicando filtros à imagem...")
-            image_path = FilterImage.process(image_path)
-            
-            # First upload to get image description
-            print("Obtendo descrição da imagem...")
-            try:
-                temp_image = uploader.upload_from_path(image_path)
-                uploaded_images.append(temp_image)
-                describe = ImageDescriber.describe(temp_image['url'])
-                
-                # Try to delete the temporary image immediately after getting description
-                if temp_image.get("deletehash"):
-                    print(f"Deletando imagem temporária usada para descrição...")
-                    if uploader.delete_image(temp_image["deletehash"]):
-                        uploaded_images.remove(temp_image)
-            except Exception as e:
-                print(f"Erro ao obter descrição da imagem: {str(e)}")
-                describe = "Imagem para publicação no Instagram."
-                
-            # Add border and prepare final image
-            print("Aplicando bordas e filtros...")
-            try:
-                image = ImageWithBorder.create_bordered_image(
-                    border_path=border_image,
-                    image_path=image_path,
-                    output_path=image_path                
+            # The describer reads the file itself: no temporary upload to the image host
+            ctx['describe'] = ImageDescriber.describe(ctx['image_path'])
+        except Exception as e:
+            print(f"Erro ao obter descrição da imagem: {str(e)}")
+            ctx['describe'] = "Imagem para publicação no Instagram."
+        return ctx
+
+    @staticmethod
+    def _apply_border(ctx):
+        """Pipeline stage: add the border to the image (CPU)"""
+        print("Aplicando bordas e filtros...")
+        border_image = os.path.join(Paths.SRC_DIR, "instagram", "moldura.png")
+        try:
+            ImageWithBorder.create_bordered_image(
+                border_path=border_image,
+                image_path=ctx['image_path'],
+                output_path=ctx['image_path']
+            )
+        except Exception as e:
+            print(f"Erro ao aplicar borda à imagem: {str(e)}")
+            # Continue with original image if border application fails
+        return ctx
+
+    @staticmethod
+    def _upload_final_image(ctx):
+        """Pipeline stage: publish the final image on the media host (network for Imgur)"""
+        print("Enviando imagem para publicação...")
+        try:
+            final_image = media_host.publish(ctx['image_path'])
+            ctx['uploaded_images'].append(final_image)
+            ctx['final_image'] = final_image
+        except Exception as e:
+            print(f"Erro ao fazer upload da imagem final: {str(e)}")
+            raise
+        return ctx
+
+    @staticmethod
+    def _generate_caption(ctx):
+        """Pipeline stage: generate the caption with the crew (network/LLM)"""
+        print("Gerando legenda...")
+        inputs = ctx['inputs']
+        caption = ctx['caption']
+        try:
+            crew = InstagramPostCrew()
+            # Usar um dicionário diretamente
+            inputs_dict = {
+                "genero": inputs.get('genero', 'Neutro'),
+                "caption": caption,
+                "describe": ctx['describe'],
+                "estilo": inputs.get('estilo', 'Divertido, Alegre, Sarcástico e descontraído'),
+                "pessoa": inputs.get('pessoa', 'Terceira pessoa do singular'),
+                "sentimento": inputs.get('sentimento', 'Positivo'),
+                "tamanho": inputs.get('tamanho', '200 palavras'),
+                "emojs": inputs.get('emojs', 'sim'),
+                "girias": inputs.get('girias', 'sim')
+            }
+            final_caption = crew.kickoff(inputs=inputs_dict)  # Passar o dicionário
+        except Exception as e:
+            print(f"Erro ao gerar legenda: {str(e)}")
+            final_caption = caption  # Usar a legenda original em caso de erro
+        
+        # Adicionar texto padrão ao final da legenda
+        final_caption = final_caption + "\n\n-------------------"
+        final_caption = final_caption + "\n\n Essa postagem foi toda realizada por um agente inteligente"
+        final_caption = final_caption + "\n O agente desempenhou as seguintes ações:"
+        final_caption = final_caption + "\n 1 - Idenficação e reconhecimento do ambiente da fotografia"
+        final_caption = final_caption + "\n 2 - Aplicação de Filtros de contraste e autocorreção da imagem"
+        final_caption = final_caption + "\n 3 - Aplicação de moldura específica"
+        final_caption = final_caption + "\n 4 - Definição de uma persona específica com base nas preferências"
+        final_caption = final_caption + "\n 5 - Criação da legenda com base na imagem e na persona"
+        final_caption = final_caption + "\n 6 - Postagem no feed do instagram"
+        final_caption = final_caption + "\n\n-------------------"
+        ctx['final_caption'] = final_caption
+        return ctx
+
+    @staticmethod
+    def _create_container(ctx):
+        """Pipeline stage: check rate limits and create the media container (network)"""
+        print("Iniciando processo de publicação no Instagram...")
+        
+        # Verificar limites de requisição
+        stats = post_queue.get_queue_stats()
+        current_time = time.time()
+        
+        if stats["rate_limited_posts"] > InstagramSend.max_rate_limit_hits:
+            # Check if we're still within the rate limit window
+            if (current_time - InstagramSend.last_rate_limit_time) < InstagramSend.rate_limit_window:
+                remaining_time = InstagramSend.rate_limit_window - (current_time - InstagramSend.last_rate_limit_time)
+                raise RateLimitExceeded(
+                    f"Taxa de requisições severamente excedida. "
+                    f"Aguarde {int(remaining_time/60)} minutos antes de tentar novamente."
                 )
-            except Exception as e:
-                print(f"Erro ao aplicar borda à imagem: {str(e)}")
-                # Continue with original image if border application fails
-            
-            # Upload final image
-            print("Enviando imagem para publicação...")
-            try:
-                final_image = uploader.upload_from_path(image_path)
-                uploaded_images.append(final_image)
-            except Exception as e:
-                print(f"Erro ao fazer upload da imagem final: {str(e)}")
-                raise
-            
-            # Generate caption
-            print("Gerando legenda...")
-            try:
-                crew = InstagramPostCrew()
-                # Usar um dicionário diretamente
-                inputs_dict = {
-                    "genero": inputs.get('genero', 'Neutro'),
-                    "caption": caption,
-                    "describe": describe,
-                    "estilo": inputs.get('estilo', 'Divertido, Alegre, Sarcástico e descontraído'),
-                    "pessoa": inputs.get('pessoa', 'Terceira pessoa do singular'),
-                    "sentimento": inputs.get('sentimento', 'Positivo'),
-                    "tamanho": inputs.get('tamanho', '200 palavras'),
-                    "emojs": inputs.get('emojs', 'sim'),
-                    "girias": inputs.get('girias', 'sim')
-                }
-                final_caption = crew.kickoff(inputs=inputs_dict)  # Passar o dicionário
-            except Exception as e:
-                print(f"Erro ao gerar legenda: {str(e)}")
-                final_caption = caption  # Usar a legenda original em caso de erro
-            
-            # Adicionar texto padrão ao final da legenda
-            final_caption = final_caption + "\n\n-------------------"
-            final_caption = final_caption + "\n\n Essa postagem foi toda realizada por um agente inteligente"
-            final_caption = final_caption + "\n O agente desempenhou as seguintes ações:"
-            final_caption = final_caption + "\n 1 - Idenficação e reconhecimento do ambiente da fotografia"
-            final_caption = final_caption + "\n 2 - Aplicação de Filtros de contraste e autocorreção da imagem"
-            final_caption = final_caption + "\n 3 - Aplicação de moldura específica"
-            final_caption = final_caption + "\n 4 - Definição de uma persona específica com base nas preferências"
-            final_caption = final_caption + "\n 5 - Criação da legenda com base na imagem e na persona"
-            final_caption = final_caption + "\n 6 - Postagem no feed do instagram"
-            final_caption = final_caption + "\n\n-------------------"
-            
-            # Post to Instagram with enhanced rate limit handling
-            print("Iniciando processo de publicação no Instagram...")
-            
-            try:
-                # Verificar limites de requisição
-                stats = post_queue.get_queue_stats()
-                current_time = time.time()
-                
-                if stats["rate_limited_posts"] > InstagramSend.max_rate_limit_hits:
-                    # Check if we're still within the rate limit window
-                    if (current_time - InstagramSend.last_rate_limit_time) < InstagramSend.rate_limit_window:
-                        remaining_time = InstagramSend.rate_limit_window - (current_time - InstagramSend.last_rate_limit_time)
-                        raise RateLimitExceeded(
-                            f"Taxa de requisições severamente excedida. "
-                            f"Aguarde {int(remaining_time/60)} minutos antes de tentar novamente."
-                        )
-                    else:
-                        # Reset rate limit tracking if window has passed
-                        InstagramSend.last_rate_limit_time = 0
-                        stats["rate_limited_posts"] = 0
-
-                # 1. Instanciar o serviço e criar o container de imagem
-                insta_post = InstagramPostService()
-                logger.info("Criando container para a imagem...")
-                container_id = insta_post.create_media_container(final_image['url'], final_caption)
-                
-                if not container_id:
-                    logger.error("Falha ao criar container para a imagem.")
-                    return None
-                
-                # 2. Aguardar processamento do container (verificação periódica do status)
-                logger.info(f"Container criado com ID: {container_id}. Aguardando processamento...")
-                status = insta_post.wait_for_container_status(container_id)
-                
-                if status != 'FINISHED':
-                    logger.error(f"Processamento da imagem falhou com status: {status}")
-                    return None
-                
-                # 3. Publicar a imagem usando o ID do container
-                logger.info("Container pronto para publicação. Publicando imagem...")
-                post_id = insta_post.publish_media(container_id)
-                
-                if not post_id:
-                    logger.error("Falha ao publicar a imagem.")
-                    return None
-                
-                # 4. Obter permalink e retornar resultado
-                permalink = insta_post.get_post_permalink(post_id)
-                
-                # 5. Montar e retornar o resultado
-                result = {
-                    'id': post_id,
-                    'container_id': container_id,
-                    'permalink': permalink,
-                    'media_type': 'IMAGE'
-                }
-                
-                logger.info(f"Imagem publicada com sucesso! ID: {post_id}")
-                
-                # 6. Cleanup - remover arquivos temporários
-                try:
-                    if image_path != original_image_path and os.path.exists(image_path):
-                        logger.info(f"Limpando arquivo temporário: {image_path}")
-                        os.remove(image_path)
-                    
-                    # Limpar imagens do Imgur que foram usadas durante o processo
-                    for img in uploaded_images:
-                        if img.get("deletehash"):
-                            logger.info(f"Removendo imagem temporária do Imgur...")
-                            uploader.delete_image(img["deletehash"])
-                except Exception as e:
-                    logger.warning(f"Erro ao limpar arquivos temporários: {str(e)}")
-                
-                return result
+            else:
+                # Reset rate limit tracking if window has passed
+                InstagramSend.last_rate_limit_time = 0
+                stats["rate_limited_posts"] = 0
 
-            except Exception as e:
-                print(f"Error posting to Instagram: {str(e)}")
-                import traceback
-                print(traceback.format_exc())
+        # 1. Instanciar o serviço e criar o container de imagem
+        insta_post = service_registry.for_account(InstagramPostService, ctx.get('account_id'))
+        logger.info("Criando container para a imagem...")
+        container_id = insta_post.create_media_container(ctx['final_image']['url'], ctx['final_caption'])
+        
+        if not container_id:
+            logger.error("Falha ao criar container para a imagem.")
+            return None
+        
+        ctx['container_id'] = container_id
+        return ctx
+
+    @staticmethod
+    def _wait_container(ctx):
+        """Pipeline stage: wait until the container is FINISHED (network polling)"""
+        container_id = ctx['container_id']
+        
+        # 2. Aguardar processamento do container (verificação periódica do status)
+        logger.info(f"Container criado com ID: {container_id}. Aguardando processamento...")
+        media_size = os.path.getsize(ctx['image_path']) if os.path.exists(ctx['image_path']) else None
+        insta_post = service_registry.for_account(InstagramPostService, ctx.get('account_id'))
+        status = insta_post.wait_for_container_status(container_id, media_size=media_size)
+        
+        if status != 'FINISHED':
+            logger.error(f"Processamento da imagem falhou com status: {status}")
+            return None
+        
+        logger.info(f"Container {container_id} pronto para publicação.")
+        ctx['staged_at'] = time.time()
+        return ctx
+
+    @staticmethod
+    def _publish_image(ctx):
+        """Pipeline stage: publish the container and clean up (network)"""
+        ctx['result'] = InstagramSend.publish_staged(ctx)
+        # publish_staged already released the temporary files and uploads
+        ctx['uploaded_images'] = []
+        ctx['temp_paths'] = []
+        return ctx if ctx['result'] else None
+
+    @staticmethod
+    def publish_staged(staged):
+        """
+        Publish a post previously prepared by stage_instagram, stage_reels or
+        stage_carousel. Only the publish call and the permalink lookup run here.
+
+        Args:
+            staged (dict): Staged post returned by one of the stage_* methods
+
+        Returns:
+            dict: Result information including post ID and permalink (or None on failure)
+        """
+        content_type = staged.get('content_type')
+        container_id = staged['container_id']
+        account_id = staged.get('account_id')
+        retry_later = False
+
+        try:
+            if content_type == 'reel':
+                from src.instagram.instagram_reels_publisher import ReelsPublisher
+                publisher = service_registry.for_account(ReelsPublisher, account_id)
+                logger.info(f"Publicando Reels pré-processado: {container_id}")
+                post_id = publisher.publish_reels(container_id)
+                permalink = publisher.get_reels_permalink(post_id) if post_id else None
+                media_type = 'REELS'
+            elif content_type == 'carousel':
+                from src.instagram.instagram_carousel_service import InstagramCarouselService
+                service = service_registry.for_account(InstagramCarouselService, account_id)
+                logger.info(f"Publicando carrossel pré-processado: {container_id}")
+                post_id = service.publish_carousel(container_id)
+                permalink = service.get_post_permalink(post_id) if post_id else None
+                media_type = 'CAROUSEL_ALBUM'
+            else:
+                insta_post = service_registry.for_account(InstagramPostService, account_id)
+                logger.info(f"Publicando imagem pré-processada: {container_id}")
+                # A fila repete a publicação após um rate limit: o container não fica pendente
+                post_id = insta_post.publish_media(container_id, save_pending=False)
+                permalink = insta_post.get_post_permalink(post_id) if post_id else None
+                media_type = 'IMAGE'
+
+            if not post_id:
+                logger.error(f"Falha ao publicar o container {container_id}.")
                 return None
 
+            logger.info(f"Publicação concluída com sucesso! ID: {post_id}")
+            return {
+                'id': post_id,
+                'container_id': container_id,
+                'permalink': permalink,
+                'media_type': media_type
+            }
+
+        except (RateLimitError, TemporaryServerError):
+            # O container continua válido: a fila publica novamente mais tarde
+            retry_later = True
+            raise
+
         except Exception as e:
-            print(f"Error publishing photo: {e}")
+            print(f"Error publishing staged container {container_id}: {str(e)}")
             import traceback
             print(traceback.format_exc())
             return None
 
+        finally:
+            if not retry_later:
+                InstagramSend._cleanup_staged(staged)
+
+    @staticmethod
+    def _cleanup_staged(staged):
+        """Remove temporary files and hosted images used by a staged post"""
+        try:
+            for path in staged.get('temp_paths', []):
+                if os.path.exists(path):
+                    logger.info(f"Limpando arquivo temporário: {path}")
+                    os.remove(path)
+
+            # Liberar as imagens publicadas no media host durante o processo
+            for img in staged.get('uploaded_images', []):
+                if img.get("deletehash"):
+                    logger.info(f"Removendo imagem temporária do media host...")
+                    media_host.delete(img["deletehash"])
+        except Exception as e:
+            logger.warning(f"Erro ao limpar arquivos temporários: {str(e)}")
+
     @staticmethod
     def send_instagram_reel(video_path, caption, inputs=None):
         """
@@ -512,7 +693,7 @@ class InstagramSend:
                 raise
             
             # Initialize Instagram service
-            service = InstagramCarouselService()
+            service = service_registry.for_account(InstagramCarouselService, InstagramSend._account(inputs))
             
             # Verificar credenciais
             if not service.ig_user_id or not service.access_token:
@@ -524,13 +705,12 @@ class InstagramSend:
             def progress_update(current, total):
                 logger.info(f"[CAROUSEL] Upload de imagens: {current}/{total}")
             
-            uploader = ImageUploader()
             image_urls = []
             uploaded_images = []
             
             try:
                 for path in valid_paths:
-                    uploaded = uploader.upload_from_path(path)
+                    uploaded = media_host.publish(path)
                     if uploaded and 'url' in uploaded:
                         image_urls.append(uploaded['url'])
                         uploaded_images.append(uploaded)
@@ -562,7 +742,7 @@ class InstagramSend:
                     for img in uploaded_images:
                         if img.get("deletehash"):
                             logger.info(f"Removing temporary image from host...")
-                            uploader.delete_image(img["deletehash"])
+                            media_host.delete(img["deletehash"])
                 except Exception as cleanup_error:
                     logger.warning(f"Error during cleanup: {cleanup_error}")
                 
@@ -579,6 +759,114 @@ class InstagramSend:
             logger.error(f"[CAROUSEL] Erro ao processar carrossel: {str(e)}")
             raise e
 
+    @staticmethod
+    def stage_reels(video_path, caption, inputs=None):
+        """
+        Upload a video and prepare its Reels container ahead of publishing,
+        waiting until the container is FINISHED.
+
+        Args:
+            video_path (str): Path to the video file
+            caption (str): Caption text
+            inputs (dict): Optional configuration for post generation
+
+        Returns:
+            dict: Staged post, ready for publish_staged (or None on failure)
+        """
+        from src.instagram.instagram_reels_publisher import ReelsPublisher
+
+        try:
+            publisher = service_registry.for_account(ReelsPublisher, InstagramSend._account(inputs))
+            hashtags = inputs.get('hashtags') if inputs else None
+            share_to_feed = inputs.get('share_to_feed', True) if inputs else True
+
+            container_id = publisher.stage_local_video_to_reels(
+                video_path=video_path,
+                caption=caption,
+                hashtags=hashtags,
+                share_to_feed=share_to_feed
+            )
+            if not container_id:
+                print(f"Failed to stage reel from {video_path}")
+                return None
+
+            return {
+                'content_type': 'reel',
+                'account_id': InstagramSend._account(inputs),
+                'container_id': container_id,
+                'staged_at': time.time()
+            }
+
+        except (RateLimitError, TemporaryServerError):
+            raise
+        except Exception as e:
+            print(f"Error staging reel: {e}")
+            import traceback
+            print(traceback.format_exc())
+            return None
+
+    @staticmethod
+    def stage_carousel(media_paths, caption, inputs=None):
+        """
+        Normalize and upload carousel images and prepare the carousel container
+        ahead of publishing, waiting until the container is FINISHED.
+
+        Args:
+            media_paths (list): List of paths to the media files
+            caption (str): Caption text
+            inputs (dict): Optional configuration for post generation
+
+        Returns:
+            dict: Staged post, ready for publish_staged (or None on failure)
+        """
+        from src.instagram.instagram_carousel_service import InstagramCarouselService
+        from src.instagram.carousel_poster import upload_carousel_images, cleanup_uploaded_images
+
+        uploaded_images = []
+        try:
+            valid_paths = [path for path in media_paths if os.path.exists(path)]
+            if len(valid_paths) < 2:
+                raise Exception(f"Número insuficiente de imagens válidas para criar um carrossel. Válidas: {len(valid_paths)}")
+
+            try:
+                normalized_paths = CarouselNormalizer.normalize_carousel_images(valid_paths)
+                if len(normalized_paths) >= 2:
+                    valid_paths = normalized_paths
+            except Exception as e:
+                logger.warning(f"[CAROUSEL] Erro ao normalizar imagens: {str(e)}. Tentando prosseguir com as originais.")
+
+            service = service_registry.for_account(InstagramCarouselService, InstagramSend._account(inputs))
+            is_valid, missing_permissions = service.check_token_permissions()
+            if not is_valid:
+                raise Exception(f"O token do Instagram não possui as permissões necessárias: {', '.join(missing_permissions)}")
+
+            success, uploaded_images, image_urls = upload_carousel_images(valid_paths)
+            if not success or len(image_urls) < 2:
+                raise Exception("Falha no upload de uma ou mais imagens do carrossel")
+
+            container_id = service.stage_carousel(
+                image_urls, caption, media_size=sum(os.path.getsize(path) for path in valid_paths)
+            )
+            if not container_id:
+                raise Exception("Falha ao preparar o container do carrossel")
+
+            return {
+                'content_type': 'carousel',
+                'account_id': InstagramSend._account(inputs),
+                'container_id': container_id,
+                'staged_at': time.time(),
+                'uploaded_images': uploaded_images,
+                'temp_paths': [path for path in valid_paths if path not in media_paths]
+            }
+
+        except Exception as e:
+            logger.error(f"[CAROUSEL] Erro ao preparar carrossel: {str(e)}")
+            if uploaded_images:
+                cleanup_uploaded_images(uploaded_images)
+            if isinstance(e, (RateLimitError, TemporaryServerError)):
+                raise
+            return None
+
     @staticmethod
     def send_reels(video_path, caption, inputs=None):
         """
@@ -597,7 +885,7 @@ class InstagramSend:
 
         try:
             # Initialize publisher
-            publisher = ReelsPublisher()
+            publisher = service_registry.for_account(ReelsPublisher, InstagramSend._account(inputs))
             
             # Process hashtags if provided in inputs
             hashtags = None
@@ -625,6 +913,8 @@ class InstagramSend:
             print(f"Reel published successfully. ID: {result.get('id')}")
             return result
 
+        except (RateLimitError, TemporaryServerError):
+            raise
         except Exception as e:
             print(f"Error publishing reel: {e}")
             import traceback
@@ -692,7 +982,7 @@ class InstagramSend:
                 pass  # Ignore if the endpoint isn't available
             
             # Certificar-se de que temos as dependências necessárias
-            service = InstagramCarouselService()
+            service = service_registry.for_account(InstagramCarouselService, InstagramSend._account(inputs))
             
             # Verificar explicitamente as permissões do token
             is_valid, missing_permissions = service.check_token_permissions()
@@ -744,6 +1034,9 @@ class InstagramSend:
                             retry_delay *= 2  # Double delay for next attempt
                         else:
                             raise Exception("Falha ao publicar o carrossel após múltiplas tentativas")
+                except (RateLimitError, TemporaryServerError):
+                    # A fila reagenda o trabalho em vez de aguardar aqui
+                    raise
                 except Exception as e:
                     logger.error(f"[CAROUSEL] Erro na tentativa {attempt+1}: {str(e)}")
                     
@@ -771,4 +1064,6 @@ class InstagramSend:
             except Exception as cleanup_error:
                 logger.error(f"[CAROUSEL] Erro ao limpar arquivos temporários: {str(cleanup_error)}")
                 
+            if isinstance(e, (RateLimitError, TemporaryServerError)):
+                raise
             raise Exception(f"Erro ao enviar carrossel: {e}")
@@ -0,0 +1,89 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger('JobDedup')
+
+class JobDeduplicator:
+    """
+    Índice de deduplicação de trabalhos recebidos pelo webhook.
+
+    Associa o hash do conteúdo da mídia e o ID da mensagem ao trabalho criado,
+    para que reenvios (retentativas do webhook ou a mesma foto enviada de novo)
+    dentro da janela configurada reutilizem o trabalho existente. O índice é
+    limitado em tamanho (LRU) e em tempo (TTL).
+    """
+
+    def __init__(self, window=None, max_entries=None):
+        """
+        Args:
+            window (int): Janela de deduplicação em segundos (padrão: POST_QUEUE_DEDUP_WINDOW ou 3600)
+            max_entries (int): Número máximo de chaves no índice (padrão: POST_QUEUE_DEDUP_MAX ou 1000)
+        """
+        self.window = window or int(os.getenv("POST_QUEUE_DEDUP_WINDOW", 60 * 60))
+        self.max_entries = max_entries or int(os.getenv("POST_QUEUE_DEDUP_MAX", 1000))
+        self._entries = OrderedDict()  # chave -> (job_id, expira_em)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def keys_for(media=None, message_id=None):
+        """
+        Gera as chaves de deduplicação de uma mensagem
+
+        Args:
+            media (bytes or list): Conteúdo decodificado da mídia (ou lista de conteúdos)
+            message_id (str): ID da mensagem no WhatsApp
+
+        Returns:
+            list: Chaves de deduplicação
+        """
+        keys = []
+        if message_id:
+            keys.append(f"msg:{message_id}")
+        if media:
+            digest = hashlib.sha256()
+            for data in (media if isinstance(media, list) else [media]):
+                digest.update(hashlib.sha256(data).digest())
+            keys.append(f"sha256:{digest.hexdigest()}")
+        return keys
+
+    def lookup(self, keys):
+        """Retorna o ID do trabalho associado a alguma das chaves, ou None"""
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                job_id, expires_at = entry
+                if expires_at < now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                return job_id
+        return None
+
+    def remember(self, job_id, keys):
+        """Associa as chaves ao trabalho criado"""
+        expires_at = time.time() + self.window
+        with self._lock:
+            for key in keys:
+                self._entries[key] = (job_id, expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def forget(self, keys):
+        """Remove as chaves do índice (ex.: o trabalho associado falhou)"""
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+# Instância global para uso em toda a aplicação
+job_dedup = JobDeduplicator()
@@ -0,0 +1,141 @@
+import time
+import threading
+from collections import OrderedDict, deque
+
+class JobRegistry:
+    """
+    Registro em memória dos trabalhos da PostQueue com índices.
+
+    - Índice por ID (dict) para consultas O(1), inclusive no histórico
+    - Histórico em buffer circular (deque com tamanho máximo)
+    - Índices secundários por status, cujos tamanhos são os contadores
+    - Trabalhos ordenados pela última atualização, para a limpeza por idade
+
+    Os trabalhos são tratados como imutáveis (copy-on-write): cada atualização
+    publica um novo dicionário. Assim, leitores obtêm um snapshot consistente
+    sem adquirir o lock usado pelos workers.
+    """
+
+    FINISHED_STATUSES = ("completed", "failed", "rate_limited", "policy_violation")
+
+    def __init__(self, max_history=100):
+        """
+        Args:
+            max_history (int): Tamanho máximo do histórico em memória
+        """
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()  # job_id -> trabalho, da atualização mais antiga à mais recente
+        self._history = deque(maxlen=max_history)
+        self._history_index = {}  # job_id -> snapshot presente no histórico
+        self._by_status = {}  # status -> set de job_ids ativos
+
+    def add(self, job):
+        """Registra (ou substitui) um trabalho ativo"""
+        job = dict(job)
+        with self._lock:
+            old = self._jobs.get(job["id"])
+            if old is not None:
+                self._unindex(old)
+            self._jobs[job["id"]] = job
+            self._jobs.move_to_end(job["id"])
+            self._by_status.setdefault(job["status"], set()).add(job["id"])
+        return dict(job)
+
+    def update(self, job_id, **changes):
+        """
+        Atualiza campos de um trabalho ativo publicando uma nova versão
+
+        Returns:
+            dict: Cópia da nova versão (ou None se o trabalho não existir)
+        """
+        with self._lock:
+            old = self._jobs.get(job_id)
+            if old is None:
+                return None
+            job = {**old, **changes}
+            if job["status"] != old["status"]:
+                self._unindex(old)
+                self._by_status.setdefault(job["status"], set()).add(job_id)
+            self._jobs[job_id] = job
+            self._jobs.move_to_end(job_id)
+        return dict(job)
+
+    def _unindex(self, job):
+        ids = self._by_status.get(job["status"])
+        if ids is not None:
+            ids.discard(job["id"])
+
+    def get(self, job_id):
+        """Retorna uma cópia do trabalho (ativo ou no histórico) ou None, sem bloquear os workers"""
+        job = self._jobs.get(job_id) or self._history_index.get(job_id)
+        return dict(job) if job is not None else None
+
+    def __contains__(self, job_id):
+        return job_id in self._jobs
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def add_to_history(self, job_id):
+        """Copia o estado atual de um trabalho ativo para o histórico"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                self._append_history(job)
+
+    def load_history(self, jobs):
+        """Carrega trabalhos finalizados no histórico, do mais antigo ao mais novo"""
+        with self._lock:
+            for job in jobs:
+                self._append_history(dict(job))
+
+    def _append_history(self, job):
+        if len(self._history) == self._history.maxlen:
+            evicted = self._history[0]
+            if self._history_index.get(evicted["id"]) is evicted:
+                del self._history_index[evicted["id"]]
+        self._history.append(job)
+        self._history_index[job["id"]] = job
+
+    def history(self, limit=10):
+        """Retorna os trabalhos mais recentes do histórico, do mais novo ao mais antigo"""
+        history = list(self._history)
+        return [dict(job) for job in reversed(history[-limit:])] if limit else []
+
+    def ids_with_status(self, status):
+        """Retorna os IDs dos trabalhos ativos com o status informado"""
+        with self._lock:
+            return set(self._by_status.get(status, ()))
+
+    def count(self, status):
+        """Número de trabalhos ativos com o status informado"""
+        return len(self._by_status.get(status, ()))
+
+    def counts(self):
+        """Número de trabalhos ativos por status"""
+        with self._lock:
+            return {status: len(ids) for status, ids in self._by_status.items() if ids}
+
+    def remove_finished_older_than(self, max_age):
+        """
+        Remove trabalhos finalizados sem atualização há mais de max_age segundos.
+        Percorre apenas o início da ordem por atualização, não todos os trabalhos.
+
+        Returns:
+            list: IDs removidos
+        """
+        cutoff = time.time() - max_age
+        removed = []
+        with self._lock:
+            for _ in range(len(self._jobs)):
+                job_id, job = next(iter(self._jobs.items()))
+                if job["updated_at"] > cutoff:
+                    break
+                if job["status"] in self.FINISHED_STATUSES:
+                    del self._jobs[job_id]
+                    self._unindex(job)
+                    removed.append(job_id)
+                else:
+                    # Trabalhos agendados podem aguardar mais que max_age
+                    self._jobs.move_to_end(job_id)
+        return removed
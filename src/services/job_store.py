@@ -0,0 +1,378 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+from src.utils.paths import Paths
+
+logger = logging.getLogger('JobStore')
+
+class JobStore:
+    """
+    Armazenamento persistente dos trabalhos da PostQueue em SQLite (modo WAL).
+
+    Cada transição de estado é gravada na tabela `job_events` e o estado atual
+    na tabela `jobs`, permitindo recuperar a fila após um reinício ou falha.
+    As escritas usam uma única conexão protegida por lock; as leituras usam
+    conexões por thread, que no modo WAL não bloqueiam o caminho de escrita.
+    """
+
+    UNFINISHED_STATUSES = ("pending", "processing", "scheduled", "staged", "delayed")
+    # Tempo de posse de um trabalho reivindicado por um processo worker; renovado periodicamente
+    LEASE_TIME = 60
+
+    def __init__(self, db_path=None):
+        """
+        Args:
+            db_path (str): Caminho do banco. Padrão: POST_QUEUE_DB ou post_queue.db na raiz do projeto
+        """
+        self.db_path = db_path or os.getenv("POST_QUEUE_DB") or os.path.join(Paths.ROOT_DIR, "post_queue.db")
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._writer = self._connect()
+        self._create_schema()
+
+    def _connect(self):
+        """Abre uma conexão configurada para WAL"""
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader(self):
+        """Retorna a conexão de leitura da thread atual"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            conn.execute("PRAGMA query_only=ON")
+            self._local.conn = conn
+        return conn
+
+    def _create_schema(self):
+        with self._write_lock:
+            self._writer.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    content_type TEXT,
+                    data TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
+                CREATE INDEX IF NOT EXISTS idx_jobs_updated_at ON jobs(updated_at);
+                CREATE TABLE IF NOT EXISTS job_events (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_job_events_job_id ON job_events(job_id);
+            """)
+            # Colunas usadas pelos processos worker (bancos criados antes delas são migrados)
+            columns = {row["name"] for row in self._writer.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in (("pool", "TEXT"), ("claimed_by", "TEXT"), ("lease_until", "REAL"),
+                                        ("account", "TEXT")):
+                if column not in columns:
+                    self._writer.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+            self._writer.executescript("""
+                CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs(status, pool, created_at);
+                CREATE INDEX IF NOT EXISTS idx_jobs_claim_account ON jobs(status, pool, account, created_at);
+                CREATE TABLE IF NOT EXISTS claim_rotation (
+                    pool TEXT PRIMARY KEY,
+                    last_account TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS publish_budget (
+                    account TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+            """)
+
+    def save_job(self, job):
+        """
+        Grava o estado atual de um trabalho e registra a transição de status
+
+        Args:
+            job (dict): Dados do trabalho (mesmo formato de PostQueue.jobs)
+        """
+        data = json.dumps(job, default=str)
+        with self._write_lock:
+            self._writer.execute("BEGIN")
+            try:
+                self._writer.execute(
+                    """
+                    INSERT INTO jobs (id, status, content_type, pool, account, data, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(id) DO UPDATE SET
+                        status = excluded.status,
+                        pool = excluded.pool,
+                        account = excluded.account,
+                        data = excluded.data,
+                        updated_at = excluded.updated_at
+                    """,
+                    (job["id"], job["status"], job.get("content_type"), job.get("pool"),
+                     (job.get("inputs") or {}).get("account_id") or "", data,
+                     job.get("created_at", time.time()), job.get("updated_at", time.time()))
+                )
+                self._writer.execute(
+                    "INSERT INTO job_events (job_id, status, error, at) VALUES (?, ?, ?, ?)",
+                    (job["id"], job["status"], job.get("error"), job.get("updated_at", time.time()))
+                )
+                self._writer.execute("COMMIT")
+            except Exception:
+                self._writer.execute("ROLLBACK")
+                raise
+
+    def get_job(self, job_id):
+        """Retorna os dados de um trabalho ou None"""
+        row = self._reader().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def get_events(self, job_id):
+        """Retorna o histórico de transições de um trabalho"""
+        rows = self._reader().execute(
+            "SELECT status, error, at FROM job_events WHERE job_id = ? ORDER BY seq",
+            (job_id,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def load_unfinished(self):
+        """Retorna os trabalhos pendentes ou em processamento, do mais antigo ao mais novo"""
+        placeholders = ",".join("?" for _ in self.UNFINISHED_STATUSES)
+        rows = self._reader().execute(
+            f"SELECT data FROM jobs WHERE status IN ({placeholders}) ORDER BY created_at",
+            self.UNFINISHED_STATUSES
+        ).fetchall()
+        return [json.loads(row["data"]) for row in rows]
+
+    def load_recent_finished(self, limit=100):
+        """Retorna os trabalhos finalizados mais recentes, do mais antigo ao mais novo"""
+        placeholders = ",".join("?" for _ in self.UNFINISHED_STATUSES)
+        rows = self._reader().execute(
+            f"SELECT data FROM jobs WHERE status NOT IN ({placeholders}) ORDER BY updated_at DESC LIMIT ?",
+            (*self.UNFINISHED_STATUSES, limit)
+        ).fetchall()
+        return [json.loads(row["data"]) for row in reversed(rows)]
+
+    def purge_finished(self, max_age):
+        """Remove trabalhos finalizados (e seus eventos) mais antigos que max_age segundos"""
+        cutoff = time.time() - max_age
+        placeholders = ",".join("?" for _ in self.UNFINISHED_STATUSES)
+        with self._write_lock:
+            self._writer.execute("BEGIN")
+            try:
+                self._writer.execute(
+                    f"""
+                    DELETE FROM job_events WHERE job_id IN (
+                        SELECT id FROM jobs WHERE updated_at < ? AND status NOT IN ({placeholders})
+                    )
+                    """,
+                    (cutoff, *self.UNFINISHED_STATUSES)
+                )
+                deleted = self._writer.execute(
+                    f"DELETE FROM jobs WHERE updated_at < ? AND status NOT IN ({placeholders})",
+                    (cutoff, *self.UNFINISHED_STATUSES)
+                ).rowcount
+                self._writer.execute("COMMIT")
+            except Exception:
+                self._writer.execute("ROLLBACK")
+                raise
+        if deleted:
+            logger.info(f"{deleted} trabalho(s) antigo(s) removido(s) do armazenamento")
+        return deleted
+
+    def claim_next(self, pool, worker_id):
+        """
+        Reivindica um trabalho pendente de um pool para um processo worker.
+        A transação IMMEDIATE garante que dois processos nunca reivindiquem o mesmo trabalho.
+
+        As contas são atendidas em rodízio, como na FairQueue do modo local: cada
+        reivindicação pega o trabalho mais antigo da conta seguinte à última atendida
+        no pool (a posição do rodízio fica no banco, compartilhada pelos processos).
+
+        Args:
+            pool (str): Nome do pool ("image", "reel", "carousel")
+            worker_id (str): Identificador do processo worker
+
+        Returns:
+            dict: Dados do trabalho, já com status "processing" (ou None se não houver pendentes)
+        """
+        now = time.time()
+        with self._write_lock:
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                rotation = self._writer.execute(
+                    "SELECT last_account FROM claim_rotation WHERE pool = ?", (pool,)
+                ).fetchone()
+                last_account = rotation["last_account"] if rotation else None
+                # Primeiro as contas depois da última atendida; ao fim da lista, volta ao início
+                row = self._writer.execute(
+                    """
+                    SELECT data, COALESCE(account, '') AS account FROM jobs
+                    WHERE status = 'pending' AND pool = ?
+                    ORDER BY (? IS NOT NULL AND COALESCE(account, '') <= ?), COALESCE(account, ''), created_at
+                    LIMIT 1
+                    """,
+                    (pool, last_account, last_account)
+                ).fetchone()
+                if row is None:
+                    self._writer.execute("COMMIT")
+                    return None
+                self._writer.execute(
+                    """
+                    INSERT INTO claim_rotation (pool, last_account) VALUES (?, ?)
+                    ON CONFLICT(pool) DO UPDATE SET last_account = excluded.last_account
+                    """,
+                    (pool, row["account"])
+                )
+                job = json.loads(row["data"])
+                job["status"] = "processing"
+                job["updated_at"] = now
+                self._writer.execute(
+                    """
+                    UPDATE jobs SET status = ?, data = ?, updated_at = ?, claimed_by = ?, lease_until = ?
+                    WHERE id = ?
+                    """,
+                    (job["status"], json.dumps(job, default=str), now, worker_id, now + self.LEASE_TIME, job["id"])
+                )
+                self._writer.execute(
+                    "INSERT INTO job_events (job_id, status, error, at) VALUES (?, ?, ?, ?)",
+                    (job["id"], job["status"], None, now)
+                )
+                self._writer.execute("COMMIT")
+                return job
+            except Exception:
+                self._writer.execute("ROLLBACK")
+                raise
+
+    def take_publish_token(self, account, quota, window):
+        """
+        Retira um token da cota de publicação da conta, compartilhada por todos os
+        processos que usam este banco (balde de tokens recarregado em quota/window por segundo)
+
+        Returns:
+            float: 0 se o token foi retirado, senão os segundos até haver um disponível
+        """
+        return self._update_publish_budget(account, quota, window, -1)
+
+    def return_publish_token(self, account, quota, window):
+        """Devolve um token retirado por take_publish_token para uma publicação que não ocorreu"""
+        self._update_publish_budget(account, quota, window, 1)
+
+    def _update_publish_budget(self, account, quota, window, change):
+        now = time.time()
+        refill_rate = quota / window
+        with self._write_lock:
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._writer.execute(
+                    "SELECT tokens, updated_at FROM publish_budget WHERE account = ?", (account,)
+                ).fetchone()
+                tokens = quota if row is None else min(quota, row["tokens"] + (now - row["updated_at"]) * refill_rate)
+                wait = 0.0
+                if change < 0 and tokens < 1:
+                    wait = (1 - tokens) / refill_rate
+                else:
+                    tokens = min(quota, tokens + change)
+                self._writer.execute(
+                    """
+                    INSERT INTO publish_budget (account, tokens, updated_at) VALUES (?, ?, ?)
+                    ON CONFLICT(account) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at
+                    """,
+                    (account, tokens, now)
+                )
+                self._writer.execute("COMMIT")
+            except Exception:
+                self._writer.execute("ROLLBACK")
+                raise
+        return wait
+
+    def renew_leases(self, job_ids, worker_id):
+        """Renova a posse dos trabalhos em processamento por um worker"""
+        if not job_ids:
+            return
+        placeholders = ",".join("?" for _ in job_ids)
+        with self._write_lock:
+            self._writer.execute(
+                f"UPDATE jobs SET lease_until = ? WHERE claimed_by = ? AND id IN ({placeholders})",
+                (time.time() + self.LEASE_TIME, worker_id, *job_ids)
+            )
+
+    def requeue_expired(self):
+        """
+        Devolve à fila os trabalhos cuja posse expirou (processo worker encerrado
+        ou travado durante o processamento)
+
+        Returns:
+            list: IDs dos trabalhos devolvidos à fila
+        """
+        now = time.time()
+        with self._write_lock:
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._writer.execute(
+                    "SELECT data FROM jobs WHERE status = 'processing' AND COALESCE(lease_until, 0) < ?",
+                    (now,)
+                ).fetchall()
+                requeued = []
+                for row in rows:
+                    job = json.loads(row["data"])
+                    job["status"] = "pending"
+                    job["updated_at"] = now
+                    job["recovered"] = job.get("recovered", 0) + 1
+                    self._writer.execute(
+                        "UPDATE jobs SET status = ?, data = ?, updated_at = ?, claimed_by = NULL, lease_until = NULL WHERE id = ?",
+                        (job["status"], json.dumps(job, default=str), now, job["id"])
+                    )
+                    self._writer.execute(
+                        "INSERT INTO job_events (job_id, status, error, at) VALUES (?, ?, ?, ?)",
+                        (job["id"], job["status"], None, now)
+                    )
+                    requeued.append(job["id"])
+                self._writer.execute("COMMIT")
+            except Exception:
+                self._writer.execute("ROLLBACK")
+                raise
+        if requeued:
+            logger.warning(f"{len(requeued)} trabalho(s) com posse expirada devolvido(s) à fila")
+        return requeued
+
+    def last_event_seq(self):
+        """Retorna o número de sequência do último evento registrado"""
+        row = self._reader().execute("SELECT COALESCE(MAX(seq), 0) AS seq FROM job_events").fetchone()
+        return row["seq"]
+
+    def get_events_since(self, seq, limit=500):
+        """
+        Retorna os eventos posteriores a seq, com os dados atuais do trabalho
+
+        Returns:
+            list: Dicionários com seq, job_id, status, error e job
+        """
+        rows = self._reader().execute(
+            """
+            SELECT e.seq, e.job_id, e.status, e.error, j.data
+            FROM job_events e JOIN jobs j ON j.id = e.job_id
+            WHERE e.seq > ? ORDER BY e.seq LIMIT ?
+            """,
+            (seq, limit)
+        ).fetchall()
+        return [
+            {"seq": row["seq"], "job_id": row["job_id"], "status": row["status"],
+             "error": row["error"], "job": json.loads(row["data"])}
+            for row in rows
+        ]
+
+    def close(self):
+        """Fecha a conexão de escrita e a conexão de leitura da thread atual"""
+        with self._write_lock:
+            self._writer.close()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
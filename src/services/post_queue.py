@@ -1,11 +1,23 @@
 import os
+import copy
 import time
 import uuid
+import socket
 import threading
 import logging
+from datetime import datetime
 from queue import Queue, Empty
 from threading import Thread
 
+from src.services.job_store import JobStore
+from src.services.job_registry import JobRegistry
+from src.services.post_scheduler import PostScheduler
+from src.services.publish_pipeline import PublishPipeline
+from src.services.admission import admission_controller
+from src.services.fair_queue import FairQueue
+from src.instagram.rate_governor import rate_governor
+from src.instagram.accounts import accounts
+
 # Configurar logger
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('PostQueue')
@@ -25,17 +37,89 @@ class PostStatus:
     FAILED = "failed"
     RATE_LIMITED = "rate_limited"
     POLICY_VIOLATION = "policy_violation"
+    SCHEDULED = "scheduled"
+    STAGED = "staged"
+    DELAYED = "delayed"
+
+class WorkerPool:
+    """
+    Pool de workers dedicado a um tipo de conteúdo.
+    
+    Cada pool possui sua própria fila e seu próprio número de threads, de forma
+    que um Reels demorado não bloqueie as imagens que estão na fila. A fila é
+    particionada por conta do Instagram e atendida em rodízio, pulando as
+    contas cuja cota está esgotada.
+    """
+    
+    def __init__(self, name, size):
+        self.name = name
+        self.size = max(1, int(size))
+        self.job_queue = FairQueue(wait_time=rate_governor.wait_time)
+        self.threads = []
+        self.stats = {
+            "workers": self.size,
+            "active_workers": 0,
+            "total_jobs": 0,
+            "completed_jobs": 0,
+            "failed_jobs": 0,
+            "avg_processing_time": 0
+        }
 
 class PostQueue:
     """
     Sistema de filas para processamento assíncrono de posts e reels
     """
     
-    def __init__(self):
-        """Inicializa o sistema de filas"""
-        self.job_queue = Queue()
-        self.jobs = {}  # Armazena informações sobre os trabalhos
-        self.job_history = []  # Histórico de trabalhos
+    # Número padrão de workers por tipo de conteúdo. Pode ser sobrescrito
+    # pelo construtor ou pelas variáveis POST_QUEUE_<POOL>_WORKERS.
+    DEFAULT_POOL_SIZES = {
+        "image": 2,
+        "reel": 1,
+        "carousel": 1
+    }
+    
+    MAX_HISTORY = 100  # Tamanho máximo do histórico em memória
+    STORE_RETENTION = 7 * 24 * 60 * 60  # Tempo de retenção de trabalhos finalizados no armazenamento
+    # Antecedência com que um post agendado é preparado (filtro, upload, legenda, container)
+    STAGE_LEAD_TIME = int(os.getenv("POST_QUEUE_STAGE_LEAD", 60 * 60))
+    # Containers do Instagram expiram em 24h; acima deste limite o post é preparado novamente
+    CONTAINER_MAX_AGE = 23 * 60 * 60
+    # Modos de execução (POST_QUEUE_MODE):
+    #   "local"    - os trabalhos rodam em threads deste processo (padrão)
+    #   "external" - este processo apenas enfileira; `python -m src.worker` executa os trabalhos
+    #   "worker"   - processo worker: reivindica trabalhos pendentes do armazenamento compartilhado
+    MODES = ("local", "external", "worker")
+    STORE_POLL_INTERVAL = 0.5  # Intervalo de consulta ao armazenamento nos modos external/worker
+    # Falhas temporárias (rate limit, erro do servidor) estacionam o trabalho em vez de
+    # ocupar o worker; após MAX_RETRIES tentativas o trabalho falha em definitivo
+    MAX_RETRIES = int(os.getenv("POST_QUEUE_MAX_RETRIES", 5))
+    RETRY_BASE_DELAY = 30  # Espera da primeira nova tentativa sem retry_seconds informado
+    RETRY_MAX_DELAY = 60 * 60
+    
+    def __init__(self, pool_sizes=None, job_store=None, mode=None):
+        """
+        Inicializa o sistema de filas
+        
+        Args:
+            pool_sizes (dict): Número de workers por pool ("image", "reel", "carousel")
+            job_store (JobStore): Armazenamento persistente dos trabalhos (padrão: SQLite na raiz do projeto)
+            mode (str): "local", "external" ou "worker" (padrão: POST_QUEUE_MODE ou "local")
+        """
+        self.mode = mode or os.getenv("POST_QUEUE_MODE", "local")
+        if self.mode not in self.MODES:
+            raise ValueError(f"Modo de fila inválido: {self.mode} (use {', '.join(self.MODES)})")
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.claimed = set()  # Trabalhos reivindicados por este processo worker
+        self.publish_tokens = set()  # Trabalhos despachados com um token de publicação do governador
+        self.last_event_seq = 0
+        self.store_threads = []
+        self.pools = {}
+        for name, default_size in self.DEFAULT_POOL_SIZES.items():
+            size = os.getenv(f"POST_QUEUE_{name.upper()}_WORKERS", default_size)
+            if pool_sizes and name in pool_sizes:
+                size = pool_sizes[name]
+            self.pools[name] = WorkerPool(name, size)
+        self.registry = JobRegistry(max_history=self.MAX_HISTORY)  # Trabalhos ativos e histórico indexados
         self.stats = {
             "total_jobs": 0,
             "completed_jobs": 0,
@@ -45,42 +129,172 @@ class PostQueue:
             "image_processing_jobs": 0,
             "avg_processing_time": 0
         }
-        self.worker_thread = None
         self.is_running = False
         self.processing_lock = threading.Lock()  # Lock para operações críticas
+        self.job_store = job_store or JobStore()
+        # Com processos worker, a cota de publicação de cada conta fica no armazenamento
+        # compartilhado: somados, os processos não passam de INSTAGRAM_PUBLISH_QUOTA
+        rate_governor.share_publish_budget(self.job_store if self.mode != "local" else None)
+        self.last_store_purge = 0
+        self.scheduler = PostScheduler(self._run_scheduled_action)
+        self.pipeline = None  # Pipeline de imagens, criado na primeira utilização
+        self.subscribers = {}  # token -> (callback, statuses)
+        self.event_queue = Queue()  # Transições de status a notificar
+        self.event_thread = None
+
+        # Recuperar trabalhos interrompidos por um reinício ou falha
+        self._recover_jobs()
 
         # Iniciar thread de processamento
         self.start_worker()
     
+    def _recover_jobs(self):
+        """Recarrega o histórico e reenfileira trabalhos pendentes do armazenamento persistente"""
+        if self.mode == "worker":
+            # Processos worker reivindicam os trabalhos diretamente do armazenamento;
+            # trabalhos de workers encerrados voltam à fila quando a posse expira
+            return
+        
+        try:
+            self.registry.load_history(self.job_store.load_recent_finished(limit=self.MAX_HISTORY))
+            unfinished = self.job_store.load_unfinished()
+        except Exception as e:
+            logger.error(f"Erro ao carregar trabalhos persistidos: {e}")
+            return
+        
+        for job in unfinished:
+            job_id = job["id"]
+            job["pool"] = self._pool_name(job.get("content_type"))
+            job["recovered"] = job.get("recovered", 0) + 1
+            self.registry.add(job)
+            
+            if job["status"] == "scheduled":
+                self.scheduler.schedule(job["publish_at"] - self.STAGE_LEAD_TIME, job_id, "stage")
+                continue
+            if job["status"] == "staged":
+                self.scheduler.schedule(job["publish_at"], job_id, "publish")
+                continue
+            if job["status"] == "delayed":
+                self.scheduler.schedule(job.get("not_before") or time.time(), job_id, "retry")
+                continue
+            if self.mode == "external":
+                # Pendentes e em processamento pertencem aos processos worker
+                continue
+            
+            missing = [path for path in job["media_paths"] if not os.path.isfile(path)]
+            if missing:
+                logger.warning(f"Trabalho {job_id} não pode ser recuperado, mídia ausente: {missing}")
+                self._update_job_status(job_id, "failed", error=f"Media file not found after restart: {missing}")
+                self._add_to_history(job_id)
+                continue
+            
+            # Trabalhos interrompidos durante o processamento voltam para a fila
+            self._update_job_status(job_id, "pending")
+            pool = self.pools[job["pool"]]
+            with self.processing_lock:
+                self.stats["total_jobs"] += 1
+                pool.stats["total_jobs"] += 1
+            pool.job_queue.put(job_id, self._account_id(job))
+        
+        if unfinished:
+            logger.info(f"{len(unfinished)} trabalho(s) recuperado(s) do armazenamento persistente")
+    
+    def _served_pools(self):
+        """Pools cujos trabalhos são executados por este processo"""
+        if self.mode == "external":
+            return []
+        if self.mode == "worker":
+            served = os.getenv("POST_QUEUE_WORKER_POOLS")
+            if served:
+                return [self.pools[name.strip()] for name in served.split(",") if name.strip() in self.pools]
+        return list(self.pools.values())
+    
     def start_worker(self):
-        """Inicia o thread worker para processamento de filas"""
+        """Inicia os threads workers de todos os pools"""
         if not self.is_running:
             self.is_running = True
-            self.worker_thread = Thread(target=self._process_queue, daemon=True)
-            self.worker_thread.start()
-            logger.info("Worker de processamento iniciado")
+            for pool in self._served_pools():
+                pool.threads = []
+                for index in range(pool.size):
+                    thread = Thread(
+                        target=self._process_queue,
+                        args=(pool,),
+                        name=f"PostQueue-{pool.name}-{index}",
+                        daemon=True
+                    )
+                    thread.start()
+                    pool.threads.append(thread)
+                logger.info(f"Pool '{pool.name}' iniciado com {pool.size} worker(s)")
+            if self.mode != "worker":
+                self.scheduler.start()
+            self.event_thread = Thread(target=self._dispatch_events, name="PostQueue-events", daemon=True)
+            self.event_thread.start()
+            
+            # Threads de integração com o armazenamento compartilhado
+            if self.mode == "external":
+                self.last_event_seq = self.job_store.last_event_seq()
+                self.store_threads = [Thread(target=self._watch_store_events, name="PostQueue-watcher", daemon=True)]
+            elif self.mode == "worker":
+                self.store_threads = [Thread(target=self._renew_leases, name="PostQueue-leases", daemon=True)]
+            for thread in self.store_threads:
+                thread.start()
+            logger.info(f"Fila iniciada no modo '{self.mode}'")
     
     def stop_worker(self):
-        """Para o thread worker"""
+        """Para os threads workers de todos os pools"""
         self.is_running = False
-        if self.worker_thread and self.worker_thread.is_alive():
-            self.worker_thread.join(timeout=5.0)
-            logger.info("Worker de processamento encerrado")
+        self.scheduler.stop()
+        if self.pipeline:
+            self.pipeline.stop()
+        self.event_queue.put(None)
+        if self.event_thread and self.event_thread.is_alive():
+            self.event_thread.join(timeout=5.0)
+        for pool in self.pools.values():
+            for thread in pool.threads:
+                if thread.is_alive():
+                    thread.join(timeout=5.0)
+            pool.threads = []
+        for thread in self.store_threads:
+            if thread.is_alive():
+                thread.join(timeout=5.0)
+        self.store_threads = []
+        logger.info("Workers de processamento encerrados")
     
-    def add_job(self, media_path, caption, inputs=None) -> str:
+    @staticmethod
+    def _pool_name(content_type):
+        """Retorna o nome do pool responsável por um tipo de conteúdo"""
+        if content_type in ("reel", "video"):
+            return "reel"
+        if content_type in ("carousel", "carrossel"):
+            return "carousel"
+        return "image"
+    
+    def add_job(self, media_path, caption, inputs=None, publish_at=None) -> str:
         """
         Adiciona um novo trabalho à fila
         
         Args:
             media_path (str or list): Caminho do arquivo de mídia ou lista de caminhos
             caption (str): Legenda do post
-            inputs (dict): Configurações adicionais
+            inputs (dict): Configurações adicionais. inputs["account"] (nome ou ID) escolhe a
+                conta do Instagram; sem ela, o post vai para a conta padrão.
+            publish_at (float or datetime): Horário agendado para a publicação. As etapas
+                custosas rodam antes e, no horário, apenas a publicação é feita.
             
         Returns:
             str: ID do trabalho
         """
         job_id = str(uuid.uuid4())
         
+        # O trabalho guarda o ID da conta: shard da fila, cota e credenciais são por conta
+        inputs = dict(inputs or {})
+        account_id = accounts.account_id(inputs.pop("account", None) or inputs.get("account_id"))
+        if account_id:
+            inputs["account_id"] = account_id
+        
+        if isinstance(publish_at, datetime):
+            publish_at = publish_at.timestamp()
+        
         # Converter media_path para lista se for string
         media_paths = media_path if isinstance(media_path, list) else [media_path]
         
@@ -100,13 +314,15 @@ class PostQueue:
             "id": job_id,
             "media_paths": media_paths,
             "caption": caption,
-            "inputs": inputs or {},
+            "inputs": inputs,
             "status": "pending",
             "created_at": time.time(),
             "updated_at": time.time(),
             "result": None,
             "error": None,
-            "content_type": content_type
+            "content_type": content_type,
+            "publish_at": publish_at,
+            "staged": None
         }
         
         # Validate paths exist
@@ -114,180 +330,556 @@ class PostQueue:
             if not os.path.isfile(path):
                 raise FileNotFoundError(f"Media file not found: {path}")
         
-        # Store job information
-        self.jobs[job_id] = job_data
+        # Posts agendados para muito depois só são preparados perto do horário
+        stage_at = publish_at - self.STAGE_LEAD_TIME if publish_at else None
+        if stage_at and stage_at > time.time():
+            job_data["status"] = "scheduled"
         
-        # Add to processing queue
-        self.job_queue.put(job_id)
+        # Store job information
+        pool = self.pools[self._pool_name(content_type)]
+        job_data["pool"] = pool.name
+        self.registry.add(job_data)
+        self.job_store.save_job(job_data)
+        self._emit_event(job_id, job_data["status"], job_data)
         
         # Update statistics
         with self.processing_lock:
             self.stats["total_jobs"] += 1
+            pool.stats["total_jobs"] += 1
             if content_type == "reel":
                 self.stats["video_processing_jobs"] += 1
             else:
                 self.stats["image_processing_jobs"] += 1
         
-        logger.info(f"Novo trabalho adicionado: {job_id} ({content_type})")
+        # Add to processing queue
+        if job_data["status"] == "scheduled":
+            self.scheduler.schedule(stage_at, job_id, "stage")
+        else:
+            self._enqueue(pool, job_data)
+        
+        logger.info(f"Novo trabalho adicionado: {job_id} ({content_type}, pool '{pool.name}', conta {account_id or 'padrão'})")
         return job_id
     
-    def _process_queue(self):
-        """Thread worker para processar trabalhos na fila"""
+    def _enqueue(self, pool, job):
+        """
+        Coloca um trabalho pendente na fila do pool, no shard da sua conta. Nos modos
+        external/worker o próprio armazenamento é a fila: o status "pending" já gravado basta.
+        """
+        if self.mode == "local":
+            pool.job_queue.put(job["id"], self._account_id(job))
+    
+    def _process_queue(self, pool):
+        """Thread worker para processar trabalhos na fila de um pool"""
+        if self.mode == "worker":
+            return self._claim_jobs(pool)
+        
         while self.is_running:
             try:
                 # Tentar obter um trabalho da fila
                 try:
-                    job_id = self.job_queue.get(block=True, timeout=1.0)
+                    job_id = pool.job_queue.get(block=True, timeout=1.0)
                 except Empty:
                     # Fila vazia, continuar verificando
                     continue
                 
-                # Processar o trabalho
+                with self.processing_lock:
+                    pool.stats["active_workers"] += 1
                 try:
-                    logger.info(f"Processando trabalho: {job_id}")
-                    
-                    # Obter dados do trabalho
-                    job = self.jobs[job_id]
-                    
-                    # Atualizar status
-                    self._update_job_status(job_id, "processing")
-                    
-                    # Importar módulos necessários aqui para evitar dependências circulares
-                    from src.services.instagram_send import InstagramSend
-                    
-                    start_time = time.time()
-                    result = None
-                    error = None
-                    
-                    # Processar com base no tipo de conteúdo
-                    try:
-                        if job["content_type"] == "reel":
-                            logger.info(f"Processando vídeo para Reels: {job['media_paths'][0]}")
-                            # Priorizar configurações específicas para otimizar vídeos
-                            share_to_feed = True
-                            if "share_to_feed" in job["inputs"]:
-                                share_to_feed = job["inputs"]["share_to_feed"]
-                                
-                            result = InstagramSend.send_reels(
-                                job["media_paths"][0], 
-                                job["caption"],
-                                job["inputs"]
-                            )
-                        elif job["content_type"] == "carousel":
-                            logger.info(f"Processando carrossel: {job['media_paths']}")
-                            result = InstagramSend.send_carousel(
-                                job["media_paths"], 
-                                job["caption"],
-                                job["inputs"]
-                            )
-                        else:
-                            # Imagem padrão
-                            result = InstagramSend.send_instagram(
-                                job["media_paths"][0], 
-                                job["caption"],
-                                job["inputs"]
-                            )
-                            
-                        if result:
-                            self._update_job_status(job_id, "completed", result=result)
-                            logger.info(f"Trabalho completado: {job_id}")
-                            
-                            with self.processing_lock:
-                                self.stats["completed_jobs"] += 1
-                        else:
-                            raise Exception("Falha no processamento do conteúdo")
-                            
-                    except RateLimitExceeded as e:
-                        error = str(e)
-                        logger.warning(f"Rate limit excedido: {error}")
-                        
-                        # Marcar como falha de rate limit
-                        self._update_job_status(job_id, "rate_limited", error=error)
-                        
-                        with self.processing_lock:
-                            self.stats["rate_limited_posts"] += 1
-                            self.stats["failed_jobs"] += 1
-                            
-                    except ContentPolicyViolation as e:
-                        error = str(e)
-                        logger.warning(f"Violação de política: {error}")
-                        self._update_job_status(job_id, "policy_violation", error=error)
-                        
-                        with self.processing_lock:
-                            self.stats["failed_jobs"] += 1
-                            
-                    except Exception as e:
-                        error = str(e)
-                        logger.error(f"Erro no processamento: {error}")
-                        self._update_job_status(job_id, "failed", error=error)
-                        
-                        with self.processing_lock:
-                            self.stats["failed_jobs"] += 1
-                    
-                    # Calcular tempo médio de processamento
-                    processing_time = time.time() - start_time
+                    self._process_job(pool, job_id)
+                finally:
                     with self.processing_lock:
-                        if self.stats["completed_jobs"] > 0:
-                            current_avg = self.stats["avg_processing_time"]
-                            total_processed = self.stats["completed_jobs"]
-                            new_avg = ((current_avg * (total_processed - 1)) + processing_time) / total_processed
-                            self.stats["avg_processing_time"] = new_avg
-                    
-                    # Adicionar ao histórico
-                    self._add_to_history(job_id)
-                    
-                    # Limpar mídia temporária após processamento 
-                    for media_path in job["media_paths"]:
-                        self._cleanup_media(media_path)
+                        pool.stats["active_workers"] -= 1
+                    # Marcar como concluído na fila
+                    pool.job_queue.task_done()
                     
+            except Exception as e:
+                logger.exception(f"Erro no worker de processamento ({pool.name}): {e}")
+    
+    def _claim_jobs(self, pool):
+        """Thread de um processo worker: reivindica e processa trabalhos pendentes do armazenamento"""
+        while self.is_running:
+            try:
+                job = self.job_store.claim_next(pool.name, self.worker_id)
+                if job is None:
+                    time.sleep(self.STORE_POLL_INTERVAL)
+                    continue
+                
+                job["pool"] = pool.name
+                self.registry.add(job)
+                with self.processing_lock:
+                    self.claimed.add(job["id"])
+                    self.stats["total_jobs"] += 1
+                    pool.stats["total_jobs"] += 1
+                    pool.stats["active_workers"] += 1
+                try:
+                    self._process_job(pool, job["id"])
                 finally:
-                    # Marcar como concluído na fila
-                    self.job_queue.task_done()
+                    with self.processing_lock:
+                        pool.stats["active_workers"] -= 1
                     
             except Exception as e:
-                logger.exception(f"Erro no worker de processamento: {e}")
+                logger.exception(f"Erro no worker de processamento ({pool.name}): {e}")
+                time.sleep(self.STORE_POLL_INTERVAL)
     
-    def _update_job_status(self, job_id, status, result=None, error=None):
-        """Atualiza o status de um trabalho"""
-        if job_id in self.jobs:
-            self.jobs[job_id]["status"] = status
-            self.jobs[job_id]["updated_at"] = time.time()
+    def _renew_leases(self):
+        """Thread de um processo worker: renova a posse dos trabalhos em andamento e libera as expiradas"""
+        interval = self.job_store.LEASE_TIME / 3
+        while self.is_running:
+            try:
+                with self.processing_lock:
+                    claimed = list(self.claimed)
+                self.job_store.renew_leases(claimed, self.worker_id)
+                self.job_store.requeue_expired()
+            except Exception as e:
+                logger.warning(f"Erro ao renovar posse dos trabalhos: {e}")
             
-            if result is not None:
-                self.jobs[job_id]["result"] = result
-                
-            if error is not None:
-                self.jobs[job_id]["error"] = error
+            deadline = time.time() + interval
+            while self.is_running and time.time() < deadline:
+                time.sleep(0.5)
     
-    def _add_to_history(self, job_id):
-        """Adiciona um trabalho ao histórico"""
-        if job_id in self.jobs:
-            # Copiar o trabalho para o histórico
-            job_copy = self.jobs[job_id].copy()
+    def _watch_store_events(self):
+        """
+        Thread do modo external: acompanha as transições gravadas pelos processos
+        worker e as aplica ao registro local e aos inscritos
+        """
+        while self.is_running:
+            try:
+                events = self.job_store.get_events_since(self.last_event_seq)
+            except Exception as e:
+                logger.warning(f"Erro ao consultar eventos do armazenamento: {e}")
+                events = []
+            
+            for event in events:
+                self.last_event_seq = event["seq"]
+                try:
+                    self._apply_store_event(event)
+                except Exception as e:
+                    logger.error(f"Erro ao aplicar evento do trabalho {event['job_id']}: {e}")
             
-            # Limitar tamanho do histórico
-            MAX_HISTORY = 100
-            if len(self.job_history) >= MAX_HISTORY:
-                self.job_history.pop(0)  # Remover o mais antigo
+            if not events:
+                time.sleep(self.STORE_POLL_INTERVAL)
+    
+    def _apply_store_event(self, event):
+        """Aplica uma transição gravada por outro processo"""
+        job_id, status = event["job_id"], event["status"]
+        job = dict(event["job"], status=status)
+        if event["error"] is not None:
+            job["error"] = event["error"]
+        job["pool"] = self._pool_name(job.get("content_type"))
+        
+        if job_id in self.registry:
+            self.registry.update(job_id, **job)
+        else:
+            self.registry.add(job)
+        
+        if status == "staged" and job.get("publish_at"):
+            self.scheduler.schedule(job["publish_at"], job_id, "publish")
+        elif status == "delayed":
+            self.scheduler.schedule(job.get("not_before") or time.time(), job_id, "retry")
+        
+        counters = {
+            "completed": ("completed_jobs",),
+            "failed": ("failed_jobs",),
+            "policy_violation": ("failed_jobs",),
+            "rate_limited": ("failed_jobs", "rate_limited_posts")
+        }
+        if status in counters:
+            pool = self.pools[job["pool"]]
+            with self.processing_lock:
+                for counter in counters[status]:
+                    self.stats[counter] += 1
+                    if counter in pool.stats:
+                        pool.stats[counter] += 1
+            self._add_to_history(job_id)
+        
+        self.event_queue.put((job_id, status, job))
+    
+    def _execute_job(self, job):
+        """
+        Executa a publicação de um trabalho de acordo com seu pool
+        
+        Returns:
+            dict: Resultado da publicação (ou None em caso de falha)
+        """
+        # Importar módulos necessários aqui para evitar dependências circulares
+        from src.services.instagram_send import InstagramSend
+        
+        if job["pool"] == "reel":
+            logger.info(f"Processando vídeo para Reels: {job['media_paths'][0]}")
+            return InstagramSend.send_reels(
+                job["media_paths"][0], 
+                job["caption"],
+                job["inputs"]
+            )
+        elif job["pool"] == "carousel":
+            logger.info(f"Processando carrossel: {job['media_paths']}")
+            return InstagramSend.send_carousel(
+                job["media_paths"], 
+                job["caption"],
+                job["inputs"]
+            )
+        # Imagem padrão
+        return InstagramSend.send_instagram(
+            job["media_paths"][0], 
+            job["caption"],
+            job["inputs"]
+        )
+    
+    def _stage_job(self, job):
+        """
+        Executa as etapas custosas de um post agendado até o container ficar pronto
+        
+        Returns:
+            dict: Post preparado (ou None em caso de falha)
+        """
+        from src.services.instagram_send import InstagramSend
+        
+        if job["pool"] == "reel":
+            staged = InstagramSend.stage_reels(job["media_paths"][0], job["caption"], job["inputs"])
+        elif job["pool"] == "carousel":
+            staged = InstagramSend.stage_carousel(job["media_paths"], job["caption"], job["inputs"])
+        else:
+            staged = InstagramSend.stage_instagram(job["media_paths"][0], job["caption"], job["inputs"])
+        
+        if staged:
+            self._update_job_status(job["id"], "staged", staged=staged)
+            if self.mode == "local":
+                # Nos demais modos, o processo que enfileirou agenda a publicação ao ver o status "staged"
+                self.scheduler.schedule(job["publish_at"], job["id"], "publish")
+            logger.info(f"Trabalho {job['id']} preparado, container {staged['container_id']} aguardando o horário agendado")
+        return staged
+    
+    def _publish_staged_job(self, job):
+        """Publica um post previamente preparado (apenas a chamada de publicação)"""
+        from src.services.instagram_send import InstagramSend
+        return InstagramSend.publish_staged(job["staged"])
+    
+    def _run_scheduled_action(self, job_id, action):
+        """Executa uma ação do agendador ("stage", "publish" ou "retry")"""
+        job = self.registry.get(job_id)
+        if not job:
+            logger.warning(f"Trabalho agendado {job_id} não encontrado")
+            return
+        pool = self.pools[job["pool"]]
+        
+        if action in ("stage", "retry"):
+            self._update_job_status(job_id, "pending")
+            self._enqueue(pool, job)
+            return
+        
+        # Containers muito antigos expiram: preparar novamente antes de publicar
+        staged = job.get("staged")
+        if not staged or time.time() - staged.get("staged_at", 0) > self.CONTAINER_MAX_AGE:
+            logger.warning(f"Container do trabalho {job_id} ausente ou expirado, preparando novamente")
+            self._update_job_status(job_id, "pending", staged=None)
+            self._enqueue(pool, job)
+            return
+        
+        # A publicação roda em um worker do pool (que verifica a cota da API antes), nunca
+        # na thread do agendador: uma chamada lenta ou limitada atrasaria as demais ações.
+        # Nos modos external/worker, um processo worker reivindica o trabalho pendente.
+        logger.info(f"Trabalho agendado {job_id} pronto para publicação")
+        self._update_job_status(job_id, "pending")
+        self._enqueue(pool, job)
+    
+    def _process_job(self, pool, job_id):
+        """Processa um único trabalho dentro de um worker do pool"""
+        logger.info(f"Processando trabalho: {job_id} (pool '{pool.name}')")
+        
+        # Obter dados do trabalho
+        job = self.registry.get(job_id)
+        
+        # Sem cota da API: estacionar o trabalho e liberar o worker para os próximos
+        if self._defer_for_quota(job, publish=not job.get("publish_at") or bool(job.get("staged"))):
+            return
+        
+        # Atualizar status (trabalhos reivindicados por um processo worker já estão em processamento)
+        if job["status"] != "processing":
+            self._update_job_status(job_id, "processing")
+        
+        # Posts preparados cujo horário chegou: apenas publicar
+        if job.get("staged"):
+            self._run_job(pool, job, self._publish_staged_job)
+        # Posts agendados são apenas preparados; a publicação ocorre no horário
+        elif job.get("publish_at"):
+            self._run_job(pool, job, self._stage_job)
+        elif pool.name == "image":
+            self._submit_to_pipeline(pool, job)
+        else:
+            self._run_job(pool, job, self._execute_job)
+    
+    def _image_pipeline(self):
+        """Cria (na primeira utilização) o pipeline em etapas de publicação de imagens"""
+        with self.processing_lock:
+            if self.pipeline is None:
+                from src.services.instagram_send import InstagramSend
+                self.pipeline = PublishPipeline(
+                    "ImagePipeline",
+                    InstagramSend.image_pipeline_stages(),
+                    on_error=InstagramSend._cleanup_staged
+                )
+                self.pipeline.start()
+            return self.pipeline
+    
+    def _submit_to_pipeline(self, pool, job):
+        """
+        Envia um post de imagem ao pipeline de publicação. O worker do pool fica
+        livre assim que a primeira etapa aceita o trabalho; a finalização ocorre
+        no callback da última etapa.
+        """
+        from src.services.instagram_send import InstagramSend
+        
+        start_time = time.time()
+        # Uma nova tentativa retoma a partir da etapa que falhou
+        checkpoint = job.get("checkpoint")
+        if checkpoint:
+            ctx = copy.deepcopy(checkpoint)
+            stage = ctx.pop("resume_stage", None)
+        else:
+            stage = None
+            try:
+                ctx = InstagramSend.new_image_context(job["media_paths"][0], job["caption"], job["inputs"])
+            except Exception as e:
+                self._finish_job(pool, job, start_time, None, e)
+                return
+        
+        def on_done(ctx, error):
+            result = ctx["result"] if ctx and error is None else None
+            self._finish_job(pool, job, start_time, result, error, checkpoint=ctx if error is not None else None)
+        
+        self._image_pipeline().submit(ctx, on_done, stage)
+    
+    @staticmethod
+    def _account_id(job):
+        return (job.get("inputs") or {}).get("account_id")
+    
+    def _defer_for_quota(self, job, publish):
+        """
+        Estaciona o trabalho se o governador de rate limit não permitir despachá-lo agora
+        
+        Returns:
+            bool: True se o trabalho foi adiado
+        """
+        wait = rate_governor.acquire(self._account_id(job), publish=publish)
+        if wait <= 0:
+            if publish:
+                with self.processing_lock:
+                    self.publish_tokens.add(job["id"])
+            return False
+        logger.warning(f"Cota da API indisponível, trabalho {job['id']} adiado em {wait:.0f}s")
+        self._park_job(job, wait)
+        return True
+    
+    def _retry_delay(self, job, exc):
+        """
+        Calcula a espera antes de uma nova tentativa após uma falha temporária
+        
+        Returns:
+            float: Segundos até a nova tentativa, ou None se o trabalho deve falhar
+        """
+        if not getattr(exc, "retriable", False):
+            return None
+        attempts = job.get("attempts", 0)
+        if attempts >= self.MAX_RETRIES:
+            logger.warning(f"Trabalho {job['id']} excedeu {self.MAX_RETRIES} novas tentativas")
+            return None
+        delay = getattr(exc, "retry_seconds", None) or min(self.RETRY_BASE_DELAY * 2 ** attempts, self.RETRY_MAX_DELAY)
+        return max(delay, rate_governor.wait_time(self._account_id(job)))
+    
+    def _park_job(self, job, delay, **fields):
+        """
+        Coloca o trabalho em espera até not_before, sem ocupar nenhum worker. O
+        agendador o devolve à fila no horário (no modo worker, o processo que
+        enfileirou agenda ao ver o status "delayed").
+        """
+        job_id = job["id"]
+        not_before = time.time() + delay
+        with self.processing_lock:
+            self.claimed.discard(job_id)
+        self._update_job_status(job_id, "delayed", not_before=not_before, **fields)
+        if self.mode != "worker":
+            self.scheduler.schedule(not_before, job_id, "retry")
+    
+    def _run_job(self, pool, job, runner):
+        """Executa runner(job) tratando status, estatísticas, histórico e limpeza"""
+        start_time = time.time()
+        try:
+            result, exc = runner(job), None
+        except Exception as e:
+            result, exc = None, e
+        self._finish_job(pool, job, start_time, result, exc)
+    
+    def _finish_job(self, pool, job, start_time, result, exc=None, checkpoint=None):
+        """
+        Registra o resultado de um trabalho: status, estatísticas, histórico e limpeza.
+        Falhas temporárias estacionam o trabalho para uma nova tentativa; checkpoint é
+        o contexto do pipeline a partir do qual ela é retomada.
+        """
+        job_id = job["id"]
+        error = None
+        with self.processing_lock:
+            self.claimed.discard(job_id)
+            holds_token = job_id in self.publish_tokens
+            self.publish_tokens.discard(job_id)
+        if holds_token and (exc is not None or not result):
+            # Nada foi publicado: o token volta para a cota de 24h da conta
+            rate_governor.release(self._account_id(job))
+        
+        delay = self._retry_delay(job, exc) if exc is not None else None
+        if delay is not None:
+            logger.warning(f"Falha temporária no trabalho {job_id}: {exc}. Nova tentativa em {delay:.0f}s")
+            self._park_job(job, delay, last_error=str(exc), attempts=job.get("attempts", 0) + 1, checkpoint=checkpoint)
+            return
+        if checkpoint:
+            # Sem nova tentativa: liberar uploads e arquivos do contexto preservado
+            from src.services.instagram_send import InstagramSend
+            InstagramSend._cleanup_staged(checkpoint)
+        
+        try:
+            if exc is not None:
+                raise exc
+                
+            if result and self.registry.get(job_id)["status"] == "staged":
+                # A publicação ocorrerá no horário agendado
+                return
+            elif result:
+                self._update_job_status(job_id, "completed", result=result)
+                logger.info(f"Trabalho completado: {job_id}")
+                
+                with self.processing_lock:
+                    self.stats["completed_jobs"] += 1
+                    pool.stats["completed_jobs"] += 1
+            else:
+                raise Exception("Falha no processamento do conteúdo")
+                
+        except RateLimitExceeded as e:
+            error = str(e)
+            logger.warning(f"Rate limit excedido: {error}")
+            
+            # Marcar como falha de rate limit
+            self._update_job_status(job_id, "rate_limited", error=error)
+            
+            with self.processing_lock:
+                self.stats["rate_limited_posts"] += 1
+                self.stats["failed_jobs"] += 1
+                pool.stats["failed_jobs"] += 1
+                
+        except ContentPolicyViolation as e:
+            error = str(e)
+            logger.warning(f"Violação de política: {error}")
+            self._update_job_status(job_id, "policy_violation", error=error)
+            
+            with self.processing_lock:
+                self.stats["failed_jobs"] += 1
+                pool.stats["failed_jobs"] += 1
                 
-            self.job_history.append(job_copy)
+        except Exception as e:
+            error = str(e)
+            logger.error(f"Erro no processamento: {error}")
+            self._update_job_status(job_id, "failed", error=error)
             
-            # Limpar trabalhos antigos após um período
-            self._cleanup_old_jobs()
+            with self.processing_lock:
+                self.stats["failed_jobs"] += 1
+                pool.stats["failed_jobs"] += 1
+        
+        # Calcular tempo médio de processamento
+        processing_time = time.time() - start_time
+        with self.processing_lock:
+            for stats in (self.stats, pool.stats):
+                if stats["completed_jobs"] > 0 and error is None:
+                    current_avg = stats["avg_processing_time"]
+                    total_processed = stats["completed_jobs"]
+                    new_avg = ((current_avg * (total_processed - 1)) + processing_time) / total_processed
+                    stats["avg_processing_time"] = new_avg
+        
+        # Adicionar ao histórico
+        self._add_to_history(job_id)
+        
+        # Limpar mídia temporária após processamento 
+        for media_path in job["media_paths"]:
+            self._cleanup_media(media_path)
+    
+    def _update_job_status(self, job_id, status, result=None, error=None, **fields):
+        """Atualiza o status de um trabalho (e campos adicionais, se fornecidos)"""
+        changes = dict(fields, status=status, updated_at=time.time())
+        if result is not None:
+            changes["result"] = result
+        if error is not None:
+            changes["error"] = error
+        
+        job = self.registry.update(job_id, **changes)
+        if job is not None:
+            try:
+                self.job_store.save_job(job)
+            except Exception as e:
+                logger.error(f"Erro ao persistir status do trabalho {job_id}: {e}")
+            self._emit_event(job_id, status, job)
+    
+    def _emit_event(self, job_id, status, job):
+        """Publica uma transição para os inscritos"""
+        # No modo external, as transições (inclusive as deste processo) chegam pelo armazenamento
+        if self.mode != "external":
+            self.event_queue.put((job_id, status, dict(job)))
+    
+    def subscribe(self, callback, statuses=None):
+        """
+        Registra um callback para as transições de status dos trabalhos
+        
+        Args:
+            callback: Função chamada como callback(job_id, job_info) a cada transição
+            statuses (iterable): Status de interesse (padrão: todos)
+            
+        Returns:
+            str: Token para cancelar a inscrição com unsubscribe
+        """
+        token = str(uuid.uuid4())
+        with self.processing_lock:
+            self.subscribers[token] = (callback, set(statuses) if statuses else None)
+        return token
+    
+    def unsubscribe(self, token):
+        """Cancela uma inscrição feita com subscribe"""
+        with self.processing_lock:
+            return self.subscribers.pop(token, None) is not None
+    
+    def _dispatch_events(self):
+        """Thread que entrega as transições de status aos inscritos, na ordem em que ocorreram"""
+        while True:
+            event = self.event_queue.get()
+            if event is None:
+                break
+            job_id, status, job = event
+            with self.processing_lock:
+                subscribers = list(self.subscribers.values())
+            for callback, statuses in subscribers:
+                if statuses is not None and status not in statuses:
+                    continue
+                try:
+                    callback(job_id, dict(job))
+                except Exception as e:
+                    logger.error(f"Erro ao notificar transição do trabalho {job_id}: {e}")
+    
+    def _add_to_history(self, job_id):
+        """Adiciona um trabalho ao histórico"""
+        self.registry.add_to_history(job_id)
+        
+        # Limpar trabalhos antigos após um período
+        self._cleanup_old_jobs()
     
     def _cleanup_old_jobs(self):
         """Limpa trabalhos antigos"""
         current_time = time.time()
         MAX_AGE = 24 * 60 * 60  # 24 horas
         
-        jobs_to_remove = []
-        for job_id, job in self.jobs.items():
-            if current_time - job["updated_at"] > MAX_AGE:
-                jobs_to_remove.append(job_id)
+        self.registry.remove_finished_older_than(MAX_AGE)
         
-        for job_id in jobs_to_remove:
-            if job_id in self.jobs:
-                del self.jobs[job_id]
+        # Remover do armazenamento persistente os trabalhos finalizados há muito tempo
+        if current_time - self.last_store_purge > 60 * 60:
+            self.last_store_purge = current_time
+            try:
+                self.job_store.purge_finished(self.STORE_RETENTION)
+            except Exception as e:
+                logger.warning(f"Erro ao limpar armazenamento de trabalhos: {e}")
     
     def _cleanup_media(self, media_path):
         """Limpa arquivos de mídia temporários"""
@@ -309,14 +901,18 @@ class PostQueue:
         Returns:
             dict: Informações do trabalho
         """
-        if job_id in self.jobs:
-            # Retornar cópia para evitar modificações
-            return self.jobs[job_id].copy()
-        
-        # Verificar no histórico
-        for job in self.job_history:
-            if job["id"] == job_id:
-                return job.copy()
+        # Trabalhos ativos e histórico recente (cópia, sem bloquear os workers)
+        job = self.registry.get(job_id)
+        if job is not None:
+            return job
+        
+        # Verificar no armazenamento persistente (leitura não bloqueia as escritas)
+        try:
+            job = self.job_store.get_job(job_id)
+            if job:
+                return job
+        except Exception as e:
+            logger.warning(f"Erro ao consultar trabalho {job_id} no armazenamento: {e}")
                 
         return {"error": "Job não encontrado"}
     
@@ -329,10 +925,27 @@ class PostQueue:
         """
         with self.processing_lock:
             stats = self.stats.copy()
-            stats["queue_size"] = self.job_queue.qsize()
-            stats["active_jobs"] = len(self.jobs)
+            stats["queue_size"] = sum(pool.job_queue.qsize() for pool in self.pools.values())
+            stats["active_jobs"] = len(self.registry)
+            stats["pending_jobs"] = self.registry.count("pending")
+            stats["processing_jobs"] = self.registry.count("processing")
+            stats["delayed_jobs"] = self.registry.count("delayed")
+            stats["scheduled_jobs"] = len(self.scheduler)
+            stats["rate_governor"] = rate_governor.snapshot()
+            stats["admission"] = admission_controller.get_stats()
+            stats["pipeline"] = self.pipeline.get_stats() if self.pipeline else {}
+            stats["pools"] = {}
+            for name, pool in self.pools.items():
+                pool_stats = pool.stats.copy()
+                pool_stats["queue_size"] = pool.job_queue.qsize()
+                pool_stats["accounts"] = pool.job_queue.shard_sizes()
+                stats["pools"][name] = pool_stats
             return stats
     
+    def queue_depth(self):
+        """Trabalhos aguardando execução ou em andamento (pendentes, em processamento ou em espera)"""
+        return sum(self.registry.count(status) for status in ("pending", "processing", "delayed"))
+    
     def get_job_history(self, limit=10):
         """
         Obtém histórico de trabalhos
@@ -344,20 +957,17 @@ class PostQueue:
             list: Histórico de trabalhos
         """
         # Retornar histórico em ordem cronológica inversa
-        return sorted(
-            self.job_history,
-            key=lambda x: x.get("updated_at", 0),
-            reverse=True
-        )[:limit]
+        return self.registry.history(limit)
     
     def clear_queue(self):
-        """Limpa a fila atual de trabalhos"""
-        while not self.job_queue.empty():
-            try:
-                self.job_queue.get(False)
-                self.job_queue.task_done()
-            except Empty:
-                break
+        """Limpa as filas atuais de trabalhos de todos os pools"""
+        for pool in self.pools.values():
+            while not pool.job_queue.empty():
+                try:
+                    pool.job_queue.get(False)
+                    pool.job_queue.task_done()
+                except Empty:
+                    break
         
         logger.info("Fila limpa")
 
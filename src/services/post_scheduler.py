@@ -0,0 +1,120 @@
+import time
+import heapq
+import logging
+import itertools
+import threading
+from threading import Thread
+
+logger = logging.getLogger('PostScheduler')
+
+class PostScheduler:
+    """
+    Agendador de ações da PostQueue ordenado por horário (min-heap).
+
+    Cada trabalho possui no máximo uma ação agendada ("stage" ou "publish").
+    Reagendar um trabalho substitui a ação anterior; entradas obsoletas do heap
+    são descartadas quando chegam ao topo.
+    """
+
+    def __init__(self, handler):
+        """
+        Args:
+            handler: Função chamada como handler(job_id, action) no horário agendado
+        """
+        self.handler = handler
+        self._heap = []
+        self._entries = {}  # job_id -> (run_at, seq, action)
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self.is_running = False
+        self.thread = None
+
+    def start(self):
+        """Inicia o thread do agendador"""
+        with self._condition:
+            if self.is_running:
+                return
+            self.is_running = True
+        self.thread = Thread(target=self._run, name="PostScheduler", daemon=True)
+        self.thread.start()
+        logger.info("Agendador de publicações iniciado")
+
+    def stop(self):
+        """Para o thread do agendador"""
+        with self._condition:
+            self.is_running = False
+            self._condition.notify_all()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=5.0)
+
+    def schedule(self, run_at, job_id, action):
+        """
+        Agenda uma ação para um trabalho
+
+        Args:
+            run_at (float): Timestamp em que a ação deve ser executada
+            job_id (str): ID do trabalho
+            action (str): "stage" ou "publish"
+        """
+        with self._condition:
+            entry = (run_at, next(self._counter), action)
+            self._entries[job_id] = entry
+            heapq.heappush(self._heap, (entry[0], entry[1], job_id, action))
+            self._condition.notify()
+        logger.info(f"Trabalho {job_id} agendado: '{action}' em {run_at - time.time():.0f}s")
+
+    def cancel(self, job_id):
+        """Cancela a ação agendada de um trabalho"""
+        with self._condition:
+            return self._entries.pop(job_id, None) is not None
+
+    def pending(self):
+        """Retorna as ações agendadas, da mais próxima à mais distante"""
+        with self._condition:
+            return sorted(
+                ({"job_id": job_id, "run_at": entry[0], "action": entry[2]}
+                 for job_id, entry in self._entries.items()),
+                key=lambda item: item["run_at"]
+            )
+
+    def __len__(self):
+        with self._condition:
+            return len(self._entries)
+
+    def _pop_due(self):
+        """Aguarda e remove a próxima ação vencida (ou None ao encerrar)"""
+        with self._condition:
+            while self.is_running:
+                # Descartar entradas canceladas ou substituídas
+                while self._heap:
+                    run_at, seq, job_id, action = self._heap[0]
+                    entry = self._entries.get(job_id)
+                    if entry and entry[1] == seq:
+                        break
+                    heapq.heappop(self._heap)
+
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+
+                wait_time = self._heap[0][0] - time.time()
+                if wait_time > 0:
+                    self._condition.wait(timeout=wait_time)
+                    continue
+
+                _, _, job_id, action = heapq.heappop(self._heap)
+                del self._entries[job_id]
+                return job_id, action
+        return None
+
+    def _run(self):
+        """Thread do agendador: executa as ações no horário agendado"""
+        while self.is_running:
+            due = self._pop_due()
+            if due is None:
+                break
+            job_id, action = due
+            try:
+                self.handler(job_id, action)
+            except Exception as e:
+                logger.exception(f"Erro ao executar ação '{action}' do trabalho {job_id}: {e}")
@@ -0,0 +1,169 @@
+import os
+import time
+import logging
+import threading
+from queue import Queue, Empty
+from threading import Thread
+
+logger = logging.getLogger('PublishPipeline')
+
+class PipelineStage:
+    """Uma etapa do pipeline: fila limitada e workers próprios"""
+
+    def __init__(self, name, func, workers=1, capacity=10):
+        """
+        Args:
+            name (str): Nome da etapa
+            func: Função chamada como func(ctx); retorna o contexto para a próxima etapa ou None em caso de falha
+            workers (int): Número de threads da etapa
+            capacity (int): Tamanho máximo da fila de entrada da etapa
+        """
+        self.name = name
+        self.func = func
+        self.workers = int(workers)
+        self.queue = Queue(maxsize=capacity)
+        self.threads = []
+        self.stats = {
+            "workers": self.workers,
+            "active_workers": 0,
+            "processed": 0,
+            "failed": 0,
+            "avg_processing_time": 0
+        }
+
+class PublishPipeline:
+    """
+    Pipeline de publicação em etapas.
+
+    Cada etapa tem sua própria fila limitada e seu próprio conjunto de workers,
+    então etapas de CPU (filtros, bordas) e de rede (uploads, legenda, polling
+    do container) de trabalhos diferentes rodam em paralelo. Uma fila cheia
+    bloqueia a etapa anterior, limitando o trabalho em andamento.
+    """
+
+    def __init__(self, name, stages, capacity=None, on_error=None):
+        """
+        Args:
+            name (str): Nome do pipeline (usado nos threads e logs)
+            stages (list): Lista de (nome, função, workers) na ordem de execução
+            capacity (int): Tamanho das filas entre etapas (padrão: PUBLISH_PIPELINE_QUEUE_SIZE ou 10)
+            on_error: Função chamada como on_error(ctx) quando um trabalho falha em definitivo, para liberar recursos
+        """
+        capacity = capacity or int(os.getenv("PUBLISH_PIPELINE_QUEUE_SIZE", 10))
+        self.name = name
+        self.on_error = on_error
+        self.stages = []
+        for stage_name, func, workers in stages:
+            workers = os.getenv(f"PUBLISH_PIPELINE_{stage_name.upper()}_WORKERS", workers)
+            self.stages.append(PipelineStage(stage_name, func, workers, capacity))
+        self.is_running = False
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Inicia os workers de todas as etapas"""
+        with self.lock:
+            if self.is_running:
+                return
+            self.is_running = True
+            for index, stage in enumerate(self.stages):
+                for i in range(stage.workers):
+                    thread = Thread(
+                        target=self._run_stage,
+                        args=(index,),
+                        name=f"{self.name}-{stage.name}-{i}",
+                        daemon=True
+                    )
+                    thread.start()
+                    stage.threads.append(thread)
+        logger.info(f"Pipeline '{self.name}' iniciado: {' → '.join(stage.name for stage in self.stages)}")
+
+    def stop(self):
+        """Para os workers de todas as etapas"""
+        self.is_running = False
+        for stage in self.stages:
+            for thread in stage.threads:
+                if thread.is_alive():
+                    thread.join(timeout=5.0)
+            stage.threads = []
+
+    def submit(self, ctx, on_done, stage=None):
+        """
+        Envia um trabalho para a primeira etapa (bloqueia se a fila estiver cheia)
+
+        Args:
+            ctx (dict): Contexto do trabalho, repassado entre as etapas
+            on_done: Função chamada como on_done(ctx, error) ao final. Em caso de falha
+                ctx é None, exceto em falhas temporárias (error.retriable): o contexto é
+                preservado, com a etapa que falhou em ctx["resume_stage"]
+            stage (str): Etapa em que o trabalho (re)começa (padrão: a primeira)
+        """
+        index = 0
+        if stage is not None:
+            index = [s.name for s in self.stages].index(stage)
+        self.stages[index].queue.put((ctx, on_done))
+
+    def _run_stage(self, index):
+        """Worker de uma etapa: executa a função e repassa o contexto à próxima etapa"""
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+
+        while self.is_running:
+            try:
+                ctx, on_done = stage.queue.get(timeout=1.0)
+            except Empty:
+                continue
+
+            with self.lock:
+                stage.stats["active_workers"] += 1
+            start_time = time.time()
+            error = None
+            try:
+                result = stage.func(ctx)
+            except Exception as e:
+                logger.error(f"Erro na etapa '{stage.name}': {e}")
+                result, error = None, e
+
+            with self.lock:
+                stage.stats["active_workers"] -= 1
+                if result is None:
+                    stage.stats["failed"] += 1
+                else:
+                    stage.stats["processed"] += 1
+                    processed = stage.stats["processed"]
+                    elapsed = time.time() - start_time
+                    stage.stats["avg_processing_time"] += (elapsed - stage.stats["avg_processing_time"]) / processed
+
+            try:
+                if result is None:
+                    self._fail(stage, ctx, on_done, error)
+                elif next_stage is not None:
+                    next_stage.queue.put((result, on_done))
+                else:
+                    on_done(result, None)
+            except Exception as e:
+                logger.error(f"Erro ao finalizar etapa '{stage.name}': {e}")
+            finally:
+                stage.queue.task_done()
+
+    def _fail(self, stage, ctx, on_done, error):
+        if getattr(error, "retriable", False):
+            # O trabalho será retomado a partir desta etapa: manter uploads e container
+            ctx["resume_stage"] = stage.name
+            on_done(ctx, error)
+            return
+        if self.on_error:
+            try:
+                self.on_error(ctx)
+            except Exception as e:
+                logger.warning(f"Erro ao liberar recursos do trabalho: {e}")
+        on_done(None, error)
+
+    def get_stats(self):
+        """Estatísticas por etapa"""
+        with self.lock:
+            stats = {}
+            for stage in self.stages:
+                stage_stats = stage.stats.copy()
+                stage_stats["queue_size"] = stage.queue.qsize()
+                stats[stage.name] = stage_stats
+            return stats
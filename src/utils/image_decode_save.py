@@ -7,6 +7,20 @@ class ImageDecodeSaver:
 
     @staticmethod
     def process(base64_str, directory='temp'):
+        """
+        Decodifica a imagem em base64 e a salva no diretório especificado.
+        
+        Retorna o caminho completo do arquivo salvo.
+        """
+        return ImageDecodeSaver.save(ImageDecodeSaver.decode(base64_str), directory)
+
+    @staticmethod
+    def decode(base64_str):
+        """Decodifica a imagem em base64 e retorna os bytes"""
+        return base64.b64decode(base64_str)
+
+    @staticmethod
+    def save(image_data, directory='temp'):
         
         timestamp_ms = int(time.time() * 1000)
         timestamp_str_ms = str(timestamp_ms)
@@ -25,12 +39,8 @@ class ImageDecodeSaver:
         # Cria o caminho completo da imagem
         filepath = os.path.join(Paths.ROOT_DIR, directory, file_name)
         
-        # Decodifica e salva a imagem
-        image_data = base64.b64decode(base64_str)
+        # Salva a imagem
         with open(filepath, 'wb') as f:
             f.write(image_data)
 
         return filepath
-
-
-
@@ -21,14 +21,43 @@ class VideoDecodeSaver:
         Returns:
             str: Caminho do arquivo salvo
         """
+        return VideoDecodeSaver.save(VideoDecodeSaver.decode(video_base64))
+    
+    @staticmethod
+    def decode(video_base64):
+        """
+        Decodifica um vídeo em formato base64
+        
+        Args:
+            video_base64 (str): String base64 do vídeo
+            
+        Returns:
+            bytes: Conteúdo do vídeo
+        """
         try:
             # Remover cabeçalho do base64 se existir
             if "base64," in video_base64:
                 video_base64 = video_base64.split("base64,")[1]
             
             # Decodificar base64
-            video_data = base64.b64decode(video_base64)
+            return base64.b64decode(video_base64)
+            
+        except Exception as e:
+            logging.error(f"Erro ao processar vídeo base64: {str(e)}")
+            raise Exception(f"Falha ao processar vídeo: {str(e)}")
+    
+    @staticmethod
+    def save(video_data):
+        """
+        Salva o conteúdo de um vídeo como um arquivo MP4
+        
+        Args:
+            video_data (bytes): Conteúdo do vídeo
             
+        Returns:
+            str: Caminho do arquivo salvo
+        """
+        try:
             # Criar diretório de vídeos temporários se não existir
             temp_dir = os.path.join(Paths.ROOT_DIR, "temp_videos")
             os.makedirs(temp_dir, exist_ok=True)
@@ -0,0 +1,64 @@
+"""
+Processo worker da fila de publicação.
+
+Executa os trabalhos gravados no armazenamento compartilhado (SQLite) por um
+processo que roda a fila no modo "external" (ex.: app.py com
+POST_QUEUE_MODE=external). Vários processos podem ser iniciados para usar
+todos os núcleos; cada trabalho é reivindicado por um único processo.
+
+Uso:
+    python -m src.worker
+    python -m src.worker --pools image,carousel --image-workers 4
+"""
+import os
+import time
+import signal
+import logging
+import argparse
+
+logger = logging.getLogger('PostWorker')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Processo worker da fila de publicação do Instagram")
+    parser.add_argument('--pools', help='Pools atendidos, separados por vírgula (padrão: image,reel,carousel)')
+    parser.add_argument('--image-workers', type=int, help='Threads do pool de imagens')
+    parser.add_argument('--reel-workers', type=int, help='Threads do pool de reels')
+    parser.add_argument('--carousel-workers', type=int, help='Threads do pool de carrosséis')
+    parser.add_argument('--db', help='Caminho do banco compartilhado (padrão: POST_QUEUE_DB)')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    # A configuração precisa estar no ambiente antes de importar a fila: a
+    # instância global post_queue é criada na importação e passa a ser este worker
+    os.environ["POST_QUEUE_MODE"] = "worker"
+    if args.pools:
+        os.environ["POST_QUEUE_WORKER_POOLS"] = args.pools
+    if args.db:
+        os.environ["POST_QUEUE_DB"] = args.db
+    for pool in ("image", "reel", "carousel"):
+        workers = getattr(args, f"{pool}_workers")
+        if workers:
+            os.environ[f"POST_QUEUE_{pool.upper()}_WORKERS"] = str(workers)
+
+    from src.services.post_queue import post_queue
+
+    stop_requested = []
+
+    def request_stop(signum, frame):
+        logger.info(f"Sinal {signum} recebido, encerrando worker...")
+        stop_requested.append(signum)
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    logger.info(f"Worker {post_queue.worker_id} atendendo: {', '.join(pool.name for pool in post_queue._served_pools())}")
+    while not stop_requested:
+        time.sleep(1)
+
+    # Trabalhos interrompidos voltam à fila quando a posse expira
+    post_queue.stop_worker()
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,7 @@ from src.instagram.image_validator import InstagramImageValidator
 from src.utils.paths import Paths
 from src.instagram.filter import FilterImage
 from datetime import datetime
+from collections import deque
 
 st.set_page_config(page_title="Instagram Agent", layout="wide")
 st.title('Instagram Agent 📷')
@@ -337,9 +338,37 @@ with tab3:
             else:
                 st.info('Por favor, selecione pelo menos 2 imagens (máximo 10) para criar um carrossel')
 
+@st.cache_resource
+def job_event_feed():
+    """Inscreve-se uma única vez nas transições da fila e guarda as mais recentes"""
+    events = deque(maxlen=50)
+    
+    def on_event(job_id, job_info):
+        events.appendleft({
+            "job_id": job_id,
+            "status": job_info.get("status"),
+            "content_type": job_info.get("content_type"),
+            "at": datetime.fromtimestamp(job_info.get("updated_at", time.time())).strftime("%H:%M:%S"),
+            "error": job_info.get("error")
+        })
+    
+    InstagramSend.subscribe_job_events(on_event)
+    return events
+
 with tab4:
     st.header('Status da Fila')
     
+    # Transições recebidas da fila (sem consultas periódicas)
+    recent_events = list(job_event_feed())
+    with st.expander(f"Eventos recentes ({len(recent_events)})"):
+        if not recent_events:
+            st.info("Nenhuma transição de status recebida ainda.")
+        for event in recent_events:
+            line = f"`{event['at']}` **{event['status']}** - {event['content_type']} - {event['job_id']}"
+            if event["error"]:
+                line += f" ({event['error']})"
+            st.write(line)
+    
     # Adiciona filtros de data
     col_date, col_refresh = st.columns([3, 1])
     with col_date:
@@ -414,7 +443,8 @@ with tab5:
         if st.button("Verificar Status da API"):
             try:
                 from src.instagram.instagram_carousel_service import InstagramCarouselService
-                service = InstagramCarouselService()
+                from src.instagram.service_registry import service_registry
+                service = service_registry.get(InstagramCarouselService)
                 usage_info = service.get_app_usage_info()
                 
                 if usage_info and 'app_usage' in usage_info:
@@ -429,7 +459,8 @@ with tab5:
         if st.button("Verificar Token"):
             try:
                 from src.instagram.instagram_carousel_service import InstagramCarouselService
-                service = InstagramCarouselService()
+                from src.instagram.service_registry import service_registry
+                service = service_registry.get(InstagramCarouselService)
                 is_valid, missing_permissions = service.check_token_permissions()
                 
                 if is_valid:
@@ -0,0 +1,424 @@
+import os
+import sys
+import json
+import time
+import types
+import asyncio
+import tempfile
+from io import BytesIO
+from urllib.parse import urlencode, urlparse, parse_qs
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.instagram.base_instagram_service import (
+    BaseInstagramService, AuthenticationError, PermissionError, RateLimitError,
+    TemporaryServerError, InstagramAPIError, graph_api_error
+)
+from src.instagram.instagram_carousel_service import InstagramCarouselService
+from src.instagram.describe_image_tool import ImageDescriber
+import src.instagram.describe_image_tool as describe_image_tool
+from src.instagram.async_instagram_service import AsyncInstagramService
+from src.instagram.container_poller import ContainerPoller
+from src.instagram.processing_times import ProcessingTimeModel
+import src.instagram.container_poller as container_poller_module
+import src.instagram.base_instagram_service as base_service_module
+from src.instagram.rate_governor import rate_governor
+from src.instagram.media_host import LocalMediaHost
+from src.instagram.service_registry import token_cache, service_registry, token_hash
+
+
+class FakeStatusService:
+    """Serviço com as credenciais de uma conta; responde às consultas de status sem acessar a API"""
+
+    def __init__(self, ig_user_id, responses):
+        self.ig_user_id = ig_user_id
+        self.access_token = f"token-{ig_user_id}"
+        self.responses = responses  # container_id -> dados do status, ou exceção a lançar
+        self.requests = []
+
+    def _make_request(self, method, endpoint, params=None, data=None, headers=None, retry_attempt=0):
+        ids = params['ids'].split(',') if params.get('ids') else [endpoint]
+        self.requests.append(ids)
+        for container_id in ids:
+            if isinstance(self.responses.get(container_id), Exception):
+                raise self.responses[container_id]
+        if not params.get('ids'):
+            return self.responses[endpoint]
+        return {container_id: self.responses[container_id] for container_id in ids}
+
+
+def test_container_poller_resolves_unexpected_errors_and_deadlines():
+    poller = ContainerPoller()
+    failing = FakeStatusService("conta-a", {"c1": TemporaryServerError("500 Internal Server Error")})
+    healthy = FakeStatusService("conta-b", {"c2": {"status_code": "FINISHED"}})
+
+    # Uma conta com erro temporário não derruba a verificação das outras contas da rodada
+    failed = poller.watch(failing, "c1", delay=0.05, deadline=1)
+    finished = poller.watch(healthy, "c2", delay=0.05, deadline=1)
+    try:
+        failed.result(timeout=3)
+        assert False, "O erro da consulta deveria chegar a quem espera o container"
+    except TemporaryServerError as e:
+        # Erro retentável: a fila reagenda o trabalho
+        assert e.retriable
+    assert finished.result(timeout=3) == {"status_code": "FINISHED"}
+
+    # Uma entrada que perdeu a verificação agendada termina com TIMEOUT no prazo
+    stuck = poller.watch(healthy, "c3", delay=60, deadline=0.5)
+    with poller._cond:
+        poller._entries["c3"]["next_check"] = float("inf")
+        poller._cond.notify()
+    assert stuck.result(timeout=3) == {"status_code": "TIMEOUT"}
+
+    # wait() nunca bloqueia além do prazo, mesmo que o poller não responda
+    silent = ContainerPoller()
+    silent.RESULT_GRACE = 0.2
+    silent._ensure_thread = lambda: None
+    started = time.time()
+    assert silent.wait(healthy, "c4", delay=60, deadline=0.3) == {"status_code": "TIMEOUT"}
+    assert time.time() - started < 2
+    assert not silent.get_stats()["watching"] and not poller.get_stats()["watching"]
+
+
+def test_container_poller_schedules_from_learned_times_within_deadline():
+    model = ProcessingTimeModel(os.path.join(tempfile.mkdtemp(), "processing_times.json"))
+    for seconds in range(20, 30):
+        model.record("IMAGE", None, seconds)
+    original = container_poller_module.processing_times
+    container_poller_module.processing_times = model
+    try:
+        poller = ContainerPoller()
+        poller._ensure_thread = lambda: None
+        service = FakeStatusService("conta-c", {})
+        started = time.time()
+
+        # Primeira verificação no p50 aprendido, não no delay fixo
+        poller.watch(service, "c1", delay=5, media_type="IMAGE")
+        entry = poller._entries["c1"]
+        assert 24 <= entry["next_check"] - started <= 26
+        assert abs(entry["deadline"] - started - ContainerPoller.DEADLINES["IMAGE"]) < 1
+
+        # Nenhuma verificação passa do prazo: a última acontece nele
+        poller.watch(service, "c2", delay=5, media_type="IMAGE", deadline=10)
+        entry = poller._entries["c2"]
+        assert entry["next_check"] == entry["deadline"] and 9 <= entry["deadline"] - started <= 11
+        entry["checks"] = 1
+        entry["deadline"] = time.time() - 1
+        poller._reschedule(entry)
+        assert entry["future"].result(timeout=1) == {"status_code": "TIMEOUT"}
+    finally:
+        container_poller_module.processing_times = original
+
+
+def test_graph_api_error_retries_only_rate_limit_403s():
+    # 403 de permissão ou de token falha na hora, sem novas tentativas
+    error = graph_api_error({"code": 10, "message": "Permissão negada"}, 403, "acct-403")
+    assert isinstance(error, PermissionError) and not getattr(error, "retriable", False)
+    error = graph_api_error({"code": 190, "message": "Token inválido"}, 403, "acct-403")
+    assert isinstance(error, AuthenticationError)
+
+    # 403 de rate limit é retentável e bloqueia a conta no governador
+    error = graph_api_error({"code": 32, "message": "Limite de chamadas"}, 403, "acct-403")
+    assert isinstance(error, RateLimitError) and error.retriable and error.retry_seconds > 0
+    assert rate_governor.blocked_time("acct-403") > 0
+    assert isinstance(graph_api_error({"code": 2, "message": "Erro temporário"}, 500), TemporaryServerError)
+
+
+class FakeAsyncResponse:
+    def __init__(self, session, status, body):
+        self.session = session
+        self.status = status
+        self.body = body
+        self.headers = {}
+
+    async def __aenter__(self):
+        self.session.in_flight += 1
+        self.session.max_in_flight = max(self.session.max_in_flight, self.session.in_flight)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.session.in_flight -= 1
+
+    async def text(self):
+        await asyncio.sleep(0.05)
+        return json.dumps(self.body)
+
+
+class FakeAsyncSession:
+    """Substitui a aiohttp.ClientSession: responde conforme o endpoint, sem rede"""
+
+    def __init__(self, responses):
+        self.responses = responses  # endpoint -> (status HTTP, corpo)
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def request(self, method, url, params=None, data=None):
+        return FakeAsyncResponse(self, *self.responses[url.rsplit("/", 1)[-1]])
+
+
+def test_async_client_bounds_concurrency_and_maps_errors():
+    session = FakeAsyncSession({
+        **{f"c{index}": (200, {"status_code": "FINISHED"}) for index in range(5)},
+        "negado": (403, {"error": {"code": 10, "message": "Permissão negada"}}),
+        "limite": (403, {"error": {"code": 613, "message": "Limite de chamadas"}})
+    })
+    client = AsyncInstagramService("token", "acct-async", max_concurrency=2, session=session)
+
+    async def scenario():
+        statuses = await asyncio.gather(*[client.check_container_status(f"c{index}") for index in range(5)])
+        assert statuses == ["FINISHED"] * 5
+        # O semáforo limita as requisições simultâneas
+        assert session.max_in_flight == 2
+
+        for endpoint, expected in (("negado", PermissionError), ("limite", RateLimitError)):
+            try:
+                await client._make_request("GET", endpoint)
+                assert False, f"{endpoint} deveria lançar {expected.__name__}"
+            except expected:
+                pass
+        # A conta fica bloqueada: nenhuma requisição sai até o fim do bloqueio
+        try:
+            await client._make_request("GET", "c0")
+            assert False, "conta bloqueada não deveria enviar requisições"
+        except RateLimitError as e:
+            assert e.retry_seconds > 0
+
+    asyncio.run(scenario())
+
+
+def _batch_item(code, body):
+    """Resposta de uma chamada dentro de um batch da Graph API"""
+    return {"code": code, "headers": [], "body": body if isinstance(body, str) else json.dumps(body)}
+
+
+def _carousel_service(batch_responses):
+    """Serviço de carrossel sem validação de token; _make_request responde aos batches enfileirados"""
+    service = InstagramCarouselService.__new__(InstagramCarouselService)
+    BaseInstagramService.__init__(service, "token", "acct-batch")
+    service.token_expires_at = None
+    service.requests = []
+
+    def make_request(method, endpoint, params=None, data=None, headers=None, retry_attempt=0):
+        service.requests.append((method, endpoint, data))
+        if "batch" in (data or {}):
+            return batch_responses.pop(0)
+        return {"id": "carousel-1"}
+    service._make_request = make_request
+    service._validate_media = lambda media_url: True
+    return service
+
+
+class FakeResponse:
+    """Resposta do requests com o mínimo usado por _make_request"""
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.headers = {}
+        self.content = json.dumps(body).encode()
+        self.request = types.SimpleNamespace(body=None)
+        self._body = body
+
+    def json(self):
+        return self._body
+
+    def raise_for_status(self):
+        pass
+
+
+class RevokedTokenService(BaseInstagramService):
+    """Serviço cujas requisições recebem as respostas enfileiradas em responses"""
+    responses = []
+
+    def __init__(self, access_token, ig_user_id):
+        super().__init__(access_token, ig_user_id)
+        self.session = types.SimpleNamespace(request=lambda *args, **kwargs: self.responses.pop(0))
+
+
+def test_authentication_error_drops_cached_token_and_shared_services():
+    RevokedTokenService.responses = [
+        FakeResponse(200, {"data": {"is_valid": True, "expires_at": 0}}),
+        FakeResponse(400, {"error": {"code": 190, "message": "Token revogado"}})
+    ]
+    service = service_registry.get(RevokedTokenService, "token-revogado", "acct-auth")
+    assert token_cache.introspect(service)["data"]["is_valid"]
+    assert service_registry.get(RevokedTokenService, "token-revogado", "acct-auth") is service
+
+    try:
+        service._make_request("GET", "acct-auth/media")
+        assert False, "token revogado deveria falhar"
+    except AuthenticationError:
+        pass
+    # O próximo uso do token consulta a API de novo e recebe uma nova instância
+    assert token_hash("token-revogado") not in token_cache.get_stats()["tokens"]
+    assert service_registry.get(RevokedTokenService, "token-revogado", "acct-auth") is not service
+
+
+def test_requests_are_paced_under_the_host_of_the_service_base_url():
+    paced = []
+    original = base_service_module.request_pacer
+    base_service_module.request_pacer = types.SimpleNamespace(acquire=lambda host, account: paced.append(host) or 0)
+    try:
+        # Serviço apontado para o simulador depois de a classe ter sido definida
+        RevokedTokenService.responses = [FakeResponse(200, {"id": "1"})]
+        service = RevokedTokenService("token-simulador", "acct-sim")
+        service.base_url = "http://127.0.0.1:8765/v22.0"
+        assert service._make_request("GET", "acct-sim") == {"id": "1"}
+    finally:
+        base_service_module.request_pacer = original
+    assert paced == ["127.0.0.1:8765"]
+
+    class SimulatedAsyncService(AsyncInstagramService):
+        base_url = "http://localhost:9000/v22.0"
+    assert SimulatedAsyncService("token-simulador", "acct-sim").host == "localhost:9000"
+
+
+def test_batch_request_maps_each_call_in_order():
+    service = _carousel_service([
+        [_batch_item(200, {"id": "child-1"}), _batch_item(400, {"error": {"code": 100, "message": "Imagem inválida"}})],
+        [None, _batch_item(500, "<html>erro</html>")],
+        [_batch_item(200, {"id": "child-5"})]
+    ])
+    service.BATCH_LIMIT = 2
+    calls = [{"method": "POST", "relative_url": "acct-batch/media", "params": {"image_url": f"https://img/{index}.jpg"}}
+             for index in range(4)]
+    calls.append({"method": "GET", "relative_url": "child-1", "params": {"fields": "status_code"}})
+    results = service._make_batch_request(calls)
+
+    # Uma requisição por BATCH_LIMIT chamadas, com os parâmetros no corpo (POST) ou na URL (GET)
+    batches = [json.loads(data["batch"]) for _, _, data in service.requests]
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert batches[0][0]["body"] == "image_url=https%3A%2F%2Fimg%2F0.jpg"
+    assert batches[2][0] == {"method": "GET", "relative_url": "child-1?fields=status_code"}
+
+    # Cada chamada tem seu próprio resultado: falhas não derrubam as demais
+    assert results[0] == {"id": "child-1"} and results[4] == {"id": "child-5"}
+    assert type(results[1]) is InstagramAPIError and results[1].error_code == 100
+    assert isinstance(results[2], TemporaryServerError)  # Chamada que não terminou a tempo (null)
+    assert type(results[3]) is InstagramAPIError  # Corpo que não é JSON
+
+
+def test_carousel_children_come_from_one_batch_and_retriable_errors_propagate():
+    urls = [f"https://img/{index}.jpg" for index in range(3)]
+    service = _carousel_service([[
+        _batch_item(200, {"id": "child-1"}),
+        _batch_item(400, {"error": {"code": 100, "message": "Imagem inválida"}}),
+        _batch_item(200, {"id": "child-3"})
+    ]])
+    children = service._create_child_containers(urls)
+    assert [child["container_id"] for child in children] == ["child-1", None, "child-3"]
+    assert isinstance(children[1]["error"], InstagramAPIError)
+
+    # Um filho inválido é descartado e o carrossel é criado com os demais
+    service = _carousel_service([[
+        _batch_item(200, {"id": "child-1"}),
+        _batch_item(400, {"error": {"code": 100, "message": "Imagem inválida"}}),
+        _batch_item(200, {"id": "child-3"})
+    ]])
+    assert service.create_carousel_container(urls, "legenda") == "carousel-1"
+    assert len(service.requests) == 2 and service.requests[1][2]["children"] == "child-1,child-3"
+
+    # Rate limit em um filho: o carrossel inteiro volta para a fila, sem criar o container
+    service = _carousel_service([[
+        _batch_item(200, {"id": "child-1"}),
+        _batch_item(403, {"error": {"code": 32, "message": "Limite de chamadas"}}),
+        _batch_item(200, {"id": "child-3"})
+    ]])
+    try:
+        service.create_carousel_container(urls, "legenda")
+        assert False, "o rate limit de um filho deveria chegar à fila"
+    except RateLimitError as e:
+        assert e.retriable
+    assert len(service.requests) == 1
+
+
+def test_carousel_children_keep_the_query_of_signed_media_urls():
+    path = os.path.join(tempfile.mkdtemp(), "foto 1.jpg")
+    with open(path, "wb") as f:
+        f.write(b"\xff\xd8\xff\xe0")
+    host = LocalMediaHost(base_url="https://midia.exemplo", secret="segredo", ttl=60,
+                          db_path=os.path.join(tempfile.mkdtemp(), "media.db"), serve=False)
+    url = host.publish(path)["url"]
+
+    def fetched_by_instagram(form_body):
+        # O que o Instagram recebe depois de decodificar o formulário, e o que o host responde
+        image_url = urlparse(parse_qs(form_body)["image_url"][0])
+        query = parse_qs(image_url.query)
+        media_id = host.PATH_PATTERN.match(image_url.path).group(1)
+        return host.lookup(media_id, query.get("expires", [None])[0], query.get("signature", [None])[0])
+
+    # Batch: o corpo de cada chamada é codificado uma única vez
+    service = _carousel_service([[_batch_item(200, {"id": "child-1"})]])
+    assert service._create_child_containers([url])[0]["container_id"] == "child-1"
+    body = json.loads(service.requests[0][2]["batch"])[0]["body"]
+    assert fetched_by_instagram(body) == (os.path.abspath(path), None)
+
+    # Chamada individual: data= é codificado pelo requests
+    service = _carousel_service([])
+    assert service._create_child_container(url) == "carousel-1"
+    assert service.requests[0][2]["image_url"] == url
+    assert fetched_by_instagram(urlencode(service.requests[0][2])) == (os.path.abspath(path), None)
+
+
+PNG_HEADER = b"\x89PNG\r\n\x1a\n" + b"\x00" * 16
+JPEG_HEADER = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00" + b"\x00" * 16
+
+
+class FakeImageResponse:
+    def __init__(self, content, content_type):
+        self.content = content
+        self.headers = {"Content-Type": content_type}
+
+    def raise_for_status(self):
+        pass
+
+
+def test_image_describer_reads_paths_bytes_files_and_urls():
+    # Arquivo local: lido do disco, tipo pela extensão
+    path = os.path.join(tempfile.mkdtemp(), "foto.png")
+    with open(path, "wb") as f:
+        f.write(PNG_HEADER)
+    assert ImageDescriber._read_image(path) == (PNG_HEADER, "image/png")
+
+    # Bytes e objetos com read(): tipo identificado depois, pela assinatura
+    assert ImageDescriber._read_image(JPEG_HEADER) == (JPEG_HEADER, None)
+    assert ImageDescriber._read_image(bytearray(PNG_HEADER)) == (PNG_HEADER, None)
+    assert ImageDescriber._read_image(BytesIO(JPEG_HEADER)) == (JPEG_HEADER, None)
+    assert ImageDescriber._sniff_mime_type(PNG_HEADER) == "image/png"
+    assert ImageDescriber._sniff_mime_type(JPEG_HEADER) == "image/jpeg"
+    assert ImageDescriber._sniff_mime_type(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "image/webp"
+
+    # URL: baixada pela sessão compartilhada; Content-Type que não é de imagem é ignorado
+    fetched = []
+    responses = {"https://img/a.jpg": FakeImageResponse(JPEG_HEADER, "image/jpeg; charset=binary"),
+                 "https://img/b": FakeImageResponse(PNG_HEADER, "application/octet-stream")}
+
+    def get(url, headers=None, timeout=None):
+        fetched.append(url)
+        return responses[url]
+    original = describe_image_tool.http_pool
+    describe_image_tool.http_pool = types.SimpleNamespace(session=types.SimpleNamespace(get=get))
+    try:
+        assert ImageDescriber._read_image("https://img/a.jpg") == (JPEG_HEADER, "image/jpeg")
+        assert ImageDescriber._read_image("https://img/b") == (PNG_HEADER, None)
+    finally:
+        describe_image_tool.http_pool = original
+    assert fetched == ["https://img/a.jpg", "https://img/b"]
+
+    try:
+        ImageDescriber._read_image(42)
+        assert False, "tipo não suportado deveria falhar"
+    except TypeError:
+        pass
+
+
+if __name__ == "__main__":
+    test_container_poller_resolves_unexpected_errors_and_deadlines()
+    test_container_poller_schedules_from_learned_times_within_deadline()
+    test_graph_api_error_retries_only_rate_limit_403s()
+    test_async_client_bounds_concurrency_and_maps_errors()
+    test_authentication_error_drops_cached_token_and_shared_services()
+    test_requests_are_paced_under_the_host_of_the_service_base_url()
+    test_batch_request_maps_each_call_in_order()
+    test_carousel_children_come_from_one_batch_and_retriable_errors_propagate()
+    test_carousel_children_keep_the_query_of_signed_media_urls()
+    test_image_describer_reads_paths_bytes_files_and_urls()
+    print("OK")
@@ -0,0 +1,1032 @@
+import os
+import sys
+import time
+import types
+import tempfile
+import threading
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services.post_queue import PostQueue
+from src.services.job_store import JobStore
+from src.services.job_registry import JobRegistry
+from src.services.publish_pipeline import PublishPipeline
+from src.services.post_notification import PostCompletionNotifier
+from src.services.job_dedup import JobDeduplicator
+from src.services.admission import AdmissionController, AdmissionRejected
+from src.services.fair_queue import FairQueue
+from src.instagram.rate_governor import RateGovernor, rate_governor
+from src.instagram.graph_simulator import GraphSimulator
+from src.instagram.instrumentation import Instrumentation, redact
+from src.instagram.state_store import StateStore
+from src.instagram.pending_publisher import PendingPublisher
+from src.instagram.accounts import AccountDirectory
+from src.instagram.media_host import LocalMediaHost
+from src.instagram.processing_times import ProcessingTimeModel
+from src.instagram.request_pacer import RequestPacer
+from src.instagram.service_registry import TokenCache, ServiceRegistry
+import src.instagram.service_registry as service_registry_module
+
+
+class TransientError(Exception):
+    """Falha temporária, como RateLimitError da API"""
+    retriable = True
+
+    def __init__(self, message, retry_seconds=None):
+        self.retry_seconds = retry_seconds
+        super().__init__(message)
+
+
+class FakeInstagramSend:
+    """Substitui o InstagramSend real para que os testes não acessem a API"""
+    delay = 0.0
+    calls = []
+    prepared = 0
+    failures = 0  # Número de publicações que falham temporariamente antes de funcionar
+    lock = threading.Lock()
+
+    @classmethod
+    def _publish(cls, kind, media):
+        with cls.lock:
+            cls.calls.append((kind, media))
+        time.sleep(cls.delay)
+        return {"id": f"{kind}-post", "permalink": f"https://instagram.com/p/{kind}"}
+
+    @classmethod
+    def send_instagram(cls, image_path, caption, inputs=None):
+        return cls._publish("image", image_path)
+
+    @classmethod
+    def send_reels(cls, video_path, caption, inputs=None):
+        return cls._publish("reel", video_path)
+
+    @classmethod
+    def send_carousel(cls, media_paths, caption, inputs=None):
+        return cls._publish("carousel", media_paths)
+
+    @classmethod
+    def new_image_context(cls, image_path, caption, inputs=None):
+        return {"image_path": image_path, "result": None}
+
+    @classmethod
+    def image_pipeline_stages(cls):
+        def prepare(ctx):
+            with cls.lock:
+                cls.prepared += 1
+            return ctx
+
+        def publish(ctx):
+            with cls.lock:
+                if cls.failures > 0:
+                    cls.failures -= 1
+                    raise TransientError("rate limit", retry_seconds=0.5)
+            ctx["result"] = cls._publish("image", ctx["image_path"])
+            return ctx
+        return [("prepare", prepare, 1), ("publish", publish, 2)]
+
+    @classmethod
+    def _cleanup_staged(cls, staged):
+        pass
+
+    @classmethod
+    def stage_instagram(cls, image_path, caption, inputs=None):
+        with cls.lock:
+            cls.calls.append(("stage", image_path))
+        return {"content_type": "image", "container_id": "container-1", "staged_at": time.time()}
+
+    @classmethod
+    def publish_staged(cls, staged):
+        return cls._publish("publish", staged["container_id"])
+
+
+def _install_fake_sender():
+    module = types.ModuleType("src.services.instagram_send")
+    module.InstagramSend = FakeInstagramSend
+    sys.modules["src.services.instagram_send"] = module
+    FakeInstagramSend.calls = []
+    FakeInstagramSend.prepared = 0
+    FakeInstagramSend.failures = 0
+
+
+def _media_file(suffix):
+    handle, path = tempfile.mkstemp(suffix=suffix)
+    os.close(handle)
+    return path
+
+
+def _job_store():
+    return JobStore(os.path.join(tempfile.mkdtemp(), "post_queue.db"))
+
+
+def _wait_for(queue, job_ids, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        statuses = [queue.get_job_status(job_id).get("status") for job_id in job_ids]
+        if all(status not in ("pending", "processing", "delayed") for status in statuses):
+            return statuses
+        time.sleep(0.05)
+    raise AssertionError(f"Jobs não finalizaram a tempo: {statuses}")
+
+
+def test_jobs_are_routed_to_content_type_pools():
+    _install_fake_sender()
+    queue = PostQueue(pool_sizes={"image": 2, "reel": 1, "carousel": 1}, job_store=_job_store())
+    try:
+        image_job = queue.add_job(_media_file(".png"), "foto")
+        reel_job = queue.add_job(_media_file(".mp4"), "video")
+        carousel_job = queue.add_job([_media_file(".png"), _media_file(".png")], "carrossel")
+
+        assert _wait_for(queue, [image_job, reel_job, carousel_job]) == ["completed"] * 3
+        assert {kind for kind, _ in FakeInstagramSend.calls} == {"image", "reel", "carousel"}
+
+        stats = queue.get_queue_stats()
+        assert stats["completed_jobs"] == 3
+        assert stats["pools"]["image"]["workers"] == 2
+        for name in ("image", "reel", "carousel"):
+            assert stats["pools"][name]["completed_jobs"] == 1
+    finally:
+        queue.stop_worker()
+
+
+def test_slow_reel_does_not_block_images():
+    _install_fake_sender()
+    queue = PostQueue(pool_sizes={"image": 2, "reel": 1, "carousel": 1}, job_store=_job_store())
+    try:
+        FakeInstagramSend.delay = 0.5
+        reel_job = queue.add_job(_media_file(".mp4"), "video")
+        image_jobs = [queue.add_job(_media_file(".png"), "foto") for _ in range(2)]
+
+        # As duas imagens rodam em paralelo no pool de imagens enquanto o reel
+        # ocupa o seu próprio pool
+        start = time.time()
+        _wait_for(queue, image_jobs + [reel_job])
+        assert time.time() - start < 1.0
+    finally:
+        FakeInstagramSend.delay = 0.0
+        queue.stop_worker()
+
+
+def test_unfinished_jobs_are_recovered_after_restart():
+    _install_fake_sender()
+    store = _job_store()
+    media = _media_file(".png")
+    job = {
+        "id": "job-interrompido",
+        "media_paths": [media],
+        "caption": "foto",
+        "inputs": {},
+        "status": "processing",
+        "created_at": time.time(),
+        "updated_at": time.time(),
+        "result": None,
+        "error": None,
+        "content_type": "image"
+    }
+    store.save_job(job)
+    store.save_job(dict(job, id="job-finalizado", status="completed"))
+
+    queue = PostQueue(job_store=store)
+    try:
+        assert _wait_for(queue, ["job-interrompido"]) == ["completed"]
+        assert [call[1] for call in FakeInstagramSend.calls] == [media]
+        statuses = [event["status"] for event in store.get_events("job-interrompido")]
+        assert statuses == ["processing", "pending", "processing", "completed"]
+    finally:
+        queue.stop_worker()
+
+
+def test_scheduled_job_is_staged_ahead_and_published_at_slot():
+    _install_fake_sender()
+    store = _job_store()
+    queue = PostQueue(job_store=store)
+    try:
+        publish_at = time.time() + 0.5
+        job_id = queue.add_job(_media_file(".png"), "foto", publish_at=publish_at)
+
+        # O container é preparado imediatamente (dentro da antecedência) e
+        # apenas a publicação aguarda o horário agendado
+        deadline = time.time() + 5
+        while queue.get_job_status(job_id)["status"] != "completed" and time.time() < deadline:
+            time.sleep(0.05)
+        assert queue.get_job_status(job_id)["status"] == "completed"
+        assert [call[0] for call in FakeInstagramSend.calls] == ["stage", "publish"]
+        assert queue.get_job_status(job_id)["updated_at"] >= publish_at
+
+        statuses = [event["status"] for event in store.get_events(job_id)]
+        assert statuses == ["pending", "processing", "staged", "pending", "processing", "completed"]
+    finally:
+        queue.stop_worker()
+
+
+def test_scheduled_publishes_run_in_the_pool_not_in_the_scheduler():
+    _install_fake_sender()
+    FakeInstagramSend.delay = 1.5
+    queue = PostQueue(pool_sizes={"image": 2}, job_store=_job_store())
+    try:
+        # Publicações lentas no mesmo horário: cada uma ocupa um worker, nenhuma trava o agendador
+        start = time.time()
+        job_ids = [queue.add_job(_media_file(".png"), "foto", publish_at=start + 0.5 + index * 0.1)
+                   for index in range(2)]
+        deadline = time.time() + 10
+        while (any(queue.get_job_status(job_id)["status"] != "completed" for job_id in job_ids)
+               and time.time() < deadline):
+            time.sleep(0.05)
+        assert all(queue.get_job_status(job_id)["status"] == "completed" for job_id in job_ids)
+        assert time.time() - start < 3.0
+        assert [call[0] for call in FakeInstagramSend.calls].count("publish") == 2
+    finally:
+        FakeInstagramSend.delay = 0.0
+        queue.stop_worker()
+
+
+def test_rate_governor_tracks_usage_headers_and_publish_quota():
+    governor = RateGovernor(publish_quota=2)
+    governor.record_headers({
+        "x-app-usage": '{"call_count": 10, "total_cputime": 5, "total_time": 5}',
+        "x-business-use-case-usage": '{"123": [{"type": "instagram", "call_count": 95, '
+                                     '"total_cputime": 10, "total_time": 10, "estimated_time_to_regain_access": 0}]}'
+    })
+    # Conta acima do limiar de uso: despacho adiado; outras contas seguem livres
+    assert governor.wait_time("123") > 0
+    assert governor.acquire("456", publish=True) == 0
+    assert governor.acquire("456", publish=True) == 0
+    assert governor.acquire("456", publish=True) > 0
+
+    governor.record_headers({
+        "x-business-use-case-usage": '{"789": [{"call_count": 100, "estimated_time_to_regain_access": 5}]}'
+    })
+    assert 290 < governor.blocked_time("789") <= 300
+
+
+def test_failed_publish_gives_back_its_publish_token():
+    governor = RateGovernor(publish_quota=2)
+    assert governor.acquire("123", publish=True) == 0
+    governor.release("123")
+    assert governor.snapshot()["publish_tokens"]["account:123"] == 2
+
+    _install_fake_sender()
+    queue = PostQueue(job_store=_job_store())
+
+    def publish_tokens():
+        return rate_governor.snapshot()["publish_tokens"].get("account:default", rate_governor.publish_quota)
+
+    def reject_reel(video_path, caption, inputs=None):
+        raise ValueError("mídia recusada")
+
+    original = FakeInstagramSend.__dict__["send_reels"]
+    try:
+        before = publish_tokens()
+        FakeInstagramSend.send_reels = staticmethod(reject_reel)
+        failed_job = queue.add_job(_media_file(".mp4"), "reel", {"content_type": "video"})
+        assert _wait_for(queue, [failed_job]) == ["failed"]
+        # Falha definitiva: a cota de 24h fica intacta
+        assert abs(publish_tokens() - before) < 0.05
+
+        # Falha temporária seguida de sucesso: apenas um token para o post publicado
+        FakeInstagramSend.failures = 1
+        retried_job = queue.add_job(_media_file(".png"), "foto")
+        assert _wait_for(queue, [retried_job]) == ["completed"]
+        assert queue.get_job_status(retried_job)["attempts"] == 1
+        assert abs(publish_tokens() - (before - 1)) < 0.05
+    finally:
+        FakeInstagramSend.send_reels = original
+        queue.stop_worker()
+
+
+def test_jobs_wait_for_rate_limit_block():
+    _install_fake_sender()
+    queue = PostQueue(job_store=_job_store())
+    try:
+        rate_governor.record_rate_limit(0.5, error_code=4)
+        start = time.time()
+        job_id = queue.add_job(_media_file(".png"), "foto")
+        assert _wait_for(queue, [job_id]) == ["completed"]
+        assert time.time() - start >= 0.4
+    finally:
+        queue.stop_worker()
+
+
+def test_job_registry_indexes_status_and_history():
+    registry = JobRegistry(max_history=2)
+    for i in range(3):
+        registry.add({"id": f"job-{i}", "status": "pending", "updated_at": time.time()})
+    registry.update("job-0", status="processing")
+    assert registry.count("pending") == 2
+    assert registry.ids_with_status("processing") == {"job-0"}
+
+    # Leitores recebem snapshots: alterar a cópia não afeta o registro
+    snapshot = registry.get("job-1")
+    snapshot["status"] = "alterado"
+    assert registry.get("job-1")["status"] == "pending"
+
+    for i in range(3):
+        registry.update(f"job-{i}", status="completed", updated_at=0)
+        registry.add_to_history(f"job-{i}")
+    assert [job["id"] for job in registry.history(10)] == ["job-2", "job-1"]
+
+    assert registry.remove_finished_older_than(60) == ["job-0", "job-1", "job-2"]
+    assert len(registry) == 0
+    assert registry.get("job-0") is None
+    assert registry.get("job-2")["status"] == "completed"
+
+
+def test_pipeline_overlaps_stages_of_different_jobs():
+    def slow_stage(name):
+        def run(ctx):
+            time.sleep(0.2)
+            ctx["stages"].append(name)
+            return ctx
+        return run
+
+    pipeline = PublishPipeline("Teste", [("caption", slow_stage("caption"), 1), ("wait", slow_stage("wait"), 1)])
+    pipeline.start()
+    try:
+        done = []
+        finished = threading.Event()
+
+        def on_done(ctx, error):
+            done.append(ctx)
+            if len(done) == 4:
+                finished.set()
+
+        start = time.time()
+        for _ in range(4):
+            pipeline.submit({"stages": []}, on_done)
+        assert finished.wait(5)
+        # Em série seriam 1.6s; com as etapas sobrepostas, ~1.0s
+        assert time.time() - start < 1.4
+        assert all(ctx["stages"] == ["caption", "wait"] for ctx in done)
+        assert pipeline.get_stats()["wait"]["processed"] == 4
+    finally:
+        pipeline.stop()
+
+
+def test_subscribers_receive_every_transition_without_polling():
+    _install_fake_sender()
+    queue = PostQueue(job_store=_job_store())
+    try:
+        transitions = []
+        notified = []
+        all_done = threading.Event()
+        queue.subscribe(lambda job_id, job: transitions.append((job_id, job["status"])))
+
+        def notify(job_id, job):
+            notified.append(job_id)
+            if len(notified) == 30:
+                all_done.set()
+
+        notifier = PostCompletionNotifier(notify)
+        notifier.start_monitoring(queue)
+
+        # Mais de 20 trabalhos concluídos de uma vez: nenhum pode ser perdido
+        job_ids = [queue.add_job(_media_file(".png"), "foto") for _ in range(30)]
+        assert all_done.wait(10)
+        assert sorted(notified) == sorted(job_ids)
+        first = [status for job_id, status in transitions if job_id == job_ids[0]]
+        assert first == ["pending", "processing", "completed"]
+        notifier.stop_monitoring()
+    finally:
+        queue.stop_worker()
+
+
+def test_job_dedup_collapses_repeated_deliveries_within_window():
+    dedup = JobDeduplicator(window=0.3, max_entries=3)
+    keys = dedup.keys_for(b"foto", "msg-1")
+    dedup.remember("job-1", keys)
+
+    # Mesma mensagem (retentativa do webhook) ou mesma mídia em outra mensagem
+    assert dedup.lookup(dedup.keys_for(b"outra", "msg-1")) == "job-1"
+    assert dedup.lookup(dedup.keys_for(b"foto", "msg-2")) == "job-1"
+    assert dedup.lookup(dedup.keys_for(b"outra", "msg-2")) is None
+
+    # Memória limitada: as chaves mais antigas são descartadas
+    dedup.remember("job-2", dedup.keys_for(b"b", "msg-3"))
+    assert len(dedup) == 3
+    time.sleep(0.35)
+    assert dedup.lookup(keys) is None
+
+
+def test_external_mode_hands_jobs_to_worker_processes():
+    _install_fake_sender()
+    db_path = os.path.join(tempfile.mkdtemp(), "post_queue.db")
+    producer = PostQueue(job_store=JobStore(db_path), mode="external")
+    # Cada processo worker abre sua própria conexão com o banco compartilhado
+    workers = [PostQueue(job_store=JobStore(db_path), mode="worker") for _ in range(2)]
+    try:
+        completed = []
+        producer.subscribe(lambda job_id, job: completed.append(job_id), statuses={"completed"})
+        job_ids = [producer.add_job(_media_file(".png"), "foto") for _ in range(4)]
+        job_ids.append(producer.add_job(_media_file(".mp4"), "video"))
+
+        assert _wait_for(producer, job_ids) == ["completed"] * 5
+        deadline = time.time() + 5
+        while len(completed) < 5 and time.time() < deadline:
+            time.sleep(0.05)
+        assert sorted(completed) == sorted(job_ids)
+        # Cada trabalho foi executado exatamente uma vez
+        assert len(FakeInstagramSend.calls) == 5
+        assert producer.get_queue_stats()["completed_jobs"] == 5
+    finally:
+        for queue in workers + [producer]:
+            queue.stop_worker()
+
+
+def test_worker_claims_rotate_accounts_and_share_the_publish_quota():
+    db_path = os.path.join(tempfile.mkdtemp(), "post_queue.db")
+    stores = [JobStore(db_path), JobStore(db_path)]
+    now = time.time()
+    for index, (job_id, account) in enumerate([("a0", "acct-a"), ("a1", "acct-a"), ("a2", "acct-a"),
+                                               ("b0", "acct-b"), ("c0", None)]):
+        stores[0].save_job({"id": job_id, "status": "pending", "pool": "image", "inputs": {"account_id": account},
+                            "created_at": now + index, "updated_at": now + index})
+
+    # Dois processos worker alternados seguem um único rodízio entre as contas
+    claimed = [stores[index % 2].claim_next("image", f"worker-{index % 2}")["id"] for index in range(5)]
+    assert claimed == ["c0", "a0", "b0", "a1", "a2"]
+    assert stores[1].claim_next("image", "worker-1") is None
+
+    # A cota de publicação de cada conta é uma só para todos os processos
+    governors = [RateGovernor(publish_quota=2), RateGovernor(publish_quota=2)]
+    for governor, store in zip(governors, stores):
+        governor.share_publish_budget(store)
+    assert governors[0].acquire("123", publish=True) == 0
+    assert governors[1].acquire("123", publish=True) == 0
+    assert governors[0].acquire("123", publish=True) > 0
+    assert governors[1].acquire("456", publish=True) == 0
+    governors[1].release("123")
+    assert governors[0].acquire("123", publish=True) == 0
+    assert governors[0].snapshot()["publish_budget"] == "shared"
+
+
+def test_transient_failure_parks_job_without_blocking_worker():
+    _install_fake_sender()
+    queue = PostQueue(pool_sizes={"image": 1}, job_store=_job_store())
+    try:
+        statuses = []
+        queue.subscribe(lambda job_id, job: statuses.append((job_id, job["status"])))
+        FakeInstagramSend.failures = 1
+        delayed_job = queue.add_job(_media_file(".png"), "foto")
+        deadline = time.time() + 5
+        while queue.get_job_status(delayed_job)["status"] != "delayed" and time.time() < deadline:
+            time.sleep(0.01)
+
+        # Com o trabalho estacionado, o único worker atende o próximo imediatamente
+        other_job = queue.add_job(_media_file(".png"), "foto")
+        assert _wait_for(queue, [other_job]) == ["completed"]
+        assert queue.get_job_status(delayed_job)["status"] == "delayed"
+
+        assert _wait_for(queue, [delayed_job]) == ["completed"]
+        job = queue.get_job_status(delayed_job)
+        assert job["attempts"] == 1 and "rate limit" in job["last_error"]
+        deadline = time.time() + 5
+        while (delayed_job, "completed") not in statuses and time.time() < deadline:
+            time.sleep(0.01)
+        assert [status for job_id, status in statuses if job_id == delayed_job] == [
+            "pending", "processing", "delayed", "pending", "processing", "completed"
+        ]
+        # A nova tentativa retoma na etapa que falhou, sem repetir as anteriores
+        assert FakeInstagramSend.prepared == 2
+    finally:
+        queue.stop_worker()
+
+
+def test_admission_limits_depth_bytes_and_sender_in_flight():
+    _install_fake_sender()
+    queue = PostQueue(job_store=_job_store())
+    controller = AdmissionController(max_depth=10, max_bytes=1000, max_per_sender=2, retry_after=30)
+    controller.start(queue)
+    try:
+        first = controller.admit("a", 400)
+        controller.admit("a", 100)
+        try:
+            controller.admit("a", 100)
+            raise AssertionError("terceiro trabalho do remetente deveria ser recusado")
+        except AdmissionRejected as e:
+            assert (e.status_code, e.retry_after, e.reason) == (429, 30, "sender_in_flight")
+        try:
+            controller.admit("b", 600)
+            raise AssertionError("limite de bytes deveria ser excedido")
+        except AdmissionRejected as e:
+            assert (e.status_code, e.reason) == (503, "pending_bytes")
+
+        # A reserva é liberada quando o trabalho associado termina
+        FakeInstagramSend.delay = 0.2
+        job_id = queue.add_job(_media_file(".png"), "foto")
+        controller.bind(job_id, first)
+        assert _wait_for(queue, [job_id]) == ["completed"]
+        deadline = time.time() + 5
+        while controller.get_stats()["pending_bytes"] != 100 and time.time() < deadline:
+            time.sleep(0.01)
+        stats = controller.get_stats()
+        assert stats["pending_bytes"] == 100 and stats["senders_in_flight"] == {"a": 1}
+        assert stats["rejected_by_reason"] == {"sender_in_flight": 1, "pending_bytes": 1}
+        assert AdmissionController.estimate_size("data:image/png;base64," + "A" * 8) == 6
+    finally:
+        FakeInstagramSend.delay = 0.0
+        queue.stop_worker()
+
+
+def test_graph_simulator_processes_containers_and_rate_limits():
+    import json
+    import urllib.error
+    import urllib.parse
+    import urllib.request
+
+    simulator = GraphSimulator(seed=7, image_delay=(0.2, 0.2), calls_per_window=6, window=60)
+    server = simulator.serve()
+    base_url = f"http://127.0.0.1:{server.server_port}/v22.0"
+
+    def call(method, path, params):
+        query = urllib.parse.urlencode(params)
+        if method == "GET":
+            request = urllib.request.Request(f"{base_url}/{path}?{query}")
+        else:
+            request = urllib.request.Request(f"{base_url}/{path}", data=query.encode(), method="POST")
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.loads(response.read()), response.headers
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read()), e.headers
+
+    try:
+        status, body, headers = call("POST", "123/media", {"image_url": "https://example.com/a.jpg"})
+        container_id = body["id"]
+        assert status == 200 and json.loads(headers["x-app-usage"])["call_count"] == 16
+
+        _, body, _ = call("GET", "", {"ids": container_id, "fields": "status_code"})
+        assert body[container_id]["status_code"] == "IN_PROGRESS"
+        status, body, _ = call("POST", "123/media_publish", {"creation_id": container_id})
+        assert status == 400 and body["error"]["code"] == 9007
+
+        time.sleep(0.25)
+        _, body, _ = call("POST", "123/media_publish", {"creation_id": container_id})
+        _, body, _ = call("GET", body["id"], {"fields": "permalink"})
+        assert body["permalink"].startswith("https://www.instagram.com/p/")
+
+        # Budget of 6 calls per window: the next calls are rate limited
+        call("GET", container_id, {"fields": "status_code"})
+        call("GET", container_id, {"fields": "status_code"})
+        status, body, headers = call("GET", container_id, {"fields": "status_code"})
+        assert status == 400 and body["error"]["code"] == 17
+        usage = json.loads(headers["x-business-use-case-usage"])["123"][0]
+        assert usage["call_count"] == 100 and usage["estimated_time_to_regain_access"] >= 1
+        assert simulator.get_stats()["published"] == 1
+    finally:
+        server.shutdown()
+
+
+def test_instrumentation_groups_endpoints_and_redacts_hook_params():
+    metrics = Instrumentation()
+    events = []
+    metrics.add_hook(events.append)
+
+    metrics.record_request("POST", "17841400000000001/media", 0.3, status=200, bytes_out=120, bytes_in=25,
+                           params={"caption": "segredo", "access_token": "abc", "image_url": "https://x/a.jpg"})
+    metrics.record_request("POST", "17841400000000002/media", 2.0, status=400, retries=1,
+                           error=type("RateLimitError", (Exception,), {})())
+    metrics.record_sleep("pacing", 0.5)
+
+    snapshot = metrics.get_metrics()
+    endpoint = snapshot["endpoints"]["POST {id}/media"]
+    assert endpoint["latency"]["count"] == 2 and endpoint["latency"]["p50"] == 0.5
+    assert endpoint["rate_limit_hits"] == 1 and endpoint["retries"] == 1
+    assert snapshot["totals"]["bytes_out"] == 120 and snapshot["errors"] == {"RateLimitError": 1}
+    assert snapshot["sleeps"]["pacing"] == {"count": 1, "seconds": 0.5}
+    assert events[0]["params"] == {"caption": "<7 chars>", "access_token": "***", "image_url": "https://x/a.jpg"}
+    assert [event["type"] for event in events] == ["request", "request", "sleep"]
+    assert redact({"input_token": "t"}) == {"input_token": "***"}
+
+
+def test_request_pacer_allows_bursts_then_spaces_requests_per_account():
+    now = [100.0]
+    pacer = RequestPacer(rate=2, burst=3, clock=lambda: now[0])
+
+    # Conta ociosa: até `burst` requisições seguidas, depois uma a cada 1/rate segundos
+    waits = [pacer.reserve("graph", "acct-a") for _ in range(6)]
+    assert waits == [0, 0, 0, 0.5, 1.0, 1.5]
+
+    # Outras contas e outros hosts têm agendas próprias
+    assert pacer.reserve("graph", "acct-b") == 0
+    assert pacer.reserve("video", "acct-a") == 0
+
+    # Ritmo sustentado: chamadas a cada 1/rate segundos nunca esperam
+    now[0] = 200.0
+    for _ in range(10):
+        assert pacer.reserve("graph", "acct-c") == 0
+        now[0] += 0.5
+    # Seguir o ritmo não consome o burst
+    assert [pacer.reserve("graph", "acct-c") for _ in range(4)] == [0, 0, 0, 0.5]
+
+    # Após um período ocioso o burst volta por inteiro
+    now[0] = 300.0
+    assert [pacer.reserve("graph", "acct-a") for _ in range(4)] == [0, 0, 0, 0.5]
+
+    stats = pacer.get_stats()
+    assert stats["requests"] == 26 and stats["delayed"] == 5 and stats["max_wait"] == 1.5
+    assert stats["accounts"] == 4
+
+
+def test_processing_times_schedule_checks_at_learned_percentiles():
+    state_file = os.path.join(tempfile.mkdtemp(), "processing_times.json")
+    model = ProcessingTimeModel(state_file)
+    assert ProcessingTimeModel.size_class(None) == "*"
+    assert ProcessingTimeModel.size_class(500 * 1024) == "0" and ProcessingTimeModel.size_class(3 * 1024 * 1024) == "2"
+
+    # Sem amostras suficientes: o poller usa o backoff padrão
+    for seconds in range(1, 5):
+        model.record("IMAGE", None, seconds)
+    assert model.next_check_in("IMAGE", None, 0) is None
+
+    for seconds in range(5, 11):
+        model.record("IMAGE", None, seconds)
+    assert model.percentiles("IMAGE") == [6, 8, 10, 10, 10]
+    # Tamanho sem dados próprios usa todas as amostras do tipo de mídia
+    assert model.percentiles("IMAGE", 3 * 1024 * 1024) == [6, 8, 10, 10, 10]
+    assert model.next_check_in("IMAGE", None, 0) == 6
+    assert model.next_check_in("IMAGE", None, 6) == 2
+    assert model.next_check_in("IMAGE", None, 7.5) == ProcessingTimeModel.MIN_INTERVAL
+    # Mais lento que o p99: verificações em ritmo constante
+    assert model.next_check_in("IMAGE", None, 30) == 2
+    assert model.next_check_in("REELS", None, 0) is None
+
+    # As amostras sobrevivem a um reinício
+    model._save()
+    assert ProcessingTimeModel(state_file).percentiles("IMAGE") == [6, 8, 10, 10, 10]
+    with open(state_file, "w") as f:
+        f.write("{corrompido")
+    assert ProcessingTimeModel(state_file).percentiles("IMAGE") is None
+
+
+def test_state_store_journals_changes_and_compacts_snapshots():
+    path = os.path.join(tempfile.mkdtemp(), "api_state.json")
+    store = StateStore(path)
+    store.increment("successful_posts")
+    store.put_pending("c1", {"container_id": "c1", "retry_count": 1})
+    store.update_pending("c1", retry_count=2)
+    store.put_pending("c2", {"container_id": "c2"})
+    store.remove_pending("c2")
+    assert store.get_pending() == {"c1": {"container_id": "c1", "retry_count": 2}}
+    assert not os.path.exists(path)
+
+    store.flush()
+    with open(store.journal_path) as f:
+        assert len(f.readlines()) == 5
+    with open(store.journal_path, "a") as f:
+        f.write('{"op": "increment", "stat": "failed')  # Linha interrompida por uma queda
+
+    reloaded = StateStore(path)
+    assert reloaded.get_stats()["successful_posts"] == 1 and reloaded.get_stats()["failed_posts"] == 0
+    assert reloaded.get_pending()["c1"]["retry_count"] == 2
+
+    reloaded.COMPACT_EVERY = 6
+    reloaded.increment("failed_posts")
+    reloaded.flush()
+    with open(path) as f:
+        import json
+        snapshot = json.load(f)
+    assert snapshot["stats"]["failed_posts"] == 1 and list(snapshot["pending_containers"]) == ["c1"]
+    assert os.path.getsize(reloaded.journal_path) == 0
+
+
+def test_state_store_is_shared_by_several_processes():
+    path = os.path.join(tempfile.mkdtemp(), "api_state.json")
+    # Duas instâncias sobre os mesmos arquivos, como o webhook e um processo worker
+    webhook, worker = StateStore(path), StateStore(path)
+    webhook.COMPACT_EVERY = worker.COMPACT_EVERY = 4
+
+    worker.increment("successful_posts")
+    worker.put_pending("c1", {"container_id": "c1"})
+    worker.flush()
+    webhook.increment("failed_posts")
+    webhook.flush()
+    # O monitor, no processo do webhook, vê os posts feitos pelo worker
+    assert webhook.get_stats()["successful_posts"] == 1 and "c1" in webhook.get_pending()
+
+    # O worker compacta sem perder a linha do webhook; o webhook recarrega o snapshot
+    worker.increment("successful_posts")
+    worker.flush()
+    assert os.path.getsize(worker.journal_path) == 0
+    webhook.remove_pending("c1")
+    webhook.flush()
+    worker.flush()
+    for store in (webhook, worker, StateStore(path)):
+        stats = store.get_stats()
+        assert stats["successful_posts"] == 2 and stats["failed_posts"] == 1
+        assert store.get_pending() == {}
+
+
+def test_pending_publisher_publishes_due_containers_in_order():
+    store = StateStore(os.path.join(tempfile.mkdtemp(), "api_state.json"))
+    now = time.time()
+    store.put_pending("late", {"container_id": "late", "ig_user_id": "acct-pending", "next_attempt_time": now + 0.3})
+    store.put_pending("early", {"container_id": "early", "ig_user_id": "acct-pending", "next_attempt_time": now - 1})
+    published, events = [], []
+    done = threading.Event()
+
+    class FakePostService:
+        ig_user_id = "acct-pending"
+        failures = 1  # A primeira tentativa de "late" encontra um rate limit
+
+        def check_container_status(self, container_id):
+            return "FINISHED"
+
+        def publish_media(self, container_id, save_pending=True):
+            assert save_pending is False
+            if container_id == "late" and self.failures:
+                self.failures -= 1
+                raise TransientError("rate limit", retry_seconds=0.2)
+            published.append(container_id)
+            store.remove_pending(container_id)
+            return f"post-{container_id}"
+
+        def get_post_permalink(self, post_id):
+            return f"https://instagram.com/p/{post_id}"
+
+    def on_event(container_id, event):
+        events.append((container_id, event["status"], event.get("permalink")))
+        if len(events) == 2:
+            done.set()
+
+    publisher = PendingPublisher(store)
+    publisher.subscribe(on_event)
+    # Registrar o serviço não faz chamadas: os containers são publicados pela thread
+    publisher.register(FakePostService())
+    assert done.wait(5)
+    assert published == ["early", "late"]
+    assert events[1] == ("late", "published", "https://instagram.com/p/post-late")
+    assert store.get_pending() == {}
+    stats = publisher.get_stats()
+    assert stats["published"] == 2 and stats["rate_limited"] == 1 and stats["pending"] == 0
+
+
+def test_pending_container_is_published_by_one_process_only():
+    path = os.path.join(tempfile.mkdtemp(), "api_state.json")
+    webhook_store, worker_store = StateStore(path), StateStore(path)
+    worker_store.put_pending("c1", {"container_id": "c1", "ig_user_id": "acct-claim", "next_attempt_time": 0})
+    worker_store.flush()
+    webhook_store.flush()
+    published = []
+
+    class SlowPostService:
+        ig_user_id = "acct-claim"
+
+        def __init__(self, store):
+            self.store = store
+
+        def check_container_status(self, container_id):
+            return "FINISHED"
+
+        def publish_media(self, container_id, save_pending=True):
+            time.sleep(0.3)
+            published.append(container_id)
+            return f"post-{container_id}"
+
+        def get_post_permalink(self, post_id):
+            return None
+
+    # O webhook e um processo worker carregam o mesmo container pendente
+    publishers = [PendingPublisher(store, owner=name)
+                  for store, name in ((webhook_store, "webhook"), (worker_store, "worker"))]
+    for publisher in publishers:
+        publisher.register(SlowPostService(publisher.store))
+    deadline = time.time() + 5
+    while sum(publisher.get_stats()["published"] for publisher in publishers) < 1 and time.time() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.5)
+
+    # Apenas o processo que reivindicou publica; o outro aguarda o fim da reivindicação
+    assert published == ["c1"]
+    assert sorted(publisher.get_stats()["pending"] for publisher in publishers) == [0, 1]
+    for store in (webhook_store, worker_store):
+        store.flush()
+    assert webhook_store.get_pending() == {} and worker_store.get_pending() == {}
+
+
+def test_fair_queue_alternates_accounts_and_skips_blocked_ones():
+    blocked = {"acct-c"}
+    queue = FairQueue(wait_time=lambda account: 60 if account in blocked else 0)
+    for index in range(4):
+        queue.put(f"a{index}", "acct-a")
+    queue.put("b0", "acct-b")
+    queue.put("c0", "acct-c")
+
+    # A conta com muitos posts não passa na frente das demais; a bloqueada espera
+    order = [queue.get(timeout=1) for _ in range(5)]
+    assert order == ["a0", "b0", "a1", "a2", "a3"]
+    try:
+        queue.get(timeout=0.2)
+        assert False, "conta bloqueada não deveria ser atendida"
+    except Exception as e:
+        assert type(e).__name__ == "Empty"
+    assert queue.shard_sizes() == {"acct-c": 1}
+
+    blocked.clear()
+    assert queue.get(timeout=2) == "c0" and queue.empty()
+
+
+def test_account_directory_resolves_names_ids_and_groups():
+    directory = AccountDirectory(environ={
+        "INSTAGRAM_ACCOUNT_ID": "100",
+        "INSTAGRAM_API_KEY": "token-default",
+        "INSTAGRAM_ACCOUNTS": "marca_a, marca_b, incompleta",
+        "INSTAGRAM_MARCA_A_ACCOUNT_ID": "200",
+        "INSTAGRAM_MARCA_A_API_KEY": "token-a",
+        "INSTAGRAM_MARCA_A_GROUP": "grupo-a",
+        "INSTAGRAM_MARCA_B_ACCOUNT_ID": "300",
+        "INSTAGRAM_MARCA_B_API_KEY": "token-b",
+        "INSTAGRAM_INCOMPLETA_ACCOUNT_ID": "400"
+    })
+    assert directory.resolve()["access_token"] == "token-default"
+    assert directory.account_id("marca_a") == "200" and directory.account_id("300") == "300"
+    assert directory.resolve("marca_b")["access_token"] == "token-b"
+    assert directory.for_group("grupo-a") == "marca_a" and directory.for_group("outro") is None
+    assert directory.names() == {"default": "100", "marca_a": "200", "marca_b": "300"}
+    try:
+        directory.resolve("incompleta")
+        assert False, "conta sem credenciais não deveria ser aceita"
+    except ValueError:
+        pass
+
+
+class FakeTokenService:
+    """Serviço cujo debug_token é contado, para verificar o cache de introspecção"""
+    constructed = 0
+
+    def __init__(self, access_token=None, ig_user_id=None, expires_in=3600, delay=0.0):
+        FakeTokenService.constructed += 1
+        self.access_token = access_token
+        self.ig_user_id = ig_user_id
+        self.expires_in = expires_in
+        self.delay = delay
+        self.calls = 0
+
+    def _make_request(self, method, endpoint, params=None, data=None, headers=None, retry_attempt=0):
+        self.calls += 1
+        time.sleep(self.delay)
+        return {"data": {"is_valid": True, "expires_at": int(time.time() + self.expires_in),
+                         "check": self.calls}}
+
+
+def test_token_cache_reuses_answers_until_ttl_expiry_or_invalidation():
+    cache = TokenCache(ttl=60)
+    service = FakeTokenService("token-a", delay=0.1)
+
+    # Chamadas simultâneas com o cache frio fazem uma única introspecção
+    threads = [threading.Thread(target=cache.introspect, args=(service,)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert service.calls == 1
+    service.delay = 0
+    assert cache.introspect(service)["data"]["check"] == 1 and service.calls == 1
+
+    # force e invalidate ignoram a entrada
+    assert cache.introspect(service, force=True)["data"]["check"] == 2
+    cache.invalidate("token-a")
+    assert cache.introspect(service)["data"]["check"] == 3
+
+    # Um token trocado nunca recebe a resposta do anterior
+    rotated = FakeTokenService("token-b")
+    assert cache.introspect(rotated)["data"]["check"] == 1 and rotated.calls == 1
+
+    # Perto do fim do TTL a resposta em cache é devolvida e renovada em segundo plano
+    key = service_registry_module.token_hash("token-a")
+    with cache._lock:
+        cache._entries[key]["checked_at"] -= 55
+    assert cache.introspect(service)["data"]["check"] == 3
+    deadline = time.time() + 5
+    while cache.get_stats()["background_refreshes"] < 1 and time.time() < deadline:
+        time.sleep(0.01)
+    assert service.calls == 4 and cache.introspect(service)["data"]["check"] == 4
+
+    # Depois do TTL, ou com o token perto de expirar, a introspecção é refeita
+    with cache._lock:
+        cache._entries[key]["valid_until"] = time.time() - 1
+    assert cache.introspect(service)["data"]["check"] == 5
+    expiring = FakeTokenService("token-c", expires_in=30)
+    cache.introspect(expiring)
+    cache.introspect(expiring)
+    assert expiring.calls == 2
+
+
+def test_service_registry_shares_one_instance_per_class_token_and_account():
+    registry = ServiceRegistry()
+    FakeTokenService.constructed = 0
+    original = service_registry_module.accounts
+    service_registry_module.accounts = AccountDirectory(environ={
+        "INSTAGRAM_ACCOUNT_ID": "100",
+        "INSTAGRAM_API_KEY": "token-default",
+        "INSTAGRAM_ACCOUNTS": "marca_a",
+        "INSTAGRAM_MARCA_A_ACCOUNT_ID": "200",
+        "INSTAGRAM_MARCA_A_API_KEY": "token-a"
+    })
+    try:
+        service = registry.for_account(FakeTokenService, "marca_a")
+        assert (service.access_token, service.ig_user_id) == ("token-a", "200")
+        # Nome ou ID da conta levam à mesma instância, construída uma única vez
+        assert registry.for_account(FakeTokenService, "200") is service
+        assert registry.get(FakeTokenService, "token-a", "200") is service
+        default = registry.for_account(FakeTokenService)
+        assert default is not service and default.access_token == "token-default"
+        assert FakeTokenService.constructed == 2
+        assert registry.get_stats() == {"FakeTokenService": 2}
+
+        # Após invalidate (ex.: token trocado) uma nova instância é construída
+        registry.invalidate(FakeTokenService)
+        assert registry.for_account(FakeTokenService, "marca_a") is not service
+        assert FakeTokenService.constructed == 3
+    finally:
+        service_registry_module.accounts = original
+
+
+def test_local_media_host_serves_signed_ranges_until_deleted():
+    import urllib.request
+    import urllib.error
+
+    path = os.path.join(tempfile.mkdtemp(), "imagem final.jpg")
+    with open(path, "wb") as f:
+        f.write(bytes(range(256)) * 4)
+    db_path = os.path.join(tempfile.mkdtemp(), "post_queue.db")
+    host = LocalMediaHost(bind="127.0.0.1", port=0, secret="segredo", ttl=60, db_path=db_path)
+    try:
+        published = host.publish(path)
+        url = published["url"]
+
+        response = urllib.request.urlopen(url, timeout=5)
+        assert response.status == 200 and len(response.read()) == 1024
+        assert response.headers["Content-Type"] == "image/jpeg"
+
+        request = urllib.request.Request(url, headers={"Range": "bytes=10-19"})
+        response = urllib.request.urlopen(request, timeout=5)
+        assert response.status == 206 and response.read() == bytes(range(10, 20))
+        assert response.headers["Content-Range"] == "bytes 10-19/1024"
+
+        def status_of(target, headers=None):
+            try:
+                return urllib.request.urlopen(urllib.request.Request(target, headers=headers or {}), timeout=5).status
+            except urllib.error.HTTPError as e:
+                return e.code
+
+        # Assinatura adulterada, prazo estendido e intervalo fora do arquivo
+        assert status_of(url[:-1] + ("0" if url[-1] != "0" else "1")) == 403
+        assert status_of(url.replace(f"expires={url.split('expires=')[1].split('&')[0]}", "expires=9999999999")) == 403
+        assert status_of(url, {"Range": "bytes=5000-"}) == 416
+
+        host.delete(published["deletehash"])
+        assert status_of(url) == 404
+        stats = host.get_stats()
+        assert stats["bytes_served"] == 1034 and stats["range_requests"] == 1 and stats["serving"] == 0
+
+        # Processo worker: não abre a porta, registra no banco compartilhado e o servidor entrega
+        worker = LocalMediaHost(base_url=host.base_url, port=host.port, secret="segredo", ttl=60,
+                                db_path=db_path, serve=False)
+        from_worker = worker.publish(path)
+        assert worker._server is None
+        assert urllib.request.urlopen(from_worker["url"], timeout=5).status == 200
+        worker.delete(from_worker["deletehash"])
+        assert status_of(from_worker["url"]) == 404
+
+        # Com processos worker, o segredo precisa ser o mesmo em todos: sem ele, erro na criação
+        os.environ["POST_QUEUE_MODE"] = "worker"
+        try:
+            LocalMediaHost(db_path=db_path)
+            assert False, "MEDIA_HOST_SECRET deveria ser obrigatório com processos worker"
+        except ValueError:
+            pass
+        finally:
+            del os.environ["POST_QUEUE_MODE"]
+    finally:
+        host.stop()
+
+
+if __name__ == "__main__":
+    test_jobs_are_routed_to_content_type_pools()
+    test_slow_reel_does_not_block_images()
+    test_unfinished_jobs_are_recovered_after_restart()
+    test_scheduled_job_is_staged_ahead_and_published_at_slot()
+    test_scheduled_publishes_run_in_the_pool_not_in_the_scheduler()
+    test_rate_governor_tracks_usage_headers_and_publish_quota()
+    test_failed_publish_gives_back_its_publish_token()
+    test_jobs_wait_for_rate_limit_block()
+    test_job_registry_indexes_status_and_history()
+    test_pipeline_overlaps_stages_of_different_jobs()
+    test_subscribers_receive_every_transition_without_polling()
+    test_job_dedup_collapses_repeated_deliveries_within_window()
+    test_external_mode_hands_jobs_to_worker_processes()
+    test_worker_claims_rotate_accounts_and_share_the_publish_quota()
+    test_transient_failure_parks_job_without_blocking_worker()
+    test_admission_limits_depth_bytes_and_sender_in_flight()
+    test_graph_simulator_processes_containers_and_rate_limits()
+    test_instrumentation_groups_endpoints_and_redacts_hook_params()
+    test_request_pacer_allows_bursts_then_spaces_requests_per_account()
+    test_processing_times_schedule_checks_at_learned_percentiles()
+    test_state_store_journals_changes_and_compacts_snapshots()
+    test_state_store_is_shared_by_several_processes()
+    test_pending_publisher_publishes_due_containers_in_order()
+    test_pending_container_is_published_by_one_process_only()
+    test_fair_queue_alternates_accounts_and_skips_blocked_ones()
+    test_account_directory_resolves_names_ids_and_groups()
+    test_token_cache_reuses_answers_until_ttl_expiry_or_invalidation()
+    test_service_registry_shares_one_instance_per_class_token_and_account()
+    test_local_media_host_serves_signed_ranges_until_deleted()
+    print("OK")